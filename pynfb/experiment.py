@@ -1,5 +1,6 @@
 import os
 import platform
+import multiprocessing
 import re
 from datetime import datetime
 import logging
@@ -7,6 +8,7 @@ import random as r
 import numpy as np
 from PyQt5 import QtCore
 from itertools import zip_longest, chain
+from concurrent.futures import ProcessPoolExecutor
 import time
 
 from PyQt5.QtWidgets import QDesktopWidget
@@ -15,13 +17,15 @@ from pynfb.inlets.montage import Montage
 from pynfb.postprocessing.plot_all_fb_bars import plot_fb_dynamic
 from pynfb.widgets.channel_trouble import ChannelTroubleWarning
 from pynfb.widgets.helpers import WaitMessage
+from pynfb.widgets.bci_fit import BackgroundBCIFit
 from pynfb.outlets.signals_outlet import SignalsOutlet
-from .generators import run_eeg_sim, stream_file_in_a_thread, stream_generator_in_a_thread
+from pynfb.signal_processing.quality import ChannelQualityMonitor
+from .generators import stream_file_in_a_thread, stream_generator_in_a_thread
 from .inlets.ftbuffer_inlet import FieldTripBufferInlet
-from .inlets.lsl_inlet import LSLInlet
+from .inlets.lsl_inlet import LSLInlet, resolve_inlets, LSL_MAX_CHUNK_LEN
 from .inlets.channels_selector import ChannelsSelector
 from .serializers.hdf5 import save_h5py, load_h5py, save_signals, load_h5py_protocol_signals, save_xml_str_to_hdf5_dataset, \
-    save_channels_and_fs
+    save_channels_and_fs, HDF5StreamWriter, RecordersStreamer, get_storage_policies, ProtocolCache
 from .serializers.xml_ import params_to_xml_file, params_to_xml, get_lsl_info_from_xml
 from .serializers import read_spatial_filter
 from .protocols import BaselineProtocol, FeedbackProtocol, ThresholdBlinkFeedbackProtocol, VideoProtocol, \
@@ -30,7 +34,10 @@ from .protocols import BaselineProtocol, FeedbackProtocol, ThresholdBlinkFeedbac
     EyeCalibrationProtocolWidgetPainter, BaselineProtocolWidgetPainter, FixationCrossProtocolWidgetPainter, \
     PlotFeedbackWidgetPainter, BarFeedbackProtocolWidgetPainter, PosnerCueProtocol, PosnerCueProtocolWidgetPainter, \
     PosnerFeedbackProtocolWidgetPainter, ExperimentStartWidgetPainter, EyeTrackFeedbackProtocolWidgetPainter
-from .signals import DerivedSignal, CompositeSignal, BCISignal
+from .signals import DerivedSignal, CompositeSignal, BCISignal, SpatialFilterBank
+from .recorders import EventRecorder, SpillRecorder
+from .serializers.mock_source import MockSignalsSource
+from .protocols.ssd.ssd import CrossSpectrumAccumulator
 from .windows import MainWindow
 from ._titles import WAIT_BAR_MESSAGES
 import pandas as pd
@@ -38,6 +45,9 @@ import mne
 
 import pylink
 
+# max frequency of cross-spectra accumulated during protocols [Hz] (covers SSD sweep and CSP bands)
+CSD_MAX_FREQ = 60
+
 # helpers
 def int_or_none(string):
     return int(string) if len(string) > 0 else None
@@ -50,6 +60,10 @@ class Experiment():
         self.main_timer = None
         self.stream = None
         self.thread = None
+        self.writer = None
+        self.spill_recorders = []
+        self.mock_source = None
+        self.bci_executor = None
         self.catch_channels_trouble = True
         self.mock_signals_buffer = None
         self.activate_trouble_catching = False
@@ -333,15 +347,24 @@ class Experiment():
         chunk, other_chunk, timestamp = self.stream.get_next_chunk() if self.stream is not None else (None, None)
         if chunk is not None and self.main is not None:
 
-            # update and collect current samples
+            # update and collect current samples to reusable (chunk, n_signals) buffer
+            if chunk.shape[0] > self.signals_chunk_buffer.shape[0]:
+                self.signals_chunk_buffer = np.zeros((chunk.shape[0], len(self.signals)),
+                                                     dtype=self.signals_chunk_buffer.dtype)
+            sample = self.signals_chunk_buffer[:chunk.shape[0]]
+            # derived signals are spatially filtered by one matrix product, then all signals are updated in order
+            self.spatial_filter_bank.update(chunk)
             for i, signal in enumerate(self.signals):
-                signal.update(chunk)
-                # self.current_samples[i] = signal.current_sample
+                if not isinstance(signal, DerivedSignal):
+                    signal.update(chunk)
+                sample[:, i] = signal.current_chunk
 
             # push current samples
-            sample = np.vstack([np.array(signal.current_chunk) for signal in self.signals]).T.tolist()
             self.signals_outlet.push_chunk(sample)
 
+            # channels quality (updated by each chunk, recording is not required)
+            self.update_channels_quality(chunk[:, :self.n_channels])
+
             # record data
             if self.main.player_panel.start.isChecked():
                 if self.samples_counter == 0:
@@ -357,39 +380,20 @@ class Experiment():
                     # ------------------------------------------------------------------------------
                 if self.params['bShowSubjectWindow']:
                     self.subject.figure.update_reward(self.reward.get_score())
-                if self.samples_counter < self.experiment_n_samples:
-                    chunk_slice = slice(self.samples_counter, self.samples_counter + chunk.shape[0])
-                    self.raw_recorder[chunk_slice] = chunk[:, :self.n_channels]
-                    self.raw_recorder_other[chunk_slice] = other_chunk
-                    self.timestamp_recorder[chunk_slice] = timestamp
-                    # for s, sample in enumerate(self.current_samples):
-                    self.signals_recorder[chunk_slice] = sample
-                    self.samples_counter += chunk.shape[0]
-
-                    # Save the chunk size for data analysis
-                    self.chunk_recorder[self.samples_counter - chunk.shape[0]:self.samples_counter] = 0
-                    self.chunk_recorder[self.samples_counter - 1] = chunk.shape[0]
-                    # logging.debug(f"SAMPLE COUNTER: {self.samples_counter}, CHUNK SIZE: {chunk.shape[0]}, TIME: {time.time()*1000}")
-
-                    # catch channels trouble
-
-                    if self.activate_trouble_catching:
-                        if self.samples_counter > self.seconds:
-                            self.seconds += 2 * self.freq
-                            raw_std_new = np.std(self.raw_recorder[int(self.samples_counter - self.freq):
-                                                                   self.samples_counter], 0)
-                            if self.raw_std is None:
-                                self.raw_std = raw_std_new
-                            else:
-                                if self.catch_channels_trouble and any(raw_std_new > 7 * self.raw_std):
-                                    w = ChannelTroubleWarning(parent=self.main)
-                                    w.pause_clicked.connect(self.handle_channels_trouble_pause)
-                                    w.closed.connect(
-                                        lambda: self.enable_trouble_catching(w)
-                                    )
-                                    w.show()
-                                    self.catch_channels_trouble = False
-                                self.raw_std = 0.5 * raw_std_new + 0.5 * self.raw_std
+                chunk_slice = slice(self.samples_counter, self.samples_counter + chunk.shape[0])
+                self.raw_recorder[chunk_slice] = chunk[:, :self.n_channels]
+                if self.csd_accumulator is not None:
+                    self.csd_accumulator.update(chunk[:, :self.n_channels])
+                self.raw_recorder_other[chunk_slice] = other_chunk
+                self.timestamp_recorder[chunk_slice] = timestamp
+                # for s, sample in enumerate(self.current_samples):
+                self.signals_recorder[chunk_slice] = sample
+                self.samples_counter += chunk.shape[0]
+
+                # Save the chunk size for data analysis
+                self.chunk_recorder[self.samples_counter - chunk.shape[0]:self.samples_counter] = 0
+                self.chunk_recorder[self.samples_counter - 1] = chunk.shape[0]
+                # logging.debug(f"SAMPLE COUNTER: {self.samples_counter}, CHUNK SIZE: {chunk.shape[0]}, TIME: {time.time()*1000}")
 
             # redraw signals and raw data
             self.main.redraw_signals(sample, chunk, self.samples_counter, self.current_protocol_n_samples)
@@ -407,8 +411,7 @@ class Experiment():
                 samples = sample[-1]
 
             # self.reward.update(samples[self.reward.signal_ind], chunk.shape[0])
-            if (self.main.player_panel.start.isChecked() and
-                    self.samples_counter - chunk.shape[0] < self.experiment_n_samples):
+            if self.main.player_panel.start.isChecked():
                 self.reward_recorder[
                 self.samples_counter - chunk.shape[0]:self.samples_counter] = self.reward.get_score()
 
@@ -572,12 +575,17 @@ class Experiment():
                 self.probe_recorder[self.samples_counter - chunk.shape[0]:self.samples_counter] = 0
             self.probe_recorder[self.samples_counter - 1] = int(probe_val or 0)
 
+            # append recorded samples to experiment_data.h5 in background (the last chunk samples can be rewritten)
+            if not self.test_mode:
+                self.recorders_streamer.update(self.get_protocol_group_name(), self.samples_counter, chunk.shape[0])
+
             # change protocol if current_protocol_n_samples has been reached
             if self.samples_counter >= self.current_protocol_n_samples and not self.test_mode:
                 # If baseline protocol, calculate average of reward signal
                 if isinstance(current_protocol, BaselineProtocol):
                     reward_signal_id = current_protocol.reward_signal_id
-                    reward_sig = self.signals_recorder[~np.isnan(self.signals_recorder).any(axis=1)]
+                    reward_sig = self.signals_recorder[:self.samples_counter]
+                    reward_sig = reward_sig[~np.isnan(reward_sig).any(axis=1)]
                     reward_sig = reward_sig[:,reward_signal_id]
                     self.mean_reward_signal = np.median(reward_sig)
                     print(f"len signal: {len(reward_sig)}, mean: {reward_sig.mean()}, median: {np.median(reward_sig)}, signal: {reward_sig}")
@@ -586,7 +594,8 @@ class Experiment():
                 if isinstance(current_protocol, FixationCrossProtocol):
                     if current_protocol.m_signal_id:
                         eye_signal_id = current_protocol.m_signal_id
-                        eye_signal = self.signals_recorder[~np.isnan(self.signals_recorder).any(axis=1)]
+                        eye_signal = self.signals_recorder[:self.samples_counter]
+                        eye_signal = eye_signal[~np.isnan(eye_signal).any(axis=1)]
                         eye_signal = eye_signal[:,eye_signal_id]
                         self.median_eye_signal = np.median(eye_signal)
                         logging.info(f"MEDIAN EYE SIGNAL: {self.median_eye_signal}")
@@ -646,6 +655,37 @@ class Experiment():
                     self.el_tracker.sendMessage(f'PROTOCOL_{self.current_protocol_index}-{self.protocols_sequence[self.current_protocol_index].name}_END')
                     self.next_protocol()
 
+    def get_protocol_group_name(self):
+        return 'protocol' + str(self.current_protocol_index + 1)
+
+    def descale_signals_recordings(self, signals_recordings):
+        return np.array([signal.descale_recording(data) for signal, data in zip(self.signals, signals_recordings.T)]).T
+
+    def update_channels_quality(self, chunk):
+        """
+        Update channels quality monitor by chunk, push status vector to quality outlet and show troubles in status bar
+        and in ChannelTroubleWarning (for new troubles only)
+        """
+        previous_status = self.quality_monitor.status
+        status = self.quality_monitor.update(chunk)
+        self.quality_outlet.push_sample(status.astype('float32'))
+        if np.array_equal(status, previous_status):
+            return
+        troubled_channels = self.quality_monitor.get_troubled_channels(self.channels_labels)
+        self.main.channels_quality_label.setText('Channels trouble: {}'.format(', '.join(troubled_channels))
+                                                 if troubled_channels else '')
+        new_troubles = status & ~previous_status
+        if self.activate_trouble_catching and self.catch_channels_trouble and new_troubles.any():
+            # troubled_channels are listed for channels with nonzero status in channels order
+            channels = [name for name, new in zip(troubled_channels, new_troubles[status > 0]) if new]
+            w = ChannelTroubleWarning(channels=channels, parent=self.main)
+            w.pause_clicked.connect(self.handle_channels_trouble_pause)
+            w.closed.connect(
+                lambda: self.enable_trouble_catching(w)
+            )
+            w.show()
+            self.catch_channels_trouble = False
+
     def enable_trouble_catching(self, widget):
         self.catch_channels_trouble = not widget.ignore_flag
 
@@ -654,6 +694,7 @@ class Experiment():
         if not self.main_timer.isActive():
             self.main_timer.start(1000 * 1. / self.freq)
         self.samples_counter = 0
+        self.recorders_streamer.reset()
         self.main.signals_buffer *= 0
         self.test_mode = True
 
@@ -664,8 +705,15 @@ class Experiment():
         if self.main_timer.isActive():
             self.main_timer.stop()
         self.samples_counter = 0
+        self.recorders_streamer.reset()
         self.main.signals_buffer *= 0
         self.test_mode = False
+        if self.csd_accumulator is not None:
+            # test protocol data are not the part of the next protocol
+            self.reset_csd_accumulator()
+
+    def reset_csd_accumulator(self):
+        self.csd_accumulator = CrossSpectrumAccumulator(self.freq, self.n_channels, max_freq=CSD_MAX_FREQ)
 
     def handle_channels_trouble_pause(self):
         print('pause clicked')
@@ -677,6 +725,33 @@ class Experiment():
         if not pause_enabled and not self.main.player_panel.start.isChecked():
             self.main.player_panel.start.click()
 
+    def fit_bci_model(self, bci_signal, X, y):
+        """
+        Fit BCI model in background, recording of protocols with the BCI signal source is paused until model is ready
+        """
+        if self.bci_executor is None:
+            # one worker is reused by all fits, spawn does not copy state of GUI process (Qt, inlet threads)
+            self.bci_executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+        if bci_signal.name not in self.bci_fitters:
+            fitter = BackgroundBCIFit(bci_signal, self.bci_executor, status_bar=self.main.statusBar())
+            fitter.ready.connect(lambda accuracies: self.handle_bci_model_ready())
+            fitter.failed.connect(lambda message: self.handle_bci_model_ready())
+            self.bci_fitters[bci_signal.name] = fitter
+        self.bci_fitters[bci_signal.name].start(X, y)
+
+    def is_waiting_for_bci_model(self):
+        protocol = self.protocols_sequence[self.current_protocol_index]
+        if protocol.source_signal_id is None:
+            return False
+        fitter = self.bci_fitters.get(self.signals[protocol.source_signal_id].name)
+        return fitter is not None and fitter.is_running()
+
+    def handle_bci_model_ready(self):
+        if self.bci_model_pause and not self.is_waiting_for_bci_model():
+            self.bci_model_pause = False
+            if not self.main.player_panel.start.isChecked():
+                self.main.player_panel.start.click()
+
     def next_protocol(self):
         """
         Change protocol
@@ -684,40 +759,43 @@ class Experiment():
         """
         logging.debug(
             f"NEXT PROTOCOL START TIMESTAMP: {self.timestamp_recorder[self.samples_counter]}, PROTOCOL_{self.current_protocol_index}-{self.protocols_sequence[self.current_protocol_index].name}")
-        # save raw and signals samples asynchronously
-        protocol_number_str = 'protocol' + str(self.current_protocol_index+1)
+        # raw and signals samples are saved asynchronously by writer, append the last samples and wait for them
+        protocol_number_str = self.get_protocol_group_name()
+        self.recorders_streamer.flush(protocol_number_str, self.samples_counter)
+        self.writer.release()
 
         # descale signals:
-        signals_recordings = np.array([signal.descale_recording(data)
-                                       for signal, data in
-                                       zip(self.signals, self.signals_recorder[:self.samples_counter].T)]).T
+        signals_recordings = self.descale_signals_recordings(self.signals_recorder[:self.samples_counter])
+
+        # raw samples kept in memory by recorder are cached (e.g. for mock of the next protocol), spilled ones are read
+        # from recorder only on request (e.g. SSD in the end) and protocols cache loads them from file later
+        raw = self.raw_recorder.view(0, self.samples_counter)
+        if self.samples_counter <= self.raw_recorder.window:
+            raw = self.protocols_cache.put(self.current_protocol_index + 1, 'raw_data', raw)
+        self.protocols_cache.put(self.current_protocol_index + 1, 'signals_data', signals_recordings)
+        if self.csd_accumulator is not None:
+            self.protocols_csd.append(self.csd_accumulator.finish())
+            self.reset_csd_accumulator()
 
         # close previous protocol
         self.protocols_sequence[self.current_protocol_index].close_protocol(
-            raw=self.raw_recorder[:self.samples_counter],
+            raw=raw,
             signals=signals_recordings,
             protocols=self.protocols,
             protocols_seq=[protocol.name for protocol in self.protocols_sequence[:self.current_protocol_index + 1]],
             raw_file=self.dir_name + 'experiment_data.h5',
-            marks=self.mark_recorder[:self.samples_counter])
-
-        save_signals(self.dir_name + 'experiment_data.h5', self.signals, protocol_number_str,
-                     raw_data=self.raw_recorder[:self.samples_counter],
-                     timestamp_data=self.timestamp_recorder[:self.samples_counter],
-                     raw_other_data=self.raw_recorder_other[:self.samples_counter],
-                     signals_data=signals_recordings,
-                     reward_data=self.reward_recorder[:self.samples_counter],
-                     protocol_name=self.protocols_sequence[self.current_protocol_index].name,
-                     mock_previous=self.protocols_sequence[self.current_protocol_index].mock_previous,
-                     mark_data=self.mark_recorder[:self.samples_counter],
-                     choice_data=self.choice_recorder[:self.samples_counter],
-                     answer_data=self.answer_recorder[:self.samples_counter],
-                     posner_stim_data = self.posnerdir_recorder[:self.samples_counter],
-                     posner_stim_time = self.posnerstim_recorder[:self.samples_counter],
-                     response_data = self.response_recorder[:self.samples_counter],
-                     cue_data=self.cue_recorder[:self.samples_counter], # TODO: make this an attribute not a dataset
-                     probe_data=self.probe_recorder[:self.samples_counter],
-                     chunk_data=self.chunk_recorder[:self.samples_counter])
+            marks=self.mark_recorder[:self.samples_counter],
+            protocols_cache=self.protocols_cache,
+            protocols_csd=self.protocols_csd if self.csd_accumulator is not None else None)
+        if self.csd_accumulator is not None and not any(
+                protocol.ssd_in_the_end for protocol in self.protocols_sequence[self.current_protocol_index + 1:]):
+            # cross-spectra are not used by the next protocols
+            self.csd_accumulator = None
+            self.protocols_csd = []
+
+        self.writer.close_group(protocol_number_str, self.signals,
+                                protocol_name=self.protocols_sequence[self.current_protocol_index].name,
+                                mock_previous=self.protocols_sequence[self.current_protocol_index].mock_previous)
 
         logging.debug(
             f"NEXT PROTOCOL SIG SAVED TIMESTAMP: {self.timestamp_recorder[self.samples_counter]}")
@@ -725,10 +803,12 @@ class Experiment():
         # reset samples counter
         previous_counter = self.samples_counter
         self.samples_counter = 0
+        self.recorders_streamer.reset()
+        for recorder in self.event_recorders.values():
+            recorder.clear()
         if self.protocols_sequence[self.current_protocol_index].update_statistics_in_the_end:
             self.main.time_counter1 = 0
             self.main.signals_viewer.reset_buffer()
-        self.seconds = self.freq
 
         # list of real fb protocols (number in protocol sequence)
         if isinstance(self.protocols_sequence[self.current_protocol_index], FeedbackProtocol):
@@ -742,6 +822,12 @@ class Experiment():
             # update current protocol index and n_samples
             self.current_protocol_index += 1
             current_protocol = self.protocols_sequence[self.current_protocol_index]
+
+            # feedback by bci signal starts when its model is fitted
+            if self.is_waiting_for_bci_model():
+                self.bci_model_pause = True
+                if self.main.player_panel.start.isChecked():
+                    self.main.player_panel.start.click()
             self.current_protocol_n_samples = self.freq * (
                     self.protocols_sequence[self.current_protocol_index].duration +
                     np.random.uniform(0, self.protocols_sequence[self.current_protocol_index].random_over_time))
@@ -881,13 +967,12 @@ class Experiment():
                     current_protocol.mock_previous = random_previos_fb
                 print('MOCK from protocol # current_protocol.mock_previous')
                 if current_protocol.mock_previous == self.current_protocol_index:
+                    # just recorded protocol (recorders are reset below)
                     mock_raw = self.raw_recorder[:previous_counter]
                     mock_signals = self.signals_recorder[:previous_counter]
                 else:
-                    mock_raw = load_h5py(self.dir_name + 'experiment_data.h5',
-                                         'protocol{}/raw_data'.format(current_protocol.mock_previous))
-                    mock_signals = load_h5py(self.dir_name + 'experiment_data.h5',
-                                             'protocol{}/signals_data'.format(current_protocol.mock_previous))
+                    mock_raw = self.protocols_cache.get(current_protocol.mock_previous, 'raw_data')
+                    mock_signals = self.protocols_cache.get(current_protocol.mock_previous, 'signals_data')
                 # print(self.real_fb_number_list)
 
                 current_protocol.prepare_raw_mock_if_necessary(mock_raw, random_previos_fb, mock_signals)
@@ -897,10 +982,7 @@ class Experiment():
                 self.subject.change_protocol(current_protocol)
             if current_protocol.mock_samples_file_path is not None:
                 logging.info(f"mockpath: {current_protocol.mock_samples_file_path}, mockprotocol: {current_protocol.mock_samples_protocol}, actual_mock_protocol: protocol{self.current_protocol_index}")
-                self.mock_signals_buffer = load_h5py_protocol_signals(
-                    current_protocol.mock_samples_file_path,
-                    f"protocol{self.current_protocol_index+1}") # TODO: [ ]fix this - it only works if there are the same number of protocols in sham and real (study must be identical)
-                    # current_protocol.mock_samples_protocol)
+                self.mock_signals_buffer = self.mock_source.get(self.current_protocol_index)
             self.main.status.update()
 
             if bc_threshold:
@@ -938,6 +1020,10 @@ class Experiment():
             # save_h5py(self.dir_name + 'raw.h5', self.main.raw_recorder)
             # save_h5py(self.dir_name + 'signals.h5', self.main.signals_recorder)
 
+        # the next protocol is recorded from the first sample (previous samples are in experiment_data.h5)
+        for recorder in self.spill_recorders:
+            recorder.reset()
+
         logging.debug(
             f"NEXT PROTOCOL END TIMESTAMP: {self.timestamp_recorder[self.samples_counter]} PROTOCOL_{self.current_protocol_index}-{self.protocols_sequence[self.current_protocol_index].name}")
 
@@ -963,6 +1049,12 @@ class Experiment():
             self.stream.disconnect()
         if self.thread is not None:
             self.thread.terminate()
+        if self.writer is not None:
+            self.writer.stop()
+        for recorder in self.spill_recorders:
+            recorder.close()
+        if self.mock_source is not None:
+            self.mock_source.close()
 
         # timer
         self.main_timer = QtCore.QTimer(self.app)
@@ -982,10 +1074,13 @@ class Experiment():
 
         # run simulated eeg lsl stream in a thread
         elif self.params['sInletType'] == 'lsl_generator':
-            self.thread = stream_generator_in_a_thread(self.params['sStreamName'])
+            # simulated markers outlet is opened only if it is used as events stream
+            events = self.params['sEventsStreamName'] == self.params['sStreamName'] + '_events'
+            self.thread = stream_generator_in_a_thread(self.params['sStreamName'], events=events)
 
         # use FTB inlet
         aux_streams = None
+        stream_names = []
         if self.params['sInletType'] == 'ftbuffer':
             hostname, port = self.params['sFTHostnamePort'].split(':')
             port = int(port)
@@ -995,19 +1090,23 @@ class Experiment():
         else:
             stream_names = re.split(r"[,;]+", self.params['sStreamName'])
             print(f'STREAM NAME: {stream_names}')
-            streams = [LSLInlet(name=name) for name in stream_names]
-            stream = streams[0]
-            aux_streams = streams[1:] if len(streams) > 1 else None
 
         # setup events stream by name
         events_stream_name = self.params['sEventsStreamName']
-        events_stream = LSLInlet(events_stream_name) if events_stream_name else None
         print(f"EVENTS STREAM NAME: {events_stream_name}")
 
+        # resolve all LSL streams concurrently
+        lsl_streams = resolve_inlets(stream_names + ([events_stream_name] if events_stream_name else []))
+        events_stream = lsl_streams.pop() if events_stream_name else None
+        if stream_names:
+            stream = lsl_streams[0]
+            aux_streams = lsl_streams[1:] if len(lsl_streams) > 1 else None
+
         # setup main stream
         self.stream = ChannelsSelector(stream, exclude=self.params['sReference'],
                                        subtractive_channel=self.params['sReferenceSub'],
                                        dc=self.params['bDC'], events_inlet=events_stream, aux_inlets=aux_streams,
+                                       aux_policy=self.params['sAuxAlignment'],
                                        prefilter_band=self.params['sPrefilterBand'])
         self.stream.save_info(self.dir_name + 'stream_info.xml')
         save_channels_and_fs(self.dir_name + 'experiment_data.h5', self.stream.get_channels_labels(),
@@ -1018,10 +1117,14 @@ class Experiment():
         self.n_channels = self.stream.get_n_channels()
         self.n_channels_other = self.stream.get_n_channels_other()
         channels_labels = self.stream.get_channels_labels()
+        self.channels_labels = channels_labels
         montage = Montage(channels_labels)
         print(montage)
-        self.seconds = 2 * self.freq
-        self.raw_std = None
+
+        # channels quality monitor and outlet of its status vector (bitwise or of QUALITY_FLAGS per channel)
+        self.quality_monitor = ChannelQualityMonitor(self.freq, self.n_channels, line_freq=self.params['fLineFreqHz'])
+        self.quality_outlet = SignalsOutlet(channels_labels[:self.n_channels], fs=0, name='NFBLab_quality',
+                                            source_id='nfblab42_quality')
 
         # signals
         self.signals = [DerivedSignal.from_params(ind, self.freq, self.n_channels, channels_labels, signal,
@@ -1041,16 +1144,24 @@ class Experiment():
                                   for ind, signal in enumerate(self.params['vSignals']['CompositeSignal'])]
 
         # bci signals
-        self.bci_signals = [BCISignal(self.freq, channels_labels, signal['sSignalName'], ind)
+        self.bci_signals = [BCISignal(self.freq, channels_labels, signal['sSignalName'], ind,
+                                      decision_rate=signal['fBCIDecisionRateHz'])
                             for ind, signal in enumerate(self.params['vSignals']['DerivedSignal']) if
                             signal['bBCIMode']]
 
         self.signals += self.composite_signals
         self.signals += self.bci_signals
+        self.spatial_filter_bank = SpatialFilterBank(self.signals)
+        # background fitting of bci models (by signal name)
+        self.bci_fitters = {}
+        self.bci_model_pause = False
         # self.current_samples = np.zeros_like(self.signals)
 
-        # signals outlet
-        self.signals_outlet = SignalsOutlet([signal.name for signal in self.signals], fs=self.freq)
+        # signals outlet and buffer of current chunk of signals (shared by outlet, recorder and viewers)
+        self.signals_outlet = SignalsOutlet([signal.name for signal in self.signals], fs=self.freq,
+                                            dtype=self.params['sRecorderDtype'])
+        self.signals_chunk_buffer = np.zeros((LSL_MAX_CHUNK_LEN, len(self.signals)),
+                                             dtype=self.params['sRecorderDtype'])
 
         # protocols
         self.protocols = []
@@ -1226,31 +1337,74 @@ class Experiment():
                                                        np.random.uniform(0, self.protocols_sequence[
                                                            self.current_protocol_index].random_over_time))
 
+        # sham signals: map donor protocols up front
+        self.mock_source = MockSignalsSource(self.protocols_sequence)
+        if 0 in self.mock_source:
+            self.mock_signals_buffer = self.mock_source.get(0)
+
         # experiment number of samples
         max_protocol_n_samples = int(
             max([self.freq * (p.duration + p.random_over_time) for p in self.protocols_sequence]))
 
-        # data recorders
-        self.experiment_n_samples = max_protocol_n_samples
+        # data recorders: last fRecorderWindowS seconds are kept in memory, older samples are spilled to disk,
+        # so protocols length is limited only by disk space
         self.samples_counter = 0
-        self.raw_recorder = np.zeros((max_protocol_n_samples * 110 // 100, self.n_channels)) * np.nan
-        self.timestamp_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan
-        self.raw_recorder_other = np.zeros((max_protocol_n_samples * 110 // 100, self.n_channels_other)) * np.nan
-        self.signals_recorder = np.zeros((max_protocol_n_samples * 110 // 100, len(self.signals))) * np.nan
-        self.reward_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # cumulative reward (int)
-        self.mark_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan
-        self.choice_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan
-        self.answer_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan
-        self.posnerstim_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # The onset of stimlus (in ms)
-        self.posnerdir_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # The direction of posner stim
-        self.response_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # the user response (in ms)
-        self.chunk_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # the length of incoming chunks
-        self.probe_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # the onset sample of probes
-        self.cue_recorder = np.zeros((max_protocol_n_samples * 110 // 100)) * np.nan # the cue direction for posner tasks
+        n_recorder_samples = max_protocol_n_samples * 110 // 100
+        dtype = self.params['sRecorderDtype']
+        window = max(1, int(self.params['fRecorderWindowS'] * self.freq))
+        self.raw_recorder = SpillRecorder(n_recorder_samples, (self.n_channels, ), window,
+                                          self.dir_name + 'raw_data.dat', dtype=dtype)
+        self.timestamp_recorder = SpillRecorder(n_recorder_samples, (), window, self.dir_name + 'timestamp_data.dat')
+        self.raw_recorder_other = SpillRecorder(n_recorder_samples, (self.n_channels_other, ), window,
+                                                self.dir_name + 'raw_other_data.dat', dtype=dtype)
+        self.signals_recorder = SpillRecorder(n_recorder_samples, (len(self.signals), ), window,
+                                              self.dir_name + 'signals_data.dat', dtype=dtype)
+        self.reward_recorder = SpillRecorder(n_recorder_samples, (), window,
+                                             self.dir_name + 'reward_data.dat') # cumulative reward (int)
+        self.spill_recorders = [self.raw_recorder, self.timestamp_recorder, self.raw_recorder_other,
+                                self.signals_recorder, self.reward_recorder]
+        # event-like recorders keep only (sample_index, value) change points
+        self.mark_recorder = EventRecorder(n_recorder_samples)
+        self.choice_recorder = EventRecorder(n_recorder_samples)
+        self.answer_recorder = EventRecorder(n_recorder_samples)
+        self.posnerstim_recorder = EventRecorder(n_recorder_samples) # The onset of stimlus (in ms)
+        self.posnerdir_recorder = EventRecorder(n_recorder_samples) # The direction of posner stim
+        self.response_recorder = EventRecorder(n_recorder_samples) # the user response (in ms)
+        self.chunk_recorder = EventRecorder(n_recorder_samples) # the length of incoming chunks
+        self.probe_recorder = EventRecorder(n_recorder_samples) # the onset sample of probes
+        self.cue_recorder = EventRecorder(n_recorder_samples) # the cue direction for posner tasks
+        self.event_recorders = {'mark_data': self.mark_recorder, 'choice_data': self.choice_recorder,
+                                'answer_data': self.answer_recorder, 'posner_stim_data': self.posnerdir_recorder,
+                                'posner_stim_time': self.posnerstim_recorder, 'response_data': self.response_recorder,
+                                'cue_data': self.cue_recorder, 'probe_data': self.probe_recorder,
+                                'chunk_data': self.chunk_recorder}
 
         # save init signals
+        storage_policies = get_storage_policies(self.params)
         save_signals(self.dir_name + 'experiment_data.h5', self.signals,
-                     group_name='protocol0')
+                     group_name='protocol0', storage_policies=storage_policies)
+
+        # in-memory cache of recorded protocols
+        self.protocols_cache = ProtocolCache(self.dir_name + 'experiment_data.h5',
+                                             self.params['iProtocolCacheMB'] * 2 ** 20)
+
+        # cross-spectra of recorded protocols are accumulated chunk by chunk (if SSD or CSP can be run in the end),
+        # so band covariances for SSD and CSP are ready when protocol is closed
+        self.protocols_csd = []
+        self.csd_accumulator = None
+        if any(protocol.ssd_in_the_end for protocol in self.protocols_sequence):
+            self.reset_csd_accumulator()
+
+        # background writer of protocols data
+        self.writer = HDF5StreamWriter(self.dir_name + 'experiment_data.h5', {
+            'raw_data': (self.n_channels, ), 'timestamp_data': (), 'raw_other_data': (self.n_channels_other, ),
+            'signals_data': (len(self.signals), ), 'reward_data': ()}, events_names=list(self.event_recorders),
+            storage_policies=storage_policies)
+        self.recorders_streamer = RecordersStreamer(self.writer, {
+            'raw_data': self.raw_recorder, 'timestamp_data': self.timestamp_recorder,
+            'raw_other_data': self.raw_recorder_other, 'signals_data': self.signals_recorder,
+            'reward_data': self.reward_recorder}, self.event_recorders, delay=LSL_MAX_CHUNK_LEN,
+            transforms={'signals_data': self.descale_signals_recordings})
 
         # save settings
         params_to_xml_file(self.params, self.dir_name + 'settings.xml')
@@ -1298,6 +1452,17 @@ class Experiment():
     def destroy(self):
         if self.thread is not None:
             self.thread.terminate()
+        if self.writer is not None:
+            self.writer.stop()
+        for recorder in self.spill_recorders:
+            recorder.close()
+        if self.mock_source is not None:
+            self.mock_source.close()
+        for fitter in self.bci_fitters.values():
+            fitter.cancel()
+        if self.bci_executor is not None:
+            self.bci_executor.shutdown(wait=False)
+            self.bci_executor = None
         self.main_timer.stop()
         del self.stream
         self.stream = None
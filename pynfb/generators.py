@@ -1,14 +1,19 @@
+import argparse
 import time
 import os
+from collections import namedtuple
 from multiprocessing import Process
 
+import h5py
 import numpy as np
-from pylsl import StreamInfo, StreamOutlet
+from pylsl import StreamInfo, StreamOutlet, local_clock
+from scipy.signal import sosfilt, sosfreqz
 import mne
 
 from mne.io.brainvision import read_raw_brainvision
-from pynfb.serializers.hdf5 import load_h5py_all_samples, load_xml_str_from_hdf5_dataset, DatasetNotFound, load_channels_and_fs
+from pynfb.serializers.hdf5 import load_xml_str_from_hdf5_dataset
 from pynfb.serializers.xml_ import get_lsl_info_from_xml
+from pynfb.serializers.reader import ExperimentReader, DatasetView, SessionView
 from pynfb.inlets.channels_selector import ChannelsSelector
 
 ch_names = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'Ft9', 'Fc5', 'Fc1', 'Fc2', 'Fc6', 'Ft10', 'T7', 'C3', 'Cz',
@@ -111,49 +116,403 @@ def run_events_sim(name='events_example'):
         print('42 sent')
     pass
 
-def stream_file_in_a_thread(file_path, reference, stream_name):
-    file_name, file_extension = os.path.splitext(file_path)
 
-    if file_extension == '.fif':
-        raw = mne.io.read_raw_fif(file_path, verbose='ERROR')
-        start, stop = raw.time_as_index([0, 60])  # read the first 15s of data
-        source_buffer = raw.get_data(start=start, stop=stop)
-    elif file_extension == '.vhdr':
-        raw = read_raw_brainvision(vhdr_fname=file_path, verbose='ERROR')
-        source_buffer = raw.get_data()
-    else:
-        source_buffer = load_h5py_all_samples(file_path=file_path).T
+SimulatedSource = namedtuple('SimulatedSource', 'freq amplitude modulation_freq modulation_depth')
+SimulatedSource.__doc__ = """
+Narrow-band source of EEG simulator: sine of freq [Hz] and amplitude, amplitude is modulated by
+(1 + modulation_depth * sin(2 * pi * modulation_freq * t))
+"""
+DEFAULT_SOURCES = (SimulatedSource(10, 20., 0.1, 0.8),  # alpha
+                   SimulatedSource(12, 10., 0.25, 0.8))  # mu
 
-    try:
+# events markers codes of EEG simulator
+EVENT_BLINK = 1
+EVENT_MUSCLE = 2
+EVENT_PERIODIC = 10
+
+
+def pink_noise_sos(fs, exponent=1., f_min=0.1):
+    """
+    Second order sections of filter shaping white noise to 1/f^exponent power spectrum (alternating real poles and
+    zeros spaced log-uniformly from f_min to fs/2), normalized to unit output std for unit white noise input
+    """
+    n_pairs = max(1, int(np.ceil(2 * np.log10(fs / 2 / f_min))))
+    poles_freqs = f_min * (fs / 2 / f_min) ** (np.arange(n_pairs) / n_pairs)
+    zeros_freqs = poles_freqs * (fs / 2 / f_min) ** (exponent / 2 / n_pairs)
+    poles = np.exp(-2 * np.pi * poles_freqs / fs)
+    zeros = np.exp(-2 * np.pi * np.minimum(zeros_freqs, fs / 2) / fs)
+    if n_pairs % 2:
+        poles, zeros = np.append(poles, 0), np.append(zeros, 0)
+    sos = np.array([np.concatenate([np.poly(zeros[k:k + 2]), np.poly(poles[k:k + 2])])
+                    for k in range(0, len(poles), 2)])
+    _, h = sosfreqz(sos, worN=4096, fs=fs)
+    sos[0, :3] /= np.sqrt(np.mean(np.abs(h) ** 2))
+    return sos
+
+
+class EEGSimulator:
+    """
+    Chunked EEG model: 1/f^exponent background noise, amplitude-modulated narrow-band sources (alpha, mu) with smooth
+    spatial patterns, line noise, eye blink (frontal channels) and muscle (random channels) artifacts and events
+    markers. Model state is kept between chunks, so consecutive chunks of any length form a continuous signal
+    """
+    def __init__(self, n_channels=32, fs=500, exponent=1., background_amplitude=10., sources=DEFAULT_SOURCES,
+                 line_noise_freq=50, line_noise_amplitude=1., blink_rate=0.1, blink_amplitude=100., muscle_rate=0.05,
+                 muscle_amplitude=20., events_period=None, seed=None):
+        """
+        :param background_amplitude: background noise std
+        :param sources: list of SimulatedSource
+        :param blink_rate: eye blinks rate [1/s] (0 to disable)
+        :param muscle_rate: muscle artifacts rate [1/s] (0 to disable)
+        :param events_period: period [s] of EVENT_PERIODIC markers (no periodic markers if None)
+        :param seed: random seed
+        """
+        self.n_channels = n_channels
+        self.fs = fs
+        self.rng = np.random.default_rng(seed)
+        self.n_generated = 0
+
+        # background
+        self.background_amplitude = background_amplitude
+        self.sos = pink_noise_sos(fs, exponent)
+        self.zi = np.zeros((self.sos.shape[0], 2, n_channels))
+
+        # sources with gaussian spatial patterns over channels indices
+        self.sources = list(sources)
+        centers = self.rng.uniform(0, n_channels, len(self.sources))
+        width = max(n_channels / 8, 1)
+        self.patterns = np.exp(-((np.arange(n_channels)[None] - centers[:, None]) / width) ** 2 / 2)
+        self.phases = self.rng.uniform(0, 2 * np.pi, len(self.sources))
+        self.line_noise_freq = line_noise_freq
+        self.line_noise_amplitude = line_noise_amplitude
+
+        # artifacts: blink waveform on frontal (first) channels, muscle bursts of noise on random channels
+        self.blink_rate = blink_rate
+        self.muscle_rate = muscle_rate
+        self.muscle_amplitude = muscle_amplitude
+        self.blink = blink_amplitude * np.hanning(int(0.4 * fs))[:, None] * \
+                     np.exp(-np.arange(n_channels) / max(n_channels / 16, 1))[None]
+        self.muscle_len = int(0.5 * fs)
+        self.artifacts_tail = np.zeros((max(len(self.blink), self.muscle_len), n_channels))
+        self.events_period = events_period
+
+    def _artifacts(self, n_samples, events):
+        artifacts = np.zeros((n_samples + len(self.artifacts_tail), self.n_channels))
+        artifacts[:len(self.artifacts_tail)] = self.artifacts_tail
+        for rate, code in [(self.blink_rate, EVENT_BLINK), (self.muscle_rate, EVENT_MUSCLE)]:
+            for onset in np.sort(self.rng.integers(0, n_samples, self.rng.poisson(rate * n_samples / self.fs))):
+                if code == EVENT_BLINK:
+                    artifacts[onset:onset + len(self.blink)] += self.blink
+                else:
+                    channels = self.rng.random(self.n_channels) < 0.2
+                    burst = self.rng.standard_normal((self.muscle_len, channels.sum())) * \
+                            np.hanning(self.muscle_len)[:, None] * self.muscle_amplitude
+                    artifacts[onset:onset + self.muscle_len, channels] += burst
+                events.append((onset, code))
+        self.artifacts_tail = artifacts[n_samples:]
+        return artifacts[:n_samples]
+
+    def generate(self, n_samples):
+        """
+        Generate next chunk
+        :return: (n_samples, n_channels) float32 chunk and list of events markers (sample index in chunk, code)
+        """
+        events = []
+        noise = self.rng.standard_normal((n_samples, self.n_channels))
+        chunk, self.zi = sosfilt(self.sos, noise, axis=0, zi=self.zi)
+        chunk *= self.background_amplitude
+
+        t = (self.n_generated + np.arange(n_samples)) / self.fs
+        if self.sources:
+            freqs, amplitudes, modulation_freqs, depths = map(np.array, zip(*self.sources))
+            envelopes = amplitudes * (1 + depths * np.sin(2 * np.pi * modulation_freqs * t[:, None]))
+            chunk += (envelopes * np.sin(2 * np.pi * freqs * t[:, None] + self.phases)).dot(self.patterns)
+        if self.line_noise_amplitude:
+            chunk += self.line_noise_amplitude * np.sin(2 * np.pi * self.line_noise_freq * t)[:, None]
+        if self.blink_rate or self.muscle_rate:
+            chunk += self._artifacts(n_samples, events)
+
+        if self.events_period is not None:
+            period = int(self.events_period * self.fs)
+            first = -self.n_generated % period
+            events += [(k, EVENT_PERIODIC) for k in range(first, n_samples, period)]
+        self.n_generated += n_samples
+        return np.ascontiguousarray(chunk, dtype='float32'), sorted(events)
+
+
+def run_eeg_simulator(name='example', n_channels=32, fs=500, chunk_duration=0.01, events=False, duration=None,
+                      labels=None, **model_kwargs):
+    """
+    Stream simulated EEG (EEGSimulator) to LSL outlet in chunks on deadline-based schedule: samples count follows
+    the clock (no drift), timestamps are derived from samples count
+    :param name: name of outlet, events markers are streamed to '<name>_events' outlet if events is True
+    :param chunk_duration: chunks period [s]
+    :param duration: streaming duration [s] (infinite if None)
+    :param labels: channels labels (default labels if None)
+    :param model_kwargs: EEGSimulator kwargs
+    """
+    labels = labels or (ch_names[:n_channels] if n_channels <= len(ch_names) else
+                        ['Ch{}'.format(k + 1) for k in range(n_channels)])
+    info = StreamInfo(name=name, type='EEG', channel_count=n_channels, nominal_srate=fs, channel_format='float32',
+                      source_id='nfblab_sim_' + name)
+    chns = info.desc().append_child("channels")
+    for label in labels:
+        chns.append_child("channel").append_child_value("label", label)
+    chunk_len = max(1, int(round(chunk_duration * fs)))
+    outlet = StreamOutlet(info, chunk_size=chunk_len)
+    events_outlet = None
+    if events:
+        events_info = StreamInfo(name=name + '_events', type='Markers', channel_count=1, channel_format='float32',
+                                 source_id='nfblab_sim_events_' + name)
+        events_outlet = StreamOutlet(events_info)
+    simulator = EEGSimulator(n_channels, fs, **model_kwargs)
+
+    print('now sending data to {} ({} channels x {} Hz)...'.format(name, n_channels, fs))
+    t0 = local_clock()
+    t_report = t0
+    n_sent = 0
+    while duration is None or n_sent < duration * fs:
+        # generate all samples due by now (several chunks if behind schedule)
+        n_due = int((local_clock() - t0) * fs) - n_sent
+        if n_due >= chunk_len:
+            chunk, chunk_events = simulator.generate(n_due)
+            last_timestamp = t0 + (n_sent + n_due - 1) / fs
+            outlet.push_chunk(chunk, last_timestamp)
+            if events_outlet is not None:
+                for index, code in chunk_events:
+                    events_outlet.push_sample([code], t0 + (n_sent + index) / fs)
+            n_sent += n_due
+
+        # sleep until next chunk deadline
+        time.sleep(max(0., t0 + (n_sent + chunk_len) / fs - local_clock()))
+
+        # print rate and lag every 5 sec
+        if local_clock() - t_report > 5:
+            t_report = local_clock()
+            print('{}: t={:.1f}, f={:.2f}, lag={:.1f} ms'.format(name, t_report - t0, n_sent / (t_report - t0),
+                                                                (t_report - t0 - n_sent / fs) * 1000))
+
+
+# sampling frequency of played files without channels info
+DEFAULT_FILE_FS = 500
+
+
+class FileSource:
+    """
+    Incremental reader of recorded raw data: .fif and .vhdr files are read in blocks by mne (not preloaded), .h5
+    experiment files are read as lazy session view of protocols raw data (uncompressed datasets are memory-mapped)
+    """
+    def __init__(self, file_path, exclude=None, protocols=None):
+        """
+        :param file_path: .fif, .vhdr or .h5 file path
+        :param exclude: channels names to exclude
+        :param protocols: .h5 protocols numbers or names to play (all protocols if None)
+        """
+        self.raw = None
+        self.reader = None
+        file_extension = os.path.splitext(file_path)[1]
         if file_extension in ('.fif', '.vhdr'):
-            labels = raw.info['ch_names']
-            fs = raw.info['sfreq']
+            if file_extension == '.fif':
+                self.raw = mne.io.read_raw_fif(file_path, preload=False, verbose='ERROR')
+            else:
+                self.raw = read_raw_brainvision(vhdr_fname=file_path, preload=False, verbose='ERROR')
+            labels, self.fs, self.n_samples = self.raw.info['ch_names'], self.raw.info['sfreq'], self.raw.n_times
         else:
-            try:
-                labels, fs = load_channels_and_fs(file_path)
-            except ValueError:
-                xml_str = load_xml_str_from_hdf5_dataset(file_path, 'stream_info.xml')
-                labels, fs = get_lsl_info_from_xml(xml_str)
-        exclude = [ex.upper() for ex in ChannelsSelector.parse_channels_string(reference)]
-        labels = [label for label in labels if label.upper() not in exclude]
-        print('Using {} channels and fs={}.\n[{}]'.format(len(labels), fs, labels))
-    except (FileNotFoundError, DatasetNotFound):
-        print('Channels labels and fs not found. Using default 32 channels and fs=500Hz.')
-        labels = None
-        fs = None
-    thread = Process(target=run_eeg_sim, args=(),
-                          kwargs={'chunk_size': 0, 'source_buffer': source_buffer,
-                                  'name': stream_name, 'labels': labels, 'freq': fs})
+            with h5py.File(file_path, 'r') as f:
+                legacy = isinstance(f['protocol1'], h5py.Dataset)
+                has_info = 'channels' in f or 'stream_info.xml' in f
+            if legacy or not has_info:
+                # legacy protocols datasets are raw data and channels are stored in stream info only, files without
+                # channels info are played with default labels and fs
+                labels, self.fs = None, None
+                if has_info:
+                    labels, self.fs = get_lsl_info_from_xml(load_xml_str_from_hdf5_dataset(file_path,
+                                                                                          'stream_info.xml'))
+                self.file = h5py.File(file_path, 'r')
+                numbers = sorted(int(key[8:]) for key in self.file if key[8:].isdigit() and key != 'protocol0')
+                numbers = [n for n in numbers if protocols is None or n in protocols or
+                           (not legacy and self.file['protocol{}'.format(n)].attrs.get('name') in protocols)]
+                views = [DatasetView(self.file['protocol{}'.format(n) + ('' if legacy else '/raw_data')], mmap=True)
+                         for n in numbers]
+                self.session = SessionView(views, np.cumsum([0] + [len(view) for view in views]))
+            else:
+                self.reader = ExperimentReader(file_path, mmap=True)
+                labels, self.fs = self.reader.channels, self.reader.fs
+                numbers = [info.number for info in self.reader.protocols
+                           if protocols is None or info.number in protocols or info.name in protocols]
+                self.session = self.reader.session('raw_data', numbers)
+            if len(self.session.views) == 0:
+                raise ValueError('No protocols {} in {}'.format(protocols, file_path))
+            self.n_samples = len(self.session)
+            if labels is None:
+                n_channels = self.session.shape[1]
+                labels = ch_names32[:n_channels] if n_channels <= len(ch_names32) else \
+                    ['Ch{}'.format(k + 1) for k in range(n_channels)]
+                self.fs = DEFAULT_FILE_FS
+                print('Channels labels and fs not found. Using default {} channels and fs={}Hz.'.format(n_channels,
+                                                                                                      self.fs))
+        exclude = [ex.upper() for ex in (exclude or [])]
+        self.picks = [k for k, label in enumerate(labels) if label.upper() not in exclude]
+        self.labels = [labels[k] for k in self.picks]
+
+    def read(self, start, stop):
+        """
+        Read samples [start, stop)
+        :return: (stop - start, n_channels) float32 array
+        """
+        if self.raw is not None:
+            return self.raw.get_data(picks=self.picks, start=start, stop=stop).T.astype('float32')
+        return np.asarray(self.session[start:stop], dtype='float32')[:, self.picks]
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+        elif self.raw is None:
+            self.file.close()
+
+
+class FilePlayback:
+    """
+    Real time (or speed times faster) LSL playback of recorded file: file is read in blocks and pushed in chunks on
+    deadline-based schedule, position can be changed by seek(), playback range [start, stop) can be looped
+    """
+    def __init__(self, file_path, name='example', exclude=None, protocols=None, speed=1., start=0., stop=None,
+                 loop=True, chunk_duration=0.01, block_duration=1.):
+        """
+        :param speed: playback speed factor (nominal sampling rate of outlet is file sampling rate)
+        :param start: range start [s] (from the beginning of selected protocols for .h5 files)
+        :param stop: range stop [s] (end of file if None)
+        :param loop: repeat range, otherwise stop at the end of range
+        :param chunk_duration: chunks period [s] (of playback time)
+        :param block_duration: duration of file blocks read at once [s]
+        """
+        self.source = FileSource(file_path, exclude, protocols)
+        self.fs = self.source.fs
+        self.name = name
+        self.speed = speed
+        self.loop = loop
+        self.range_start = int(start * self.fs)
+        self.range_stop = self.source.n_samples if stop is None else min(int(stop * self.fs), self.source.n_samples)
+        if self.range_stop <= self.range_start:
+            raise ValueError('Empty playback range [{}, {}) s'.format(start, stop))
+        self.chunk_len = max(1, int(round(chunk_duration * self.fs * speed)))
+        self.block_len = max(self.chunk_len, int(block_duration * self.fs))
+        self.position = self.range_start
+        self.block = None
+        self.block_start = None
+        print('Using {} channels and fs={}.\n[{}]'.format(len(self.source.labels), self.fs, self.source.labels))
+
+    def seek(self, t):
+        """
+        Continue playback from t [s] of file (or of selected protocols)
+        """
+        self.position = min(max(int(t * self.fs), 0), self.source.n_samples - 1)
+
+    def _read(self, n_samples):
+        # read n_samples from current position from blocks, wrap around range end if loop
+        chunks = []
+        while n_samples > 0 and (self.position < self.range_stop or self.loop):
+            if self.position >= self.range_stop:
+                self.position = self.range_start
+            if self.block is None or not self.block_start <= self.position < self.block_start + len(self.block):
+                self.block_start = self.position
+                self.block = self.source.read(self.position, min(self.position + self.block_len, self.range_stop))
+            offset = self.position - self.block_start
+            chunk = self.block[offset:offset + n_samples]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            n_samples -= len(chunk)
+        return np.concatenate(chunks) if len(chunks) > 1 else chunks[0] if chunks else None
+
+    def run(self):
+        info = StreamInfo(name=self.name, type='EEG', channel_count=len(self.source.labels), nominal_srate=self.fs,
+                          channel_format='float32', source_id='nfblab_file_' + self.name)
+        chns = info.desc().append_child("channels")
+        for label in self.source.labels:
+            chns.append_child("channel").append_child_value("label", label)
+        outlet = StreamOutlet(info, chunk_size=self.chunk_len)
+
+        print('now sending data...')
+        rate = self.fs * self.speed
+        t0 = local_clock()
+        n_sent = 0
+        while True:
+            n_due = int((local_clock() - t0) * rate) - n_sent
+            if n_due >= self.chunk_len:
+                chunk = self._read(n_due)
+                if chunk is None:
+                    break
+                outlet.push_chunk(np.ascontiguousarray(chunk), t0 + (n_sent + len(chunk) - 1) / rate)
+                n_sent += len(chunk)
+            time.sleep(max(0., t0 + (n_sent + self.chunk_len) / rate - local_clock()))
+        self.source.close()
+
+
+def run_file_playback(file_path, name='example', **kwargs):
+    """
+    Play file to LSL outlet, see FilePlayback
+    """
+    FilePlayback(file_path, name, **kwargs).run()
+
+
+def stream_file_in_a_thread(file_path, reference, stream_name, **kwargs):
+    """
+    Play file to LSL stream in a separate process, reference channels are excluded. File, channels labels, fs and
+    playback range are checked in the calling process, so errors are raised here instead of the playback process
+    :param kwargs: FilePlayback kwargs
+    """
+    exclude = [ex for ex in ChannelsSelector.parse_channels_string(reference) if isinstance(ex, str)]
+    FilePlayback(file_path, stream_name, exclude=exclude, **kwargs).source.close()
+    thread = Process(target=run_file_playback, args=(file_path, stream_name), kwargs=dict(exclude=exclude, **kwargs))
     thread.start()
     time.sleep(2)
     return thread
 
-def stream_generator_in_a_thread(name, generator=run_eeg_sim):
-    thread = Process(target=generator, args=(), kwargs={'name': name})
+def stream_generator_in_a_thread(name, generator=run_eeg_simulator, **kwargs):
+    """
+    Run generator in a separate process
+    :param kwargs: generator kwargs (e.g. events=True to stream run_eeg_simulator markers to '<name>_events' outlet)
+    """
+    thread = Process(target=generator, args=(), kwargs=dict(name=name, **kwargs))
     thread.start()
     time.sleep(2)
     return thread
 
 if __name__ == '__main__':
-    run_eeg_sim(chunk_size=0, name='NVX136_Data')
+    parser = argparse.ArgumentParser(description='Simulated EEG LSL streams (one process per device) or file playback')
+    parser.add_argument('--device', action='append', default=None, metavar='NAME:N_CHANNELS:FS',
+                        help='simulated device, can be repeated (default NVX136_Data:32:500)')
+    parser.add_argument('--chunk-ms', type=float, default=10, help='chunks period [ms]')
+    parser.add_argument('--exponent', type=float, default=1., help='background 1/f^exponent spectrum exponent')
+    parser.add_argument('--no-artifacts', action='store_true', help='disable blinks and muscle artifacts')
+    parser.add_argument('--events', action='store_true', help='stream markers to <name>_events outlets')
+    parser.add_argument('--events-period', type=float, default=None, help='periodic markers period [s]')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--file', default=None, help='play .fif, .vhdr or .h5 file instead of simulation')
+    parser.add_argument('--name', default='NVX136_Data', help='file playback stream name')
+    parser.add_argument('--speed', type=float, default=1., help='file playback speed factor')
+    parser.add_argument('--start', type=float, default=0., help='file playback range start [s]')
+    parser.add_argument('--stop', type=float, default=None, help='file playback range stop [s]')
+    parser.add_argument('--protocols', default=None, help='.h5 protocols to play: numbers or names, e.g. "2,3,FB"')
+    parser.add_argument('--no-loop', action='store_true', help='stop file playback at the end of range')
+    args = parser.parse_args()
+
+    if args.file is not None:
+        protocols = None if args.protocols is None else [int(p) if p.isdigit() else p for p in args.protocols.split(',')]
+        run_file_playback(args.file, args.name, protocols=protocols, speed=args.speed, start=args.start, stop=args.stop,
+                          loop=not args.no_loop, chunk_duration=args.chunk_ms / 1000)
+        exit()
+
+    processes = []
+    for k, device in enumerate(args.device or ['NVX136_Data:32:500']):
+        device_name, n_channels, fs = device.split(':')
+        kwargs = dict(name=device_name, n_channels=int(n_channels), fs=float(fs), chunk_duration=args.chunk_ms / 1000,
+                      events=args.events, exponent=args.exponent, events_period=args.events_period,
+                      seed=None if args.seed is None else args.seed + k)
+        if args.no_artifacts:
+            kwargs.update(blink_rate=0, muscle_rate=0)
+        processes.append(Process(target=run_eeg_simulator, kwargs=kwargs))
+        processes[-1].start()
+    for process in processes:
+        process.join()
 
@@ -1,11 +1,20 @@
+import logging
 import os
+import re
+from functools import lru_cache
 
+import h5py
 import mne
 import numpy as np
 import pylab as plt
 from mne.datasets import fetch_fsaverage
 from mne.minimum_norm.inverse import _assemble_kernel
 
+# channels excluded from source estimation #TODO: make this work for other amplifiers /caps other than brainVision (with ECG and EOG)
+NON_EEG_CHANNELS = ['ECG', 'EOG', 'MKIDX']
+# precomputed ROI filters matrices (see get_roi_filter_from_bank)
+ROI_FILTERS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pynfb')
+
 def _get_label_flip(labels, label_vertidx, src):
     """Get sign-flip for labels."""
     # do the import here to avoid circular dependency
@@ -23,8 +32,10 @@ def _get_label_flip(labels, label_vertidx, src):
 
     return label_flip
 
-# get flip
-def get_flip(label, vertno, inv):
+def get_label_vertidx(label, vertno):
+    """
+    Get indices of label vertices in the concatenated (lh, rh) source space
+    """
     nvert = [len(vn) for vn in vertno]
     if label.hemi == 'both':
         sub_labels = [label.lh, label.rh]
@@ -41,7 +52,12 @@ def get_flip(label, vertno, inv):
         else:
             raise ValueError('label %s has invalid hemi' % label.name)
         this_vertidx.append(vertidx)
-    vertidx = np.concatenate(this_vertidx)
+    return np.concatenate(this_vertidx)
+
+
+# get flip
+def get_flip(label, vertno, inv):
+    vertidx = get_label_vertidx(label, vertno)
     label_flip = _get_label_flip([label], [vertidx], inv['src'][:2])
     label_flip = np.array(label_flip).flatten()
     return label_flip
@@ -54,15 +70,23 @@ def get_filter(K, vertno, inv, roi_label, noise_norm):
     w = np.dot(noise_norm.flatten() * label_flip / len(label_flip), K)
     return w
 
+@lru_cache(maxsize=None)
+def get_parcellation_labels(parc='aparc'):
+    """
+    Read fsaverage labels of parcellation once per session (e.g. 'aparc', 'aparc.a2009s')
+    """
+    return tuple(mne.read_labels_from_annot('fsaverage', parc=parc))
+
+
 # setup roi
-def get_roi_by_name(name):
+def get_roi_by_name(name, parc='aparc'):
+    labels = get_parcellation_labels(parc)
     if type(name) == list:
-        roi_label = mne.read_labels_from_annot('fsaverage',regexp=name[0], parc='aparc')[0]
-        del name[0]
+        roi_label = None
         for elem in name:
-            roi_label = roi_label + mne.read_labels_from_annot('fsaverage',regexp=elem, parc='aparc')[0]
+            label = [label for label in labels if re.search(elem, label.name)][0]
+            roi_label = label if roi_label is None else roi_label + label
     else:
-        labels = mne.read_labels_from_annot('fsaverage', parc='aparc')
         #print([label.name for label in labels])
         roi_label = labels[[label.name for label in labels].index(name)]
     return roi_label
@@ -107,87 +131,149 @@ def get_fsaverage_fwd(info):
     # fwd = mne.convert_forward_solution(fwd, surf_ori=True)
     return fwd
 
-def get_roi_filter(label_name, fs, channels, show=False, method='sLORETA', lambda2=1):
+def get_standard_info(channels, fs):
+    """
+    Create info of EEG channels with standard 10-20 montage: channels names are matched to montage names ignoring case,
+    non-EEG channels (NON_EEG_CHANNELS) are dropped
+    :param channels: channels labels
+    :param fs: sampling frequency
+    :return: info
+    """
     standard_montage = mne.channels.make_standard_montage(kind='standard_1020') # TODO: make this setable (and make sure it is the right one)
-    standard_montage_names = [name.upper() for name in standard_montage.ch_names]
-    for j, channel in enumerate(channels):
-        try:
-            channels[j] = standard_montage.ch_names[standard_montage_names.index(channel.upper())]
-        except ValueError as e:
-            print(f"ERROR ENCOUNTERED: {e}")
-    info = mne.create_info(ch_names=channels, sfreq=fs, ch_types=['eeg' for ch in channels])
-    # drop the ECG and EOG channels #TODO: make this work for other amplifiers /caps other than brainVision (with ECG and EOG)
-    keep_chs = [ elem for elem in info.ch_names if elem not in ['ECG', 'EOG', 'MKIDX']]
-    info.pick_channels(keep_chs)
+    standard_montage_names = {name.upper(): name for name in standard_montage.ch_names}
+    ch_names = []
+    for channel in channels:
+        if channel in NON_EEG_CHANNELS:
+            continue
+        if channel.upper() not in standard_montage_names:
+            logging.warning('Channel {} is not in standard_1020 montage, its position is unknown'.format(channel))
+        ch_names.append(standard_montage_names.get(channel.upper(), channel))
+    info = mne.create_info(ch_names=ch_names, sfreq=fs, ch_types=['eeg' for ch in ch_names])
     info.set_montage(standard_montage, on_missing='ignore')
-    print(f"2: {info.get('dig')}")
+    return info
+
+
+def get_inverse_operator(channels, fs, method='sLORETA', lambda2=1):
+    """
+    Fixed orientation inverse operator of fsaverage head model prepared for method
+    :return: inverse operator, info
+    """
+    info = get_standard_info(channels, fs)
     noise_cov = mne.make_ad_hoc_cov(info, verbose=None)
-    # fwd = get_fwd_solution()
-    loc = info.get('chs')[0]['loc']
-    print(f"ss: {np.isfinite(loc[:3]).all()}")
     fwd = get_fsaverage_fwd(info)
     inv = mne.minimum_norm.make_inverse_operator(info, fwd, noise_cov, fixed=True)
     inv = mne.minimum_norm.prepare_inverse_operator(inv, nave=1, lambda2=lambda2, method=method) # TODO: find out exactly what this does and if it is needed (not in the examples on MNE website)
+    return inv, info
+
+
+def normalize_filters(filters):
+    """
+    Common reference projection and unit norm of each row of filters matrix
+    """
+    filters = filters - filters.mean(-1, keepdims=True)
+    return filters / np.linalg.norm(filters, axis=-1, keepdims=True)
+
+
+def get_roi_filter(label_name, fs, channels, show=False, method='sLORETA', lambda2=1):
+    inv, info = get_inverse_operator(channels, fs, method=method, lambda2=lambda2)
     roi_label = get_roi_by_name(label_name)
     print(f"ROI: {roi_label}")
     K, noise_norm, vertno, source_nn = _assemble_kernel(inv, label=roi_label, method=method, pick_ori=None) # TODO: make sure this is really doing what you want it to
     w = get_filter(K, vertno, inv, roi_label, noise_norm)
     if show:
         mne.viz.plot_topomap(w, info)
-    common_ref_proj = np.eye(len(w)) - np.ones((len(w), len(w)))/len(w) # TODO: this common ref projection - is it needed?
-    w = common_ref_proj.dot(w)
-    w /= np.linalg.norm(w)
-    return w
+    return normalize_filters(w)
+
+
+def get_label_filters(K, noise_norm, vertno, src, labels):
+    """
+    Spatial filters of labels from full inverse kernel: sparse label weights (noise normalization * sign flip / label
+    size) are applied to the kernel by a single GEMM
+    :param K: inverse kernel (n_sources x n_channels)
+    :param noise_norm: noise normalization (n_sources) or None
+    :param vertno: vertices of source space hemispheres
+    :param src: source space hemispheres
+    :param labels: labels list
+    :return: normalized filters matrix (n_labels x n_channels), list of labels with vertices in source space
+    """
+    noise_norm = np.ones(K.shape[0]) if noise_norm is None else np.asarray(noise_norm).flatten()
+    weights = []
+    used_labels = []
+    for label in labels:
+        vertidx = get_label_vertidx(label, vertno)
+        if len(vertidx) == 0:
+            continue
+        label_flip = np.array(_get_label_flip([label], [vertidx], src)).flatten()
+        w = np.zeros(K.shape[0])
+        w[vertidx] = noise_norm[vertidx] * label_flip / len(label_flip)
+        weights.append(w)
+        used_labels.append(label)
+    return normalize_filters(np.dot(np.array(weights), K)), used_labels
+
+
+def get_roi_filter_bank(fs, channels, parc='aparc', method='sLORETA', lambda2=1):
+    """
+    Compute spatial filters for all labels of parcellation in a single pass over the inverse kernel
+    :param fs: sampling frequency
+    :param channels: channels labels
+    :param parc: parcellation name ('aparc', 'aparc.a2009s')
+    :return: filters matrix (n_labels x n_channels), labels names list
+    """
+    inv, info = get_inverse_operator(channels, fs, method=method, lambda2=lambda2)
+    # full kernel (all sources) is assembled only once
+    K, noise_norm, vertno, source_nn = _assemble_kernel(inv, label=None, method=method, pick_ori=None)
+    filters, labels = get_label_filters(K, noise_norm, vertno, inv['src'][:2], get_parcellation_labels(parc))
+    return filters, [label.name for label in labels]
+
+
+def save_roi_filter_bank(file_path, filters, labels, channels, parc='aparc'):
+    with h5py.File(file_path, 'w') as f:
+        f.create_dataset('filters', data=filters)
+        f.create_dataset('labels', data=np.array(labels, dtype='S'))
+        f.create_dataset('channels', data=np.array(channels, dtype='S'))
+        f.attrs['parc'] = parc
+
+
+def load_roi_filter_bank(file_path):
+    with h5py.File(file_path, 'r') as f:
+        filters = f['filters'][:]
+        labels = [s.decode('utf-8') for s in f['labels'][:]]
+        channels = [s.decode('utf-8') for s in f['channels'][:]]
+    return filters, labels, channels
+
+
+def get_roi_filter_from_bank(label_name, fs, channels, parc='aparc', method='sLORETA', lambda2=1, cache_dir=None):
+    """
+    Get ROI spatial filter as a row of the precomputed filters matrix. The matrix is computed for all labels of
+    parcellation on first request and stored in user cache directory
+    :param cache_dir: filters matrices directory (ROI_FILTERS_CACHE_DIR if None)
+    """
+    if isinstance(label_name, list):
+        if len(label_name) != 1:
+            # filter of united label is not a combination of single labels filters
+            return get_roi_filter(list(label_name), fs, channels, method=method, lambda2=lambda2)
+        label_name = label_name[0]
+    cache_dir = ROI_FILTERS_CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    file_path = os.path.join(cache_dir, 'roi_filters_{}_{}_{}.h5'.format(parc, method, lambda2))
+    filters = labels = None
+    if os.path.isfile(file_path):
+        filters, labels, bank_channels = load_roi_filter_bank(file_path)
+        if bank_channels != list(channels):
+            filters = labels = None
+    if filters is None:
+        filters, labels = get_roi_filter_bank(fs, channels, parc=parc, method=method, lambda2=lambda2)
+        save_roi_filter_bank(file_path, filters, labels, channels, parc=parc)
+    return filters[labels.index(label_name)]
+
 
 def get_stc_params(label_name, channels, fs, method='sLORETA', lambda2=1):
-    standard_montage = mne.channels.make_standard_montage(
-        kind='standard_1020')  # TODO: make this setable (and make sure it is the right one)
-    standard_montage_names = [name.upper() for name in standard_montage.ch_names]
-    for j, channel in enumerate(channels):
-        try:
-            channels[j] = standard_montage.ch_names[standard_montage_names.index(channel.upper())]
-        except ValueError as e:
-            print(f"ERROR ENCOUNTERED: {e}")
-    info = mne.create_info(ch_names=channels, sfreq=fs, ch_types=['eeg' for ch in channels])
-    # drop the ECG and EOG channels #TODO: make this work for other amplifiers /caps other than brainVision (with ECG and EOG)
-    keep_chs = [elem for elem in info.ch_names if elem not in ['ECG', 'EOG', 'MKIDX']]
-    info.pick_channels(keep_chs)
-    info.set_montage(standard_montage, on_missing='ignore')
-    print(f"2: {info.get('dig')}")
-    noise_cov = mne.make_ad_hoc_cov(info, verbose=None)
-    # fwd = get_fwd_solution()
-    loc = info.get('chs')[0]['loc']
-    print(f"ss: {np.isfinite(loc[:3]).all()}")
-    fwd = get_fsaverage_fwd(info)
-    inv = mne.minimum_norm.make_inverse_operator(info, fwd, noise_cov, fixed=True)
-    inv = mne.minimum_norm.prepare_inverse_operator(inv, nave=1, lambda2=lambda2,
-                                                    method=method)  # TODO: find out exactly what this does and if it is needed (not in the examples on MNE website)
+    inv, info = get_inverse_operator(channels, fs, method=method, lambda2=lambda2)
     roi_label = get_roi_by_name(label_name)
     return inv, info, roi_label
 
 def get_kernel_results(label_name, fs, channels, show=False, method='sLORETA', lambda2=1):
-    standard_montage = mne.channels.make_standard_montage(
-        kind='standard_1020')  # TODO: make this setable (and make sure it is the right one)
-    standard_montage_names = [name.upper() for name in standard_montage.ch_names]
-    for j, channel in enumerate(channels):
-        try:
-            channels[j] = standard_montage.ch_names[standard_montage_names.index(channel.upper())]
-        except ValueError as e:
-            print(f"ERROR ENCOUNTERED: {e}")
-    info = mne.create_info(ch_names=channels, sfreq=fs, ch_types=['eeg' for ch in channels])
-    # drop the ECG and EOG channels #TODO: make this work for other amplifiers /caps other than brainVision (with ECG and EOG)
-    keep_chs = [elem for elem in info.ch_names if elem not in ['ECG', 'EOG', 'MKIDX']]
-    info.pick_channels(keep_chs)
-    info.set_montage(standard_montage, on_missing='ignore')
-    print(f"2: {info.get('dig')}")
-    noise_cov = mne.make_ad_hoc_cov(info, verbose=None)
-    # fwd = get_fwd_solution()
-    loc = info.get('chs')[0]['loc']
-    print(f"ss: {np.isfinite(loc[:3]).all()}")
-    fwd = get_fsaverage_fwd(info)
-    inv = mne.minimum_norm.make_inverse_operator(info, fwd, noise_cov, fixed=True)
-    inv = mne.minimum_norm.prepare_inverse_operator(inv, nave=1, lambda2=lambda2,
-                                                    method=method)  # TODO: find out exactly what this does and if it is needed (not in the examples on MNE website)
+    inv, info = get_inverse_operator(channels, fs, method=method, lambda2=lambda2)
     roi_label = get_roi_by_name(label_name)
     print(f"ROI: {roi_label}")
     K, noise_norm, vertno, source_nn = _assemble_kernel(inv, label=roi_label, method=method,
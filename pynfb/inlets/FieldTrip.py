@@ -71,7 +71,7 @@ def serialize(A):
     object, if possible.
     """
     if isinstance(A, str):
-        return (0, A)
+        return (0, A.encode('utf-8'))
 
     if isinstance(A, numpy.ndarray):
         dt = A.dtype
@@ -83,12 +83,12 @@ def serialize(A):
             return (DATATYPE_UNKNOWN, None)
 
         if A.flags['C_CONTIGUOUS']:
-            # great, just use the array's buffer interface
-            return (ft, str(A.data))
+            # great, just use the array's buffer interface (flat bytes view)
+            return (ft, A.data.cast('B'))
 
         # otherwise, we need a copy to C order
         AC = A.copy('C')
-        return (ft, str(AC.data))
+        return (ft, AC.data.cast('B'))
 
     if isinstance(A, int):
         return (DATATYPE_INT32, struct.pack('i', A))
@@ -191,20 +191,20 @@ class Event:
         if type_type == DATATYPE_UNKNOWN:
             return None
         type_size = len(type_buf)
-        type_numel = type_size / wordSize[type_type]
+        type_numel = type_size // wordSize[type_type]
 
         value_type, value_buf = serialize(self.value)
         if value_type == DATATYPE_UNKNOWN:
             return None
         value_size = len(value_buf)
-        value_numel = value_size / wordSize[value_type]
+        value_numel = value_size // wordSize[value_type]
 
         bufsize = type_size + value_size
 
         S = struct.pack('IIIIIiiI', type_type, type_numel, value_type,
                         value_numel, int(self.sample), int(self.offset),
                         int(self.duration), bufsize)
-        return S + type_buf + value_buf
+        return S + bytes(type_buf) + bytes(value_buf)
 
 
 class Client:
@@ -214,6 +214,10 @@ class Client:
     def __init__(self):
         self.isConnected = False
         self.sock = []
+        # reusable receive buffers (payloads are returned as views of
+        # self.buffer, which grows if a larger payload is received)
+        self.header_buffer = bytearray(8)
+        self.buffer = bytearray(2 ** 16)
 
     def connect(self, hostname, port=1972):
         """
@@ -223,6 +227,7 @@ class Client:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((hostname, port))
         self.sock.setblocking(True)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.isConnected = True
 
     def disconnect(self):
@@ -237,10 +242,17 @@ class Client:
         if not(self.isConnected):
             raise IOError('Not connected to FieldTrip buffer')
 
-        N = len(request)
-        nw = self.sock.send(request)
-        while nw < N:
-            nw += self.sock.send(request[nw:])
+        self.sock.sendall(request)
+
+    def receiveInto(self, view):
+        """Receive exactly len(view) bytes from socket into writable view."""
+        nr = 0
+        while nr < len(view):
+            n = self.sock.recv_into(view[nr:])
+            if n == 0:
+                self.disconnect()
+                raise IOError('Connection closed by buffer server')
+            nr += n
 
     def sendRequest(self, command, payload=None):
         if payload is None:
@@ -253,23 +265,22 @@ class Client:
     def receiveResponse(self, minBytes=0):
         """
         Receive response from server on socket 's' and return it as
-        (status,bufsize,payload).
+        (status,bufsize,payload). The payload is a memoryview of the reusable
+        receive buffer, valid until the next request.
         """
 
-        resp_hdr = self.sock.recv(8)
-        while len(resp_hdr) < 8:
-            resp_hdr += self.sock.recv(8 - len(resp_hdr))
-
-        (version, command, bufsize) = struct.unpack('HHI', resp_hdr)
+        self.receiveInto(memoryview(self.header_buffer))
+        (version, command, bufsize) = struct.unpack('HHI', self.header_buffer)
 
         if version != VERSION:
             self.disconnect()
             raise IOError('Bad response from buffer server - disconnecting')
 
         if bufsize > 0:
-            payload = self.sock.recv(bufsize)
-            while len(payload) < bufsize:
-                payload += self.sock.recv(bufsize - len(payload))
+            if bufsize > len(self.buffer):
+                self.buffer = bytearray(max(bufsize, 2 * len(self.buffer)))
+            payload = memoryview(self.buffer)[:bufsize]
+            self.receiveInto(payload)
         else:
             payload = None
         return (command, bufsize, payload)
@@ -311,9 +322,9 @@ class Client:
                 (chunk_type, chunk_len) = struct.unpack(
                     'II', payload[offset:offset + 8])
                 offset += 8
-                if offset + chunk_len < bufsize:
+                if offset + chunk_len > bufsize:
                     break
-                H.chunks[chunk_type] = payload[offset:offset + chunk_len]
+                H.chunks[chunk_type] = bytes(payload[offset:offset + chunk_len])
                 offset += chunk_len
 
             if CHUNK_CHANNEL_NAMES in H.chunks:
@@ -327,12 +338,12 @@ class Client:
     def putHeader(self, nChannels, fSample, dataType, labels=None,
                   chunks=None):
         haveLabels = False
-        extras = ''
+        extras = b''
         if not(labels is None):
-            serLabels = ''
+            serLabels = b''
             try:
                 for n in range(0, nChannels):
-                    serLabels += labels[n] + '\0'
+                    serLabels += labels[n].encode('utf-8') + b'\0'
             except:
                 raise ValueError('Channels names (labels), if given,'
                                  ' must be a list of N=numChannels strings')
@@ -365,7 +376,8 @@ class Client:
         getData([indices]) -- retrieve data samples and return them as a
         Numpy array, samples in rows(!). The 'indices' argument is optional,
         and if given, must be a tuple or list with inclusive, zero-based
-        start/end indices.
+        start/end indices. The array is a view of the receive buffer (no
+        copy), valid until the next request.
         """
 
         if index is None:
@@ -393,8 +405,9 @@ class Client:
         if bfsiz < bufsize - 16 or datype >= len(numpyType):
             raise IOError('Invalid DATA packet received')
 
-        raw = payload[16:bfsiz + 16]
-        D = numpy.ndarray((nsamp, nchans), dtype=numpyType[datype], buffer=raw)
+        D = numpy.frombuffer(payload, dtype=numpyType[datype],
+                             count=nsamp * nchans, offset=16)
+        D = D.reshape((nsamp, nchans))
 
         return D
 
@@ -418,6 +431,8 @@ class Client:
         (status, bufsize, resp_buf) = self.receiveResponse()
         if status == GET_ERR:
             return []
+        # events own their data, so copy out of the receive buffer
+        resp_buf = bytes(resp_buf) if resp_buf is not None else b''
 
         if status != GET_OK:
             self.disconnect()
@@ -444,11 +459,11 @@ class Client:
         if isinstance(E, Event):
             buf = E.serialize()
         else:
-            buf = ''
+            buf = b''
             num = 0
             for e in E:
                 if not(isinstance(e, Event)):
-                    raise 'Element %i in given list is not an Event' % num
+                    raise ValueError('Element %i in given list is not an Event' % num)
                 buf = buf + e.serialize()
                 num = num + 1
 
@@ -479,7 +494,8 @@ class Client:
 
         request = struct.pack('HHI', VERSION, PUT_DAT, 16 + dataBufSize)
         dataDef = struct.pack('IIII', nChan, nSamp, dataType, dataBufSize)
-        self.sendRaw(request + dataDef + dataBuf)
+        self.sendRaw(request + dataDef)
+        self.sendRaw(dataBuf)
 
         (status, bufsize, resp_buf) = self.receiveResponse()
         if status != PUT_OK:
@@ -498,6 +514,11 @@ class Client:
         return struct.unpack('II', resp_buf[0:8])
 
     def wait(self, nsamples, nevents, timeout):
+        """
+        wait(nsamples, nevents, timeout) -- block until the buffer holds more
+        than nsamples samples or more than nevents events, or timeout [ms]
+        expires. Returns current (nsamples, nevents).
+        """
         request = struct.pack('HHIIII', VERSION, WAIT_DAT,
                               12, int(nsamples), int(nevents), int(timeout))
         self.sendRaw(request)
@@ -1,27 +1,16 @@
 import numpy as np
 from pynfb.signal_processing.filters import ButterFilter, IdentityFilter
+from pynfb.inlets.stream_merger import AlignedStream, StreamMerger
 EVENTS_CHANNEL_NAME = 'EVENTS'
 
 
-def interp_nans(y, empty_fill_val=0):
-    nans = np.isnan(y)
-    if sum(~nans) == 0:
-        y = np.ones_like(y) * empty_fill_val
-    else:
-        y[nans] = np.interp(nans.nonzero()[0], (~nans).nonzero()[0], y[~nans])
-    return y
-
-
-
 class ChannelsSelector:
     def __init__(self, inlet, include=None, exclude=None, start_from_1=True, subtractive_channel=None, dc=False,
-                 events_inlet=None, aux_inlets=None, aux_interpolate=False, prefilter_band=(None, None)):
+                 events_inlet=None, aux_inlets=None, aux_policy='sparse', prefilter_band=(None, None)):
         self.last_y = 0
         self.inlet = inlet
         self.events_inlet = events_inlet
         self.aux_inlets = aux_inlets
-        self.aux_previous_chunks = []
-        self.aux_interpolate = aux_interpolate
 
         # get names in uppercase format
         names = [n.upper() for n in self.inlet.get_channels_labels()]
@@ -29,15 +18,17 @@ class ChannelsSelector:
         # cut after first non alphabetic numerical (e.g. 'Fp1-A1' -> 'Fp1')
         names = [''.join([ch if ch.isalnum() else ' ' for ch in name]).split()[0] for name in names]
 
-        # append aux inlets
+        # secondary streams aligned to main stream timestamps: events channel then aux inlets channels
+        n_channels = len(names)
+        secondary_streams = []
+        if self.events_inlet is not None:
+            names += [EVENTS_CHANNEL_NAME]
+            secondary_streams.append(AlignedStream(self.events_inlet, n_channels=1, policy='sparse', fill_value=0))
         if self.aux_inlets is not None:
             for aux_inlet in self.aux_inlets:
                 names += aux_inlet.get_channels_labels()
-                self.aux_previous_chunks.append(np.zeros_like((1, aux_inlet.n_channels)))
-
-        # append events inlet
-        if self.events_inlet is not None:
-            names += [EVENTS_CHANNEL_NAME]
+                secondary_streams.append(AlignedStream(aux_inlet, policy=aux_policy))
+        self.merger = StreamMerger(n_channels, secondary_streams) if secondary_streams else None
         self.channels_names = names
         print('Channels:', names)
 
@@ -104,38 +95,22 @@ class ChannelsSelector:
         else:
             self.prefilter = ButterFilter(prefilter_band, self.inlet.get_frequency(),
                                           len(self.inlet.get_channels_labels()))
+        self.float_processing = self.dc or not isinstance(self.prefilter, IdentityFilter)
 
 
     def get_next_chunk(self):
         chunk, timestamp = self.inlet.get_next_chunk()
         if chunk is not None:
+            if self.float_processing and chunk.dtype.kind in 'iu':
+                # integer streams are kept as is, DC blocker and pre-filter need floats
+                chunk = chunk.astype('float64')
             if self.dc:
                 chunk = self.dc_blocker(chunk)
 
             chunk = self.prefilter.apply(chunk)
 
-            if self.events_inlet is not None:
-                events, events_timestamp = self.events_inlet.get_next_chunk()
-                aug_chunk = np.zeros((chunk.shape[0], 1))
-                if events is not None:
-                    aug_chunk[np.searchsorted(timestamp[:-1], events_timestamp)] = events
-                chunk = np.hstack([chunk, aug_chunk])
-
-            if self.aux_inlets is not None:
-                for j_aux_inlet, aux_inlet in enumerate(self.aux_inlets):
-                    aux_chunk_short, aux_timestamp = aux_inlet.get_next_chunk()
-                    aux_chunk = np.zeros((chunk.shape[0], aux_inlet.n_channels)) * np.nan
-                    if aux_chunk_short is not None:
-                        for k in range(aux_inlet.n_channels):
-                            aux_chunk[np.searchsorted(timestamp[:-1], aux_timestamp), k] = aux_chunk_short[:, k]
-                            if self.aux_interpolate:
-                                aux_chunk[:, k] = interp_nans(aux_chunk[:, k])
-                        self.aux_previous_chunks[j_aux_inlet] = aux_chunk
-                    else:
-                        if self.aux_interpolate:
-                            aux_chunk = np.ones((chunk.shape[0], aux_inlet.n_channels)) * \
-                                        self.aux_previous_chunks[j_aux_inlet][-1]
-                    chunk = np.hstack([chunk, aux_chunk])
+            if self.merger is not None:
+                chunk = self.merger.merge(chunk, timestamp)
 
             if self.sub_channel_index is None:
                 return chunk[:, self.indices], chunk[:, self.other_indices], timestamp
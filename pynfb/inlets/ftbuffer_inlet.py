@@ -1,10 +1,21 @@
-import sys
-from pynfb.inlets.FieldTrip import Client as FieldTrip_Client, numpyType
 import time
+import numpy as np
+from pynfb.inlets.FieldTrip import Client as FieldTrip_Client, numpyType
+
+# WAIT_DAT events threshold which is never exceeded (wait for samples only)
+NO_EVENTS_THRESHOLD = 0xFFFFFFFF
+# GET_HDR retry period [s] while buffer has no header
+HEADER_RETRY_PERIOD = 0.1
 
 
 class FieldTripBufferInlet:
-    def __init__(self, host='localhost', port=1972):
+    def __init__(self, host='localhost', port=1972, wait_timeout=0, header_timeout=10):
+        """
+        :param wait_timeout: WAIT_DAT timeout [ms] of get_next_chunk: 0 for non-blocking polling from GUI timer, > 0
+        to block until new samples arrive (worker thread)
+        :param header_timeout: time [s] to wait for the header if acquisition has not put it to the buffer yet
+        :raise IOError: if there is no header after header_timeout
+        """
         ftc = FieldTrip_Client()
         try:
             ftc.connect(host, port)  # might throw IOError
@@ -13,45 +24,73 @@ class FieldTripBufferInlet:
             buffer on localhost:1972. Did you start neuromag2ft on sinuhe?')
             raise SystemExit
         self.ftc = ftc
-        self.last_repeated_sample = 0
+        self.address = '{}:{}'.format(host, port)
+        self.wait_timeout = wait_timeout
+        # header is requested once (and again if buffer is flushed), samples count is tracked by WAIT_DAT responses
+        self.header = self._wait_header(header_timeout)
+        self.n_samples = None
+
+    def _wait_header(self, timeout):
+        deadline = time.time() + timeout
+        header = self.ftc.getHeader()
+        while header is None and time.time() < deadline:
+            time.sleep(HEADER_RETRY_PERIOD)
+            header = self.ftc.getHeader()
+        if header is None:
+            self.ftc.disconnect()
+            raise IOError('FieldTrip buffer on {} has no header after {} s, is acquisition started?'.format(
+                self.address, timeout))
+        return header
 
     def get_next_chunk(self):
-        H = self.ftc.getHeader()
-        last_sample = H.nSamples - 1
-        if last_sample == self.last_repeated_sample:  # no new data in FT buffer
+        """
+        Wait for new samples (one WAIT_DAT round trip if there are no new samples) and get them
+        :return: chunk and timestamp mock or None, None. Chunk of float64 stream is a view of the client receive buffer
+        valid until the next call
+        """
+        n_samples, _ = self.ftc.wait(self.n_samples or 0, NO_EVENTS_THRESHOLD, self.wait_timeout)
+        if self.n_samples is not None and n_samples < self.n_samples:
+            # buffer is flushed or header is put again (acquisition restart)
+            header = self.ftc.getHeader()
+            if header is not None and (header.nChannels, header.fSample) != (self.header.nChannels,
+                                                                             self.header.fSample):
+                raise IOError('FieldTrip buffer on {} header is changed: {} channels at {} Hz -> {} channels at {} '
+                              'Hz'.format(self.address, self.header.nChannels, self.header.fSample,
+                                          header.nChannels, header.fSample))
+            self.n_samples = None
+        if n_samples == 0 or n_samples == self.n_samples:  # no new data in FT buffer
             return None, None
         # If it is the first time then retrieve only one sample
-        if self.last_repeated_sample == 0:
-            retrieve_from = last_sample
+        if self.n_samples is None:
+            retrieve_from = n_samples - 1
         # Else retrieve all the new samples
         else:
-            retrieve_from = self.last_repeated_sample + 1
-        chunk = self.ftc.getData([retrieve_from, last_sample])
-        self.last_repeated_sample = last_sample
-        chunk = chunk.astype('float64')
-        if len(chunk) == 0:
+            retrieve_from = self.n_samples
+        chunk = self.ftc.getData([retrieve_from, n_samples - 1])
+        self.n_samples = n_samples
+        if chunk is None or len(chunk) == 0:
             return None, None
-        else:
-            return chunk, chunk[:, 0]*0  # chunk, timestamp mock
+        chunk = chunk.astype('float64', copy=False)
+        return chunk, np.zeros(len(chunk))  # chunk, timestamp mock
 
     def update_action(self):
         pass
 
     def save_info(self, file):
         with open(file, 'w', encoding="utf-8") as f:
-            f.write(str(self.ftc.getHeader()))
+            f.write(self.info_as_xml())
 
     def info_as_xml(self):
-        return str(self.ftc.getHeader())
+        return str(self.header)
 
     def get_frequency(self):
-        return self.ftc.getHeader().fSample
+        return self.header.fSample
 
     def get_n_channels(self):
-        return self.ftc.getHeader().nChannels
+        return self.header.nChannels
 
     def get_channels_labels(self):
-        labels = self.ftc.getHeader().labels
+        labels = self.header.labels
         if len(labels) == 0:
             labels = ['Ch{}'.format(k + 1) for k in range(self.get_n_channels())]
         return labels
@@ -61,6 +100,6 @@ class FieldTripBufferInlet:
 
 
 if __name__ == '__main__':
-    inlet = FieldTripBufferInlet()
+    inlet = FieldTripBufferInlet(wait_timeout=1000)
     while True:
         print(inlet.get_next_chunk())
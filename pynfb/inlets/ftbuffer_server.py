@@ -0,0 +1,229 @@
+"""
+FieldTrip buffer (V1) server emulator in pure Python (asyncio) for tests and benchmarks of FieldTrip clients without
+a real buffer process. Supports PUT_HDR, PUT_DAT, GET_HDR, GET_DAT, WAIT_DAT, FLUSH_DAT and GET_EVT (no events are
+stored). Samples are kept in a ring buffer of max_samples samples.
+
+Usage:
+    python -m pynfb.inlets.ftbuffer_server [--host localhost] [--port 1972] [--generate 64x1000]
+"""
+import argparse
+import asyncio
+import struct
+import threading
+import time
+
+import numpy as np
+
+from pynfb.inlets.FieldTrip import Client, VERSION, PUT_HDR, PUT_DAT, PUT_OK, PUT_ERR, GET_HDR, GET_DAT, GET_EVT, \
+    GET_OK, GET_ERR, FLUSH_DAT, FLUSH_OK, FLUSH_ERR, WAIT_DAT, WAIT_OK, WAIT_ERR, numpyType, DATATYPE_FLOAT32, \
+    DATATYPE_FLOAT64
+
+
+class FieldTripBufferServer:
+    def __init__(self, host='localhost', port=1972, max_samples=600000):
+        """
+        :param host: host to listen
+        :param port: port to listen (0 for any free port, see self.port after start)
+        :param max_samples: ring buffer length [samples]
+        """
+        self.host = host
+        self.port = port
+        self.max_samples = max_samples
+        self.header = None
+        self.header_chunks = b''
+        self.samples = None
+        self.n_samples = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.data_event = None
+        self.writers = set()
+
+    # state
+
+    def put_header(self, payload):
+        n_channels, _, _, fs, data_type, chunks_size = struct.unpack('IIIfII', payload[:24])
+        if data_type >= len(numpyType) or len(payload) < 24 + chunks_size:
+            return PUT_ERR
+        self.header = (n_channels, fs, data_type)
+        self.header_chunks = bytes(payload[24:24 + chunks_size])
+        self.samples = np.zeros((self.max_samples, n_channels), dtype=numpyType[data_type])
+        self.n_samples = 0
+        return PUT_OK
+
+    def put_data(self, payload):
+        n_channels, n_samples, data_type, size = struct.unpack('IIII', payload[:16])
+        if self.header is None or (n_channels, data_type) != (self.header[0], self.header[2]) or \
+                len(payload) < 16 + size or size != n_samples * n_channels * self.samples.itemsize:
+            return PUT_ERR
+        data = np.frombuffer(payload, dtype=self.samples.dtype, count=n_samples * n_channels, offset=16)
+        data = data.reshape(n_samples, n_channels)[-self.max_samples:]
+        indices = np.arange(self.n_samples + n_samples - len(data), self.n_samples + n_samples) % self.max_samples
+        self.samples[indices] = data
+        self.n_samples += n_samples
+        self.data_event.set()
+        self.data_event = asyncio.Event()
+        return PUT_OK
+
+    def get_header(self):
+        if self.header is None:
+            return GET_ERR, b''
+        n_channels, fs, data_type = self.header
+        return GET_OK, struct.pack('IIIfII', n_channels, self.n_samples, 0, fs, data_type,
+                                   len(self.header_chunks)) + self.header_chunks
+
+    def get_data(self, payload):
+        if self.header is None:
+            return GET_ERR, b''
+        first = max(self.n_samples - self.max_samples, 0)
+        start, stop = struct.unpack('II', payload[:8]) if len(payload) >= 8 else (first, self.n_samples - 1)
+        if not first <= start <= stop < self.n_samples:
+            return GET_ERR, b''
+        data = self.samples[np.arange(start, stop + 1) % self.max_samples]
+        return GET_OK, struct.pack('IIII', data.shape[1], data.shape[0], self.header[2], data.nbytes) + data.tobytes()
+
+    async def wait_data(self, payload):
+        n_samples, n_events, timeout = struct.unpack('III', payload[:12])
+        if self.header is None:
+            return WAIT_ERR, b''
+        deadline = self.loop.time() + timeout / 1000
+        while self.n_samples <= n_samples and self.loop.time() < deadline:
+            try:
+                await asyncio.wait_for(self.data_event.wait(), deadline - self.loop.time())
+            except asyncio.TimeoutError:
+                break
+        return WAIT_OK, struct.pack('II', self.n_samples, 0)
+
+    # protocol
+
+    async def handle_client(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                version, command, size = struct.unpack('HHI', await reader.readexactly(8))
+                payload = memoryview(await reader.readexactly(size)) if size > 0 else memoryview(b'')
+                if version != VERSION:
+                    break
+                response = b''
+                if command == PUT_HDR:
+                    status = self.put_header(payload)
+                elif command == PUT_DAT:
+                    status = self.put_data(payload)
+                elif command == GET_HDR:
+                    status, response = self.get_header()
+                elif command == GET_DAT:
+                    status, response = self.get_data(payload)
+                elif command == WAIT_DAT:
+                    status, response = await self.wait_data(payload)
+                elif command == GET_EVT:
+                    status = GET_OK if self.header is not None else GET_ERR
+                elif command == FLUSH_DAT:
+                    status = FLUSH_OK if self.header is not None else FLUSH_ERR
+                    self.n_samples = 0
+                else:
+                    status = GET_ERR
+                writer.write(struct.pack('HHI', VERSION, status, len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _start(self):
+        self.data_event = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _shutdown(self):
+        # closing of connections finishes clients handlers
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        self.data_event.set()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run(self, started=None):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._start())
+        print('FieldTrip buffer server listens on {}:{}'.format(self.host, self.port))
+        if started is not None:
+            started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self._shutdown())
+            self.loop.close()
+
+    def run_forever(self):
+        """
+        Run server in current thread
+        """
+        self._run()
+
+    def start_in_a_thread(self):
+        """
+        Run server in a daemon thread
+        :return: self (port is resolved after start)
+        """
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started, ), daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None and self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+
+
+def run_ftbuffer_generator(host='localhost', port=1972, n_channels=64, fs=1000, chunk_len=10, duration=None,
+                           dtype='float32', stop_event=None, time_channel=False):
+    """
+    Load generator: put synthetic multichannel data (noise and 10 Hz sine) to FieldTrip buffer in real time
+    :param chunk_len: samples per PUT_DAT request
+    :param duration: streaming duration [s] (infinite if None)
+    :param dtype: 'float32' or 'float64'
+    :param stop_event: threading.Event to stop streaming
+    :param time_channel: write time.perf_counter() of sending to the first channel (for latency measurements,
+    float64 only)
+    :return: number of sent samples
+    """
+    ftc = Client()
+    ftc.connect(host, port)
+    ftc.putHeader(n_channels, fs, DATATYPE_FLOAT64 if dtype == 'float64' else DATATYPE_FLOAT32,
+                  labels=['Ch{}'.format(k + 1) for k in range(n_channels)])
+    chunk = np.random.randn(chunk_len, n_channels).astype(dtype)
+    sine = np.sin(2 * np.pi * 10 * np.arange(int(fs)) / fs).astype(dtype)
+    n_sent = 0
+    start = time.perf_counter()
+    while (duration is None or n_sent < duration * fs) and not (stop_event is not None and stop_event.is_set()):
+        n_required = int((time.perf_counter() - start) * fs)
+        while n_sent + chunk_len <= n_required:
+            chunk[:, -1] = sine[np.arange(n_sent, n_sent + chunk_len) % len(sine)]
+            if time_channel:
+                chunk[:, 0] = time.perf_counter()
+            ftc.putData(chunk)
+            n_sent += chunk_len
+        time.sleep(chunk_len / fs / 4)
+    ftc.disconnect()
+    return n_sent
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FieldTrip buffer server emulator')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1972)
+    parser.add_argument('--max-samples', type=int, default=600000)
+    parser.add_argument('--generate', default=None, help='stream synthetic data "<n_channels>x<fs>", e.g. 64x1000')
+    args = parser.parse_args()
+    server = FieldTripBufferServer(args.host, args.port, args.max_samples)
+    if args.generate is None:
+        server.run_forever()
+    else:
+        server.start_in_a_thread()
+        n_channels, fs = args.generate.split('x')
+        run_ftbuffer_generator(server.host, server.port, int(n_channels), float(fs))
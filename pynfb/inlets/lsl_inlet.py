@@ -1,14 +1,33 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 from pylsl import StreamInlet, resolve_byprop, resolve_bypred
-from pylsl.pylsl import lib, StreamInfo, FOREVER, c_int, c_double, byref, handle_error
+from pylsl.pylsl import lib, StreamInfo, FOREVER, c_int, c_double, c_size_t, byref, handle_error
+from ctypes import POINTER
 import xml.etree.ElementTree as ET
-import time
+import logging
 import socket
+from concurrent.futures import ThreadPoolExecutor
 fmt2string = ['undefined', 'float32', 'float64', 'str', 'int32', 'int16',
               'int8', 'int64']
 LSL_STREAM_NAMES = ['AudioCaptureWin', 'NVX136_Data', 'example']
 LSL_RESOLVE_TIMEOUT = 10
+LSL_MAX_CHUNK_LEN = 1024
+
+
+def pull_chunk_into(inlet, data, timestamps, timeout=0.0):
+    """
+    Pull chunk of samples directly into preallocated arrays (without python lists)
+    :param inlet: pylsl StreamInlet of numeric stream
+    :param data: C-contiguous (max_samples, n_channels) array of the stream native dtype
+    :param timestamps: C-contiguous (max_samples, ) float64 array
+    :return: number of pulled samples
+    """
+    errcode = c_int()
+    n_values = inlet.do_pull_chunk(inlet.obj, data.ctypes.data_as(POINTER(inlet.value_type)),
+                                   timestamps.ctypes.data_as(POINTER(c_double)), c_size_t(data.size),
+                                   c_size_t(data.shape[0]), c_double(timeout), byref(errcode))
+    handle_error(errcode)
+    return n_values // data.shape[1]
 
 
 class FixedStreamInfo(StreamInfo):
@@ -25,29 +44,45 @@ class FixedStreamInlet(StreamInlet):
 
 
 class LSLInlet:
-    def __init__(self, name=LSL_STREAM_NAMES[2], only_this_host=False):
+    def __init__(self, name=LSL_STREAM_NAMES[2], only_this_host=False, max_chunklen=LSL_MAX_CHUNK_LEN):
         if not only_this_host:
             streams = resolve_byprop('name', name, timeout=LSL_RESOLVE_TIMEOUT)
         else:
             streams = resolve_bypred("name='{}' and hostname='{}'".format(name, socket.gethostname()))
 
         self.inlet = None
-        self.dtype = 'float64'
         if len(streams) > 0:
             self.inlet = FixedStreamInlet(streams[0], max_buflen=2)
-            # self.dtype = fmt2string[self.inlet.info().channel_format()]
             print('Connected to {} LSL stream successfully'.format(name))
-            self.n_channels = self.inlet.info().channel_count()
         else:
             raise ConnectionError('Cannot connect to "{}" LSL stream'.format(name))
 
+        # stream metadata is fetched and parsed once
+        self.name = name
+        info = self.inlet.info()
+        self.xml = info.as_xml()
+        self.n_channels = info.channel_count()
+        self.dtype = fmt2string[info.channel_format()]
+        self.fs = info.nominal_srate()
+        self.channels_labels = self._parse_channels_labels()
+
+        # reusable buffers for samples of native dtype and timestamps
+        self.max_chunklen = max_chunklen
+        if self.dtype != 'str':
+            self.buffer = np.zeros((max_chunklen, self.n_channels), dtype=self.dtype)
+            self.timestamps_buffer = np.zeros(max_chunklen)
+
     def get_next_chunk(self):
-        # get next chunk
-        chunk, timestamp = self.inlet.pull_chunk()
-        # convert to numpy array
-        chunk = np.array(chunk, dtype=self.dtype)
-        # return first n_channels channels or None if empty chunk
-        return (chunk, timestamp) if chunk.shape[0] > 0 else (None, None)
+        """
+        Pull available samples (max_chunklen at most)
+        :return: chunk and timestamps arrays (views of reusable buffers valid until the next call) or None, None if
+        there are no samples
+        """
+        if self.dtype == 'str':
+            chunk, timestamp = self.inlet.pull_chunk(max_samples=self.max_chunklen)
+            return (np.array(chunk), np.array(timestamp)) if len(chunk) > 0 else (None, None)
+        n_samples = pull_chunk_into(self.inlet, self.buffer, self.timestamps_buffer)
+        return (self.buffer[:n_samples], self.timestamps_buffer[:n_samples]) if n_samples > 0 else (None, None)
 
     def update_action(self):
         pass
@@ -57,30 +92,44 @@ class LSLInlet:
             f.write(self.info_as_xml())
 
     def info_as_xml(self):
-        xml = self.inlet.info().as_xml()
-        return xml
+        return self.xml
 
     def get_frequency(self):
-        return self.inlet.info().nominal_srate()
+        return self.fs
 
     def get_n_channels(self):
-        return self.inlet.info().channel_count()
+        return self.n_channels
 
     def get_channels_labels(self):
-        for t in range(3):
-            time.sleep(0.5*(t+1))
-            try:
-                # print('wow') TODO too many repetitions
-                rt = ET.fromstring(self.info_as_xml())
-                channels_tree = rt.find('desc').findall("channel") or rt.find('desc').find("channels").findall(
-                    "channel")
-                labels = [(ch.find('label') if ch.find('label') is not None else ch.find('name')).text
-                          for ch in channels_tree]
-                return labels
-            except OSError:
-                print('OSError during reading channels names', t+1)
-        return ['channel'+str(n+1) for n in range(self.get_n_channels())]
+        return self.channels_labels
+
+    def _parse_channels_labels(self):
+        try:
+            rt = ET.fromstring(self.xml)
+            channels_tree = rt.find('desc').findall("channel") or rt.find('desc').find("channels").findall(
+                "channel")
+            labels = [(ch.find('label') if ch.find('label') is not None else ch.find('name')).text
+                      for ch in channels_tree]
+        except (ET.ParseError, AttributeError):
+            logging.warning('Channels names not found in "{}" stream info, default names are used'.format(self.name))
+            return ['channel'+str(n+1) for n in range(self.n_channels)]
+        if len(labels) != self.n_channels:
+            logging.warning('"{}" stream info has {} channels names for {} channels, default names are used instead of '
+                            '{}'.format(self.name, len(labels), self.n_channels, labels))
+            return ['channel'+str(n+1) for n in range(self.n_channels)]
+        return labels
 
     def disconnect(self):
         del self.inlet
         self.inlet = None
+
+
+def resolve_inlets(names, **kwargs):
+    """
+    Connect to LSL streams concurrently
+    :param names: streams names
+    :param kwargs: LSLInlet kwargs
+    :return: list of LSLInlet
+    """
+    with ThreadPoolExecutor(max(len(names), 1)) as pool:
+        return list(pool.map(lambda name: LSLInlet(name, **kwargs), names))
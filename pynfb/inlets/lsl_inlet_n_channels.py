@@ -2,9 +2,8 @@
 import numpy as np
 from pylsl import StreamInlet, resolve_byprop
 import time
+from .lsl_inlet import pull_chunk_into, fmt2string
 #from ..generators import ch_names
-fmt2string = ['undefined', 'float32', 'float64', 'str', 'int32', 'int16',
-              'int8', 'int64']
 LSL_STREAM_NAMES = ['AudioCaptureWin', 'NVX136_Data', 'example']
 LSL_RESOLVE_TIMEOUT = 10
 
@@ -12,23 +11,29 @@ ch_names = ['Fc1', 'Fc3', 'Fc5', 'C1', 'C3', 'C5', 'Cp1', 'Cp3', 'Cp5', 'Cz', 'P
 'Cp2', 'Cp4', 'Cp6', 'C2', 'C4', 'C6', 'Fc2', 'Fc4', 'Fc6']
 
 class LSLInlet:
-    def __init__(self, name=LSL_STREAM_NAMES[2], max_chunklen=8, n_channels=20):
+    def __init__(self, name=LSL_STREAM_NAMES[2], max_chunklen=8, n_channels=20, max_pull_len=1024):
         streams = resolve_byprop('name', name, timeout=LSL_RESOLVE_TIMEOUT)
         self.inlet = None
-        self.dtype = 'float64'
         if len(streams) > 0:
             self.inlet = StreamInlet(streams[0], max_buflen=1, max_chunklen=max_chunklen)
-            # self.dtype = fmt2string[self.inlet.info().channel_format()]
-            print(self.dtype)
-        self.n_channels = n_channels if n_channels else self.inlet.info().channel_count()
+        else:
+            raise ConnectionError('Cannot connect to "{}" LSL stream'.format(name))
+        info = self.inlet.info()
+        self.dtype = fmt2string[info.channel_format()]
+        self.n_channels = n_channels if n_channels else info.channel_count()
+
+        # reusable buffers for samples of native dtype and timestamps
+        self.buffer = np.zeros((max_pull_len, info.channel_count()), dtype=self.dtype)
+        self.timestamps_buffer = np.zeros(max_pull_len)
 
     def get_next_chunk(self):
-        # get next chunk
-        chunk, timestamp = self.inlet.pull_chunk()
-        # convert to numpy array
-        chunk = np.array(chunk, dtype=self.dtype)
-        # return first n_channels channels or None if empty chunk
-        return chunk[:, :self.n_channels] if chunk.shape[0] > 0 else None
+        """
+        Pull available samples (max_pull_len at most)
+        :return: first n_channels channels of chunk (view of reusable buffer valid until the next call) or None if
+        there are no samples
+        """
+        n_samples = pull_chunk_into(self.inlet, self.buffer, self.timestamps_buffer)
+        return self.buffer[:n_samples, :self.n_channels] if n_samples > 0 else None
 
     def update_action(self):
         pass
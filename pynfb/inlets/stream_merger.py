@@ -0,0 +1,108 @@
+import numpy as np
+
+ALIGNMENT_POLICIES = ['sparse', 'hold', 'nearest', 'linear']
+
+
+class AlignedStream:
+    """
+    Secondary stream aligned to primary stream timestamps. Samples later than the primary chunk are assigned to its last
+    sample. Policies:
+        'sparse' - each sample is placed at the first primary sample not earlier than it, others are fill_value
+        'hold' - last received sample (sample-and-hold)
+        'nearest' - nearest in time received sample
+        'linear' - linear interpolation between received samples, last sample is held
+    Last received sample is kept across chunks, so 'hold', 'nearest' and 'linear' are continuous at chunk boundaries.
+    """
+    def __init__(self, inlet, n_channels=None, policy='sparse', fill_value=np.nan):
+        """
+        :param inlet: inlet with get_next_chunk() returning (chunk, timestamp) or (None, None)
+        :param n_channels: number of channels (inlet.n_channels if None)
+        :param policy: one of ALIGNMENT_POLICIES
+        :param fill_value: value of primary samples without secondary data
+        """
+        if policy not in ALIGNMENT_POLICIES:
+            raise ValueError('Unknown alignment policy "{}", use one of {}'.format(policy, ALIGNMENT_POLICIES))
+        self.inlet = inlet
+        self.n_channels = inlet.n_channels if n_channels is None else n_channels
+        self.policy = policy
+        self.fill_value = fill_value
+        self.last_timestamp = None
+        self.last_sample = None
+
+    def align(self, timestamp, out):
+        """
+        Pull secondary stream chunk and write it aligned to primary timestamps
+        :param timestamp: (n_samples, ) primary chunk timestamps
+        :param out: (n_samples, n_channels) output block
+        """
+        chunk, chunk_timestamp = self.inlet.get_next_chunk()
+        if chunk is None:
+            out[:] = self.fill_value if self.policy == 'sparse' or self.last_sample is None else self.last_sample
+            return
+        chunk = chunk.reshape(len(chunk_timestamp), self.n_channels)
+
+        if self.policy == 'sparse':
+            out[:] = self.fill_value
+            out[np.searchsorted(timestamp[:-1], chunk_timestamp)] = chunk
+        else:
+            times = np.minimum(chunk_timestamp, timestamp[-1])
+            samples = chunk
+            if self.last_sample is not None:
+                times = np.concatenate([[self.last_timestamp], times])
+                samples = np.concatenate([self.last_sample[None], chunk])
+
+            # indices of last sample not later (prev) and first sample later (next) than each primary sample
+            next_indices = np.searchsorted(times, timestamp, side='right')
+            prev_indices = next_indices - 1
+            no_prev = prev_indices < 0
+            prev_indices[no_prev] = 0
+            next_indices = np.minimum(next_indices, len(times) - 1)
+
+            if self.policy == 'hold':
+                out[:] = samples[prev_indices]
+            elif self.policy == 'nearest':
+                use_next = no_prev | (times[next_indices] - timestamp < timestamp - times[prev_indices])
+                out[:] = samples[np.where(use_next, next_indices, prev_indices)]
+            else:
+                dt = times[next_indices] - times[prev_indices]
+                weights = np.divide(timestamp - times[prev_indices], dt, out=np.zeros(len(timestamp)), where=dt > 0)
+                prev_samples = samples[prev_indices]
+                out[:] = prev_samples + weights[:, None] * (samples[next_indices] - prev_samples)
+            if self.policy != 'nearest':
+                out[no_prev] = self.fill_value
+            self.last_timestamp = times[-1]
+            self.last_sample = np.array(chunk[-1], dtype=out.dtype)
+
+
+class StreamMerger:
+    """
+    Merges secondary streams into primary stream chunks: primary chunk and aligned secondary streams are written to
+    preallocated (n_samples, n_channels + sum of secondary n_channels) output block
+    """
+    def __init__(self, n_channels, streams, max_chunklen=1024):
+        """
+        :param n_channels: number of primary stream channels
+        :param streams: list of AlignedStream
+        :param max_chunklen: initial output block length (grows if longer chunk is merged)
+        """
+        self.n_primary_channels = n_channels
+        self.streams = streams
+        self.n_channels = n_channels + sum(stream.n_channels for stream in streams)
+        self.buffer = np.zeros((max_chunklen, self.n_channels))
+
+    def merge(self, chunk, timestamp):
+        """
+        :param chunk: (n_samples, n_channels) primary chunk
+        :param timestamp: (n_samples, ) primary timestamps
+        :return: merged chunk (view of reusable buffer valid until the next call)
+        """
+        n_samples = chunk.shape[0]
+        if n_samples > self.buffer.shape[0]:
+            self.buffer = np.zeros((n_samples, self.n_channels))
+        out = self.buffer[:n_samples]
+        out[:, :self.n_primary_channels] = chunk
+        start = self.n_primary_channels
+        for stream in self.streams:
+            stream.align(timestamp, out[:, start:start + stream.n_channels])
+            start += stream.n_channels
+        return out
@@ -1,32 +1,49 @@
 from pylsl import StreamInfo, StreamOutlet
 import numpy as np
 
+# LSL channel formats of samples dtypes
+CHANNEL_FORMATS = {'float32': 'float32', 'float64': 'double64'}
+
+
 class SignalsOutlet:
-    def __init__(self, signals, fs, name='NFBLab_data1'):
-        self.info = StreamInfo(name=name, type='', channel_count=len(signals), source_id='nfblab42',
-                               nominal_srate=fs)
+    def __init__(self, signals, fs, name='NFBLab_data1', chunk_size=0, max_buffered=360,
+                 source_id='nfblab42', dtype='float32'):
+        """
+        :param signals: signals names
+        :param fs: sampling frequency
+        :param chunk_size: LSL outlet chunk size (0 - chunks are pushed as they are)
+        :param max_buffered: LSL outlet buffer length [s]
+        :param source_id: LSL stream source id
+        :param dtype: 'float32' or 'float64' samples format (chunks of this dtype are pushed without copy)
+        """
+        self.dtype = np.dtype(dtype)
+        self.info = StreamInfo(name=name, type='', channel_count=len(signals), nominal_srate=fs,
+                               channel_format=CHANNEL_FORMATS[self.dtype.name], source_id=source_id)
         self.info.desc().append_child_value("manufacturer", "BioSemi")
         channels = self.info.desc().append_child("channels")
         for c in signals:
             channels.append_child("channel").append_child_value("name", c)
-        self.outlet = StreamOutlet(self.info)
+        self.outlet = StreamOutlet(self.info, chunk_size=chunk_size, max_buffered=max_buffered)
 
     def push_sample(self, data):
         self.outlet.push_sample(data)
 
     def push_repeated_chunk(self, data, n=1):
-        #chunk = repeat(data, n).reshape(-1, n).T.tolist()
-        #self.outlet.push_chunk(chunk)
-        for k in range(n):
-            self.outlet.push_sample(data)
+        """
+        Push sample repeated n times as one chunk
+        """
+        self.push_chunk(np.repeat(np.asarray(data, dtype=self.dtype)[None], n, axis=0))
 
     def push_chunk(self, data, n=1):
-        self.outlet.push_chunk(data)
-        # with open("../bci_current_state.pkl", "w", encoding="utf-8") as fp:
-        #    fp.write(str(np.array(data)[:, 0].mean()))
-
+        """
+        Push chunk
+        :param data: (n_samples, n_signals) array (pushed without copy if it is C-contiguous array of outlet dtype) or
+        nested list
+        """
+        # pylsl reinterprets array buffer as outlet format, so dtype and layout must match exactly
+        self.outlet.push_chunk(np.ascontiguousarray(data, dtype=self.dtype))
 
 
 if __name__ == '__main__':
-    outlet = SignalsOutlet(['alpha', 'beta'])
+    outlet = SignalsOutlet(['alpha', 'beta'], fs=500)
     print(outlet.info.as_xml())
\ No newline at end of file
@@ -3,6 +3,7 @@ from scipy.signal import welch
 from scipy import fftpack
 import h5py
 from pynfb.serializers.xml_ import get_lsl_info_from_xml
+from pynfb.serializers.reader import ExperimentReader
 import pandas as pd
 import pylab as plt
 
@@ -176,13 +177,21 @@ def band_hilbert(x, fs, band, N=None, axis=-1):
 
 
 def load_data(file_path, drop_channels=()):
-    with h5py.File(file_path) as f:
-        fs, channels, p_names = get_info(f, drop_channels)
-        data = [f['protocol{}/raw_data'.format(k + 1)][:] for k in range(len(p_names))]
-
-        df = pd.DataFrame(np.concatenate(data), columns=channels)
-        df['block_name'] = np.concatenate([[p]*len(d) for p, d in zip(p_names, data)])
-        df['block_number'] = np.concatenate([[j + 1]*len(d) for j, d in enumerate(data)])
+    """
+    Load raw data to data frame with channels columns (select channels by names: events stream channel is 'EVENTS',
+    aux streams channels follow it)
+    :param drop_channels: names of channels to skip
+    :return: data frame, fs, protocols names, channels
+    """
+    with ExperimentReader(file_path) as reader:
+        fs = reader.fs
+        channels = [channel for channel in reader.channels if channel not in drop_channels]
+        p_names = [info.name for info in reader.protocols]
+        print('fs: {}\nselected channels {}: {}\nprotocol_names: {}'.format(fs, len(channels), channels, p_names))
+
+        df = pd.DataFrame(reader.session('raw_data')[:, channels], columns=channels)
+        df['block_name'] = np.concatenate([[info.name] * (info.stop - info.start) for info in reader.protocols])
+        df['block_number'] = np.concatenate([[info.number] * (info.stop - info.start) for info in reader.protocols])
 
     return df, fs, p_names, channels
 
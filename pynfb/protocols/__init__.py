@@ -127,21 +127,26 @@ class Protocol:
                 self.mock_recordings = self.mock_recordings[::-1]
                 self.mock_recordings_signals = self.mock_recordings_signals[::-1]
 
-    def close_protocol(self, raw=None, signals=None, protocols=list(), protocols_seq=None, raw_file=None, marks=None):
+    def close_protocol(self, raw=None, signals=None, protocols=list(), protocols_seq=None, raw_file=None, marks=None,
+                       protocols_cache=None, protocols_csd=None):
         # action if ssd in the end checkbox was checked
         if self.beep_after:
             SingleBeep().try_to_play()
 
         if self.ssd_in_the_end or self.auto_bci_fit:
 
-            # stop main timer
-            if self.timer:
+            # stop main timer (bci model is fitted in background)
+            if self.timer and self.ssd_in_the_end:
                 self.timer.stop()
 
             # get recorded raw data
             if raw_file is not None and protocols_seq is not None:
-                x = load_h5py_protocols_raw(raw_file, [j for j in range(len(protocols_seq) - 1)])
-                x.append(raw)
+                if protocols_cache is not None:
+                    x = protocols_cache.get_protocols_raw([j for j in range(len(protocols_seq) - 1)])
+                else:
+                    x = load_h5py_protocols_raw(raw_file, [j for j in range(len(protocols_seq) - 1)])
+                x.append(raw[:])  # raw can be lazy recorder view
+                raw = x[-1]
             else:
                 raise AttributeError('Attributes protocol_seq and raw_file should be not a None')
 
@@ -152,20 +157,21 @@ class Protocol:
             X = np.vstack([x for x, name in zip(x, protocols_seq) if name in bci_labels])
             y = np.concatenate([np.ones(len(x), dtype=int) * bci_labels[name]
                                 for x, name in zip(x, protocols_seq) if name in bci_labels], 0)
-            # find and fit first bci signal:
+            # find and fit first bci signal in background (protocols with bci source wait for the model):
             bci_signal = [signal for signal in self.signals if isinstance(signal, BCISignal)][0]
-            bci_signal.fit_model(X, y)
+            self.experiment.fit_bci_model(bci_signal, X, y)
 
         if self.ssd_in_the_end:
             signal_manager = SignalsSSDManager(self.signals, x, self.montage, self, signals, protocols,
-                                               sampling_freq=self.freq, protocol_seq=protocols_seq, marks=marks)
+                                               sampling_freq=self.freq, protocol_seq=protocols_seq, marks=marks,
+                                               csd=protocols_csd)
             signal_manager.test_signal.connect(lambda: self.experiment.start_test_protocol(
                 protocols[signal_manager.combo_protocols.currentIndex()]
             ))
             signal_manager.test_closed_signal.connect(self.experiment.close_test_protocol)
             signal_manager.exec_()
 
-        if self.ssd_in_the_end or self.auto_bci_fit:
+        if self.ssd_in_the_end:
             # run main timer
             if self.timer:
                 self.timer.start(1000 * 1. / self.freq)
@@ -1,9 +1,10 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from ...widgets.parameter_slider import ParameterSlider
+from ...signal_processing.decompositions import ICA_DEFAULTS, get_ica_methods
 
 
 class Sliders(QtWidgets.QWidget):
-    def __init__(self, sample_freq, reg_coef=True, stimulus_split=True, band=None):
+    def __init__(self, sample_freq, reg_coef=True, stimulus_split=True, band=None, ica=False):
         super(Sliders, self).__init__()
         h_layout = QtWidgets.QHBoxLayout()
         v_layout = QtWidgets.QVBoxLayout()
@@ -16,7 +17,9 @@ class Sliders(QtWidgets.QWidget):
                         'regularizator': 0.05,
                         'bandpass_high': 45 if band is None else band[1],
                         'prestim_interval': 500,
-                        'poststim_interval': 500}
+                        'poststim_interval': 500,
+                        'ica_variance': 100,
+                        'ica_decimation': ICA_DEFAULTS['decimation']}
 
 
         # regularizator slider
@@ -55,6 +58,30 @@ class Sliders(QtWidgets.QWidget):
         self.parameters['bandpass_high'].slider.valueChanged.connect(lambda: self.revert_button.setEnabled(True))
         v_layout.addWidget(self.parameters['bandpass_high'])
 
+        # ica backend, pca reduction and decimation
+        self.ica_method_combo = QtWidgets.QComboBox()
+        self.ica_method_combo.addItems(get_ica_methods())
+        self.ica_method_combo.setCurrentText(ICA_DEFAULTS['method'])
+        self.ica_method_combo.currentIndexChanged.connect(lambda: self.revert_button.setEnabled(True))
+        ica_method_layout = QtWidgets.QHBoxLayout()
+        ica_method_layout.addWidget(QtWidgets.QLabel('ICA method:'), 1)
+        ica_method_layout.addWidget(self.ica_method_combo, 4)
+        self.ica_method_widget = QtWidgets.QWidget()
+        self.ica_method_widget.setLayout(ica_method_layout)
+        v_layout.addWidget(self.ica_method_widget)
+        self.parameters['ica_variance'] = ParameterSlider('PCA explained variance:', 80, 100, 5,
+                                                          value=self.defaults['ica_variance'], units='%', integer=True)
+        self.parameters['ica_variance'].slider.valueChanged.connect(lambda: self.revert_button.setEnabled(True))
+        v_layout.addWidget(self.parameters['ica_variance'])
+        self.parameters['ica_decimation'] = ParameterSlider('Fit decimation:', 1, 10, 1,
+                                                            value=self.defaults['ica_decimation'], integer=True)
+        self.parameters['ica_decimation'].slider.valueChanged.connect(lambda: self.revert_button.setEnabled(True))
+        v_layout.addWidget(self.parameters['ica_decimation'])
+        if not ica:
+            self.ica_method_widget.hide()
+            self.parameters['ica_variance'].hide()
+            self.parameters['ica_decimation'].hide()
+
         button_layout = QtWidgets.QVBoxLayout()
         h_layout.addLayout(button_layout)
         # apply button
@@ -70,6 +97,7 @@ class Sliders(QtWidgets.QWidget):
     def restore_defaults(self):
         for key in self.defaults.keys():
             self.parameters[key].setValue(self.defaults[key])
+        self.ica_method_combo.setCurrentText(ICA_DEFAULTS['method'])
         self.revert_button.setEnabled(False)
 
     def set_default_band(self, low, high):
@@ -79,6 +107,7 @@ class Sliders(QtWidgets.QWidget):
 
     def getValues(self):
         values = dict([(key, param.getValue()) for key, param in self.parameters.items()])
+        values['ica_method'] = self.ica_method_combo.currentText()
         return values
 
 
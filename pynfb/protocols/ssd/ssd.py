@@ -1,7 +1,16 @@
-from scipy.signal import butter, lfilter, filtfilt
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from scipy.signal import butter, lfilter, filtfilt, get_window
 from scipy.linalg import eigh, inv, eig
 import numpy as np
 
+# min number of channels to solve sweep eigenproblems in a process pool (pool start costs more for small problems)
+PARALLEL_MIN_CHANNELS = 64
+# (n_workers, executor) of sweeps, pool is shared because spawned workers start slowly
+_sweep_pool = None
+
 
 def butter_bandpass(lowcut, highcut, fs, order=3):
     nyq = 0.5 * fs
@@ -42,7 +51,14 @@ def ssd(x, fs, bands, butter_order=3, regularization_coef=0.05):
         cov_flankers = 0.5 * cov_x_filtered[0] + 0.5 * cov_x_filtered[2]
     else:
         raise ValueError('Wrong format for <band> argument')
+    return ssd_from_covariances(cov_peak, cov_flankers, regularization_coef)
+
 
+def ssd_from_covariances(cov_peak, cov_flankers, regularization_coef=0.05):
+    """
+    Solve SSD generalized eigenproblem for peak and flankers covariance matrices
+    :return: vals, vecs and topographies in descending order of vals
+    """
     # find filters
     regularization = lambda z: z + regularization_coef * np.trace(z) * np.eye(z.shape[0]) / z.shape[0]
     vals, vecs = eigh(regularization(cov_peak), regularization(cov_flankers))
@@ -60,21 +76,205 @@ def ssd(x, fs, bands, butter_order=3, regularization_coef=0.05):
     return vals[reversed_slice], vecs[:, reversed_slice], topo
 
 
-def ssd_analysis(x, sampling_frequency, freqs, flanker_delta=2, flanker_margin=0, regularization_coef=0.05):
+class CrossSpectrumAccumulator:
+    """
+    Running cross-spectral density of multichannel data (Welch method, Hann window, 50% overlap): streamed chunks are
+    buffered and each completed segment is added to the sum, so band covariances of all data streamed so far are
+    available at any moment without keeping or refiltering the data (see BandCovariances.from_accumulators)
+    """
+    def __init__(self, fs, n_channels, max_freq=None, resolution=0.25, n_per_segment=None):
+        """
+        :param max_freq: max frequency of accumulated bins [Hz] (Nyquist frequency if None)
+        :param resolution: frequency resolution [Hz] defines segments length, bands edges are rounded to it
+        :param n_per_segment: segment length (overrides resolution)
+        """
+        self.n_per_segment = n_per_segment or max(int(round(fs / resolution)), 1)
+        freqs = np.fft.rfftfreq(self.n_per_segment, 1 / fs)
+        n_bins = len(freqs) if max_freq is None else min(int(np.searchsorted(freqs, max_freq, 'right')) + 1,
+                                                          len(freqs))
+        self.freqs = freqs[:n_bins]
+        self.max_freq = self.freqs[-1] if n_bins < len(freqs) else fs / 2
+        self.window = get_window('hann', self.n_per_segment)
+        self.step = max(self.n_per_segment // 2, 1)
+        self.csd_sum = np.zeros((n_bins, n_channels, n_channels))
+        self.n_segments = 0
+        self.buffer = np.zeros((self.n_per_segment, n_channels))
+        self.n_buffered = 0
+
+    def add_segments(self, segments):
+        """
+        :param segments: array (n_segments x n_per_segment x n_channels)
+        """
+        segments = (segments - segments.mean(1, keepdims=True)) * self.window[:, None]
+        spectra = np.fft.rfft(segments, axis=1)[:, :len(self.freqs)].transpose(1, 0, 2)
+        self.csd_sum += np.matmul(spectra.conj().transpose(0, 2, 1), spectra).real
+        self.n_segments += segments.shape[0]
+
+    def add(self, x, batch_size=8):
+        """
+        Add all segments of x at once (buffered samples are not used)
+        """
+        starts = np.arange(0, x.shape[0] - self.n_per_segment + 1, self.step)
+        for k in range(0, len(starts), batch_size):
+            self.add_segments(np.stack([x[start:start + self.n_per_segment] for start in starts[k:k + batch_size]]))
+        return self
+
+    def update(self, chunk):
+        """
+        Add chunk of stream, completed segments are added to the sum
+        """
+        k = 0
+        while k < chunk.shape[0]:
+            n = min(self.n_per_segment - self.n_buffered, chunk.shape[0] - k)
+            self.buffer[self.n_buffered:self.n_buffered + n] = chunk[k:k + n]
+            self.n_buffered += n
+            k += n
+            if self.n_buffered == self.n_per_segment:
+                self.add_segments(self.buffer[None])
+                self.buffer[:-self.step] = self.buffer[self.step:]
+                self.n_buffered -= self.step
+
+    def finish(self):
+        """
+        Stop stream: buffered samples are dropped and the sum is kept in float32 (accumulators of all recorded protocols
+        are kept for the session)
+        """
+        self.csd_sum = self.csd_sum.astype('float32')
+        self.buffer = None
+        self.n_buffered = 0
+        return self
+
+    def get_csd(self):
+        """
+        Mean one-sided CSD scaled by Parseval theorem to covariance of windowed segments
+        """
+        csd = self.csd_sum.astype('float64') * 2 / (max(self.n_segments, 1) * self.n_per_segment * np.sum(self.window ** 2))
+        csd[0] /= 2
+        return csd
+
+
+class BandCovariances:
+    """
+    Band-limited covariance matrices of multichannel signal from single cross-spectral density estimate (Welch method,
+    Hann window, 50% overlap): covariance of band [low, high) is the sum of CSD bins in the band, so any band of
+    a sweep costs one subtraction of cumulative sums instead of filtering of the whole recording
+    """
+    def __init__(self, x, fs, max_freq=None, resolution=0.25, batch_size=8):
+        """
+        :param x: data (n_samples x n_channels)
+        :param max_freq: max frequency of bands [Hz] (Nyquist frequency if None)
+        :param resolution: frequency resolution [Hz] defines segments length, bands edges are rounded to it
+        :param batch_size: number of segments transformed at once
+        """
+        n_per_segment = max(min(int(round(fs / resolution)), x.shape[0]), 1)
+        accumulator = CrossSpectrumAccumulator(fs, x.shape[1], max_freq, n_per_segment=n_per_segment)
+        self._set_csd(accumulator.add(x, batch_size))
+
+    def _set_csd(self, accumulator, csd=None):
+        self.freqs = accumulator.freqs
+        self.max_freq = accumulator.max_freq
+        csd = accumulator.get_csd() if csd is None else csd
+        self.cumulative = np.concatenate([np.zeros((1, ) + csd.shape[1:]), np.cumsum(csd, 0)])
+
+    @classmethod
+    def from_accumulators(cls, accumulators):
+        """
+        Band covariances of concatenated streams of accumulators (with the same sampling frequency and resolution)
+        """
+        covariances = cls.__new__(cls)
+        n_segments = sum(accumulator.n_segments for accumulator in accumulators)
+        csd = sum(accumulator.get_csd() * accumulator.n_segments for accumulator in accumulators) / max(n_segments, 1)
+        covariances._set_csd(accumulators[0], csd)
+        return covariances
+
+    def transform(self, matrix):
+        """
+        Band covariances of x.dot(matrix)
+        """
+        covariances = self.__class__.__new__(self.__class__)
+        covariances.freqs = self.freqs
+        covariances.max_freq = self.max_freq
+        covariances.cumulative = np.matmul(np.matmul(matrix.T, self.cumulative), matrix)
+        return covariances
+
+    def __call__(self, band):
+        """
+        Covariance matrix of band [low, high) Hz
+        """
+        if band[1] > self.max_freq:
+            raise ValueError('Band {} exceeds max frequency {} Hz of covariances'.format(band, self.max_freq))
+        eps = 1e-9
+        low, high = np.searchsorted(self.freqs, [max(band[0], 0) - eps, band[1] - eps])
+        return self.cumulative[high] - self.cumulative[low]
+
+
+def _ssd_from_covariances_task(args):
+    ind, cov_peak, cov_flankers, regularization_coef = args
+    return (ind, ) + ssd_from_covariances(cov_peak, cov_flankers, regularization_coef)
+
+
+def get_sweep_bands(freqs, flanker_delta=2, flanker_margin=0):
     freq_delta = freqs[1] - freqs[0]
-    bands = [
+    return [
         [[fc - flanker_delta - flanker_margin, fc - flanker_margin],
          [fc, fc + freq_delta],
          [fc + freq_delta + flanker_margin, fc + freq_delta + flanker_delta + flanker_margin]]
         for fc in freqs]
-    major_vals = []
-    topographies = []
-    filters = []
-    for band in bands:
-        vals, vecs, topos = ssd(x, sampling_frequency, band, regularization_coef=regularization_coef)
-        major_vals.append(vals)
-        topographies.append(topos)
-        filters.append(vecs)
+
+
+def get_sweep_pool(n_workers):
+    """
+    Process pool with at least n_workers workers shared by sweeps. Workers are spawned (fork would copy GUI process
+    with its inlet threads)
+    """
+    global _sweep_pool
+    if _sweep_pool is None or _sweep_pool[0] < n_workers:
+        if _sweep_pool is not None:
+            _sweep_pool[1].shutdown(wait=False)
+        _sweep_pool = (n_workers, ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('spawn')))
+    return _sweep_pool[1]
+
+
+def ssd_sweep(x, sampling_frequency, freqs, flanker_delta=2, flanker_margin=0, regularization_coef=0.05,
+              covariances=None, n_jobs=None):
+    """
+    SSD for each central frequency of freqs, results are yielded as soon as they are ready (not in freqs order)
+    :param covariances: BandCovariances of x (computed if None)
+    :param n_jobs: number of processes (all CPUs if x has PARALLEL_MIN_CHANNELS channels or more and 1 otherwise)
+    :return: generator of (index of frequency, vals, vecs, topographies)
+    """
+    bands = get_sweep_bands(freqs, flanker_delta, flanker_margin)
+    if covariances is None:
+        covariances = BandCovariances(x, sampling_frequency, max_freq=bands[-1][2][1])
+    tasks = [(ind, covariances(band[1]), 0.5 * covariances(band[0]) + 0.5 * covariances(band[2]),
+              regularization_coef) for ind, band in enumerate(bands)]
+    if n_jobs is None:
+        n_jobs = os.cpu_count() if x.shape[1] >= PARALLEL_MIN_CHANNELS else 1
+    if n_jobs == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield _ssd_from_covariances_task(task)
+        return
+    pool = get_sweep_pool(min(n_jobs, len(tasks)))
+    futures = [pool.submit(_ssd_from_covariances_task, task) for task in tasks]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # not consumed results of stopped sweep
+        for future in futures:
+            future.cancel()
+
+
+def ssd_analysis(x, sampling_frequency, freqs, flanker_delta=2, flanker_margin=0, regularization_coef=0.05,
+                 covariances=None, n_jobs=None):
+    major_vals = [None] * len(freqs)
+    topographies = [None] * len(freqs)
+    filters = [None] * len(freqs)
+    for ind, vals, vecs, topos in ssd_sweep(x, sampling_frequency, freqs, flanker_delta, flanker_margin,
+                                            regularization_coef, covariances, n_jobs):
+        major_vals[ind] = vals
+        topographies[ind] = topos
+        filters[ind] = vecs
     return np.array(major_vals), np.array(topographies), filters
 
 
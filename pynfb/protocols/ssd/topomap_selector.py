@@ -1,17 +1,17 @@
-from PyQt5 import QtGui, QtWidgets
-from ...protocols.ssd.ssd import ssd_analysis
+from PyQt5 import QtCore, QtGui, QtWidgets
+from ...protocols.ssd.ssd import ssd_sweep, BandCovariances
 from ...protocols.ssd.sliders import Sliders
 from ...protocols.ssd.topomap_canvas import TopographicMapCanvas
 from ...protocols.ssd.interactive_barplot import ClickableBarplot
 
 from ...widgets.parameter_slider import ParameterSlider
-from numpy import arange, dot, array, eye
+from numpy import arange, dot, array, eye, zeros
 from numpy.linalg import pinv
 
 
 
 class TopomapSelector(QtWidgets.QWidget):
-    def __init__(self, data, pos, names, sampling_freq=500, **kwargs):
+    def __init__(self, data, pos, names, sampling_freq=500, covariances=None, **kwargs):
         super(TopomapSelector, self).__init__(**kwargs)
 
         # layouts
@@ -35,6 +35,8 @@ class TopomapSelector(QtWidgets.QWidget):
         self.names = names
         self.data = data
         self.sampling_freq = sampling_freq
+        # band covariances of data are computed once (or accumulated during protocols) and shared by all recomputes
+        self.covariances = covariances
 
         # topomap canvas layout
         topo_layout = QtWidgets.QVBoxLayout()
@@ -101,8 +103,13 @@ class TopomapSelector(QtWidgets.QWidget):
             return dot(filters, inv)
         return filter
 
-    def update_data(self, data):
+    def update_data(self, data, transform=None):
+        """
+        :param transform: matrix applied to previous data (covariances are transformed instead of recomputing)
+        """
         self.data = data
+        self.covariances = self.covariances.transform(transform) if (transform is not None and
+                                                                     self.covariances is not None) else None
         self.recompute()
 
     def get_current_bandpass(self):
@@ -118,12 +125,25 @@ class TopomapSelector(QtWidgets.QWidget):
         self.freqs = arange(self.x_left, self.x_right, self.x_delta)
         self.flanker_delta = parameters['flanker_bandwidth']
         self.flanker_margin = parameters['flanker_margin']
-        self.major_vals, self.topographies, self.filters = ssd_analysis(self.data,
-                                                                        sampling_frequency=self.sampling_freq,
-                                                                        freqs=self.freqs,
-                                                                        regularization_coef=parameters['regularizator'],
-                                                                        flanker_delta=self.flanker_delta,
-                                                                        flanker_margin=self.flanker_margin)
+        max_freq = self.freqs[-1] + self.x_delta + self.flanker_margin + self.flanker_delta
+        if self.covariances is None or self.covariances.max_freq < max_freq:
+            self.covariances = BandCovariances(self.data, self.sampling_freq, max_freq=max_freq)
+
+        # sweep results are shown as soon as they are ready
+        n_channels = self.data.shape[1]
+        self.major_vals = zeros((len(self.freqs), n_channels))
+        self.topographies = zeros((len(self.freqs), n_channels, n_channels))
+        self.filters = [None] * len(self.freqs)
+        self.selector.plot(self.freqs, self.major_vals[:, 0])
+        for ind, vals, vecs, topos in ssd_sweep(self.data, self.sampling_freq, self.freqs,
+                                                flanker_delta=self.flanker_delta,
+                                                flanker_margin=self.flanker_margin,
+                                                regularization_coef=parameters['regularizator'],
+                                                covariances=self.covariances):
+            self.major_vals[ind], self.filters[ind], self.topographies[ind] = vals, vecs, topos
+            self.selector.reset_y(self.major_vals[:, 0])
+            self.selector.setYRange(0, self.major_vals[:, 0].max())
+            QtWidgets.QApplication.processEvents(QtCore.QEventLoop.ExcludeUserInputEvents)
         self.selector.plot(self.freqs, self.major_vals[:, 0])
         self.selector.set_current_by_value(current_x)
         self.change_topomap()
@@ -3,7 +3,6 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from mne import create_info
 from mne.io import RawArray
 from mne.preprocessing import ICA
-from sklearn.metrics import mutual_info_score
 
 from ...serializers.xml_ import get_lsl_info_from_xml
 from ...postprocessing.helpers import dc_blocker
@@ -13,19 +12,18 @@ from ...protocols.ssd.sliders_csp import Sliders
 from ...signal_processing.filters import SpatialRejection
 from ...widgets.helpers import ch_names_to_2d_pos, WaitMessage
 from ..._titles import WAIT_BAR_MESSAGES
-from ...signal_processing.decompositions import CSPDecomposition, ICADecomposition, CSPDecompositionStimulus
+from ...signal_processing.decompositions import CSPDecomposition, ICADecomposition, CSPDecompositionStimulus, \
+    mutual_info, score_components, get_rejection_matrix
 from ...signal_processing.helpers import stimulus_split
 from time import time
 
-def mutual_info(x, y, bins=100):
-    c_xy = np.histogram2d(x, y, bins)[0]
-    mi = mutual_info_score(None, None, contingency=c_xy)
-    return mi
+# scores of components sorting by reference channel (name -> score_components score)
+SORT_SCORES = {'Mutual info': 'mutual_info', 'Correlation': 'correlation'}
 
 
 class ICADialog(QtWidgets.QDialog):
     def __init__(self, raw_data, channel_names, fs, parent=None, decomposition=None, mode='ica', filters=None,
-                 scores=None, states=None, labels=None, _stimulus_split=False, marks=None, band=None):
+                 scores=None, states=None, labels=None, _stimulus_split=False, marks=None, band=None, covariances=None):
         super(ICADialog, self).__init__(parent)
         self.setWindowTitle(mode.upper())
         self.setMinimumWidth(800)
@@ -58,11 +56,13 @@ class ICADialog(QtWidgets.QDialog):
         self.raw_data = raw_data
         self.labels = labels
         self.data = self.raw_data
+        # band covariances of states (accumulated during protocols) are used by CSP instead of data filtering
+        self.covariances = covariances if (mode == 'csp' and not _stimulus_split) else None
 
         # unmixing matrix estimation
         timer = time()
         if decomposition is None:
-            self.decomposition.fit(self.raw_data, self.labels)
+            self.fit_decomposition()
         self.scores = self.decomposition.scores
         self.unmixing_matrix = self.decomposition.filters
         self.topographies = self.decomposition.topographies
@@ -94,7 +94,8 @@ class ICADialog(QtWidgets.QDialog):
         self.update_band_checkbox = QtWidgets.QCheckBox('Update band')
 
         # setup sliders
-        self.sliders = Sliders(fs, reg_coef=(mode == 'csp'), stimulus_split=_stimulus_split, band=band)
+        self.sliders = Sliders(fs, reg_coef=(mode == 'csp'), stimulus_split=_stimulus_split, band=band,
+                               ica=(mode == 'ica'))
         self.sliders.apply_button.clicked.connect(self.recompute)
         self.lambda_csp3 = states
         layout.addWidget(self.sliders)
@@ -108,7 +109,12 @@ class ICADialog(QtWidgets.QDialog):
             self.sort_combo.addItems(channel_names)
             self.sort_combo.setCurrentIndex(self.decomposition.sorted_channel_index)
             self.sort_combo.currentIndexChanged.connect(self.sort_by_mutual)
+            self.sort_score_combo = QtWidgets.QComboBox()
+            self.sort_score_combo.setMaximumWidth(100)
+            self.sort_score_combo.addItems(list(SORT_SCORES))
+            self.sort_score_combo.currentIndexChanged.connect(self.sort_by_mutual)
             sort_layout.addWidget(QtWidgets.QLabel('Sort by: '))
+            sort_layout.addWidget(self.sort_score_combo)
             sort_layout.addWidget(self.sort_combo)
             sort_layout.setAlignment(QtCore.Qt.AlignLeft)
             layout.addLayout(sort_layout)
@@ -135,15 +141,15 @@ class ICADialog(QtWidgets.QDialog):
 
     def sort_by_mutual(self):
         ind = self.sort_combo.currentIndex()
-        self.scores = [mutual_info(self.components[:, j], self.data[:, ind]) for j in range(self.components.shape[1])]
+        score = SORT_SCORES[self.sort_score_combo.currentText()]
+        self.scores = list(score_components(self.components, self.data[:, ind], scores=(score, ))[score])
         self.table.set_scores(self.scores)
 
     def reject_and_close(self):
         indexes = self.table.get_checked_rows()
-        unmixing_matrix = self.unmixing_matrix.copy()
-        inv = np.linalg.pinv(self.unmixing_matrix)
-        unmixing_matrix[:, indexes] = 0
-        self.rejection = SpatialRejection(np.dot(unmixing_matrix, inv), rank=len(indexes), type_str=self.mode,
+        # components are projected out (un-mixing matrix can be non-square after PCA reduction)
+        rejection = get_rejection_matrix(self.unmixing_matrix, self.topographies, indexes)
+        self.rejection = SpatialRejection(rejection, rank=len(indexes), type_str=self.mode,
                                           topographies=self.topographies[:, indexes])
         self.close()
 
@@ -158,19 +164,34 @@ class ICADialog(QtWidgets.QDialog):
         parameters = self.sliders.getValues()
         self.bandpass = (parameters['bandpass_low'], parameters['bandpass_high'])
         self.decomposition.set_parameters(**parameters)
-        self.decomposition.fit(self.raw_data, self.labels)
+        self.fit_decomposition()
         self.scores = self.decomposition.scores
         self.unmixing_matrix = self.decomposition.filters
         self.topographies = self.decomposition.topographies
         self.components = np.dot(self.decomposition.temporal_filter.apply(self.raw_data), self.unmixing_matrix)
         self.table.redraw(self.components, self.topographies, self.unmixing_matrix, self.scores)
 
+    def fit_decomposition(self):
+        if self.covariances is not None:
+            try:
+                self.decomposition.fit_covariances([covariances(self.decomposition.band)
+                                                    for covariances in self.covariances])
+                return
+            except ValueError:
+                # band is out of accumulated frequencies range
+                pass
+        self.decomposition.fit(self.raw_data, self.labels)
+
     @classmethod
     def get_rejection(cls, raw_data, channel_names, fs, decomposition=None, mode='ica', states=None, labels=None,
-                      _stimulus_split=False, marks=None, band=None):
+                      _stimulus_split=False, marks=None, band=None, covariances=None):
+        """
+        :param covariances: pair of BandCovariances of CSP states (CSP is fitted by data if None)
+        """
         wait_bar = WaitMessage(mode.upper() + WAIT_BAR_MESSAGES['CSP_ICA']).show_and_return()
         selector = cls(raw_data, channel_names, fs, decomposition=decomposition, mode=mode, states=states,
-                       labels=labels, _stimulus_split=_stimulus_split, marks=marks, band=band)
+                       labels=labels, _stimulus_split=_stimulus_split, marks=marks, band=band,
+                       covariances=covariances)
         wait_bar.close()
         result = selector.exec_()
         bandpass = selector.bandpass if selector.update_band_checkbox.isChecked() else None
@@ -10,7 +10,8 @@ from ..widgets.spatial_filter_setup import SpatialFilterSetup
 
 
 class SelectSSDFilterWidget(QtWidgets.QDialog):
-    def __init__(self, data, pos, names=None, sampling_freq=500, parent=None, selector_class=TopomapSelector):
+    def __init__(self, data, pos, names=None, sampling_freq=500, parent=None, selector_class=TopomapSelector,
+                 covariances=None):
         super(SelectSSDFilterWidget, self).__init__(parent)
         self.data = data
         self.rejections = []
@@ -25,7 +26,8 @@ class SelectSSDFilterWidget(QtWidgets.QDialog):
         layout.addWidget(top_label)
 
         # topomap selector
-        self.selector = selector_class(data, pos, names=names, sampling_freq=sampling_freq)
+        selector_kwargs = {'covariances': covariances} if covariances is not None else {}
+        self.selector = selector_class(data, pos, names=names, sampling_freq=sampling_freq, **selector_kwargs)
         layout.addWidget(self.selector)
 
         # reject, select radio
@@ -70,9 +72,9 @@ class SelectSSDFilterWidget(QtWidgets.QDialog):
         rejection = self.selector.get_current_filter(reject=True)
         self.rejections.append(SpatialRejection(rejection, rank=1, type_str='ssd',
                                                 topographies=self.selector.get_current_topo()))
-        self.data = np.dot(self.data, self.selector.get_current_filter(reject=True))
-        self.selector.update_data(self.data)
-        self.selector.recompute()
+        transform = self.selector.get_current_filter(reject=True)
+        self.data = np.dot(self.data, transform)
+        self.selector.update_data(self.data, transform=transform)
 
     def select_action(self):
         self.filter = self.selector.get_current_filter()
@@ -82,9 +84,12 @@ class SelectSSDFilterWidget(QtWidgets.QDialog):
         self.close()
 
     @classmethod
-    def select_filter_and_bandpass(cls, data, pos, names=None, sampling_freq=500, parent=None):
+    def select_filter_and_bandpass(cls, data, pos, names=None, sampling_freq=500, parent=None, covariances=None):
+        """
+        :param covariances: BandCovariances of data (computed from data if None)
+        """
         wait_bar = WaitMessage(WAIT_BAR_MESSAGES['SSD']).show_and_return()
-        selector = cls(data, pos, names=names, sampling_freq=sampling_freq, parent=parent)
+        selector = cls(data, pos, names=names, sampling_freq=sampling_freq, parent=parent, covariances=covariances)
         wait_bar.close()
 
         result = selector.exec_()
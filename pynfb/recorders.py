@@ -0,0 +1,264 @@
+import os
+from bisect import bisect_left, bisect_right
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+
+
+def expand_events(indices, values, n_samples, fill_value=np.nan):
+    """
+    Expand sparse (sample_index, value) change points to dense array, value holds until the next change point
+    :param indices: sorted samples indices of change points
+    :param values: values of change points
+    :param n_samples: length of dense array
+    :param fill_value: value before the first change point
+    :return: dense array
+    """
+    data = np.full(n_samples, fill_value, dtype='float64')
+    indices = np.asarray(indices, dtype=int)
+    if len(indices) > 0:
+        data[indices[0]:] = np.repeat(np.asarray(values, dtype='float64'), np.diff(np.append(indices, n_samples)))
+    return data
+
+
+def _equal(a, b):
+    return a == b or (a != a and b != b)
+
+
+def _get_range(key, n_samples, grow=False):
+    """
+    Convert int or contiguous slice key to [start, stop) samples range (numpy-like)
+    :param grow: allow range beyond n_samples (for assignment to growing recorders)
+    """
+    if isinstance(key, slice):
+        if grow and key.stop is not None and key.stop > n_samples:
+            n_samples = key.stop
+        start, stop, step = key.indices(n_samples)
+        if step != 1:
+            raise IndexError('Recorders support only contiguous slices')
+        return start, max(start, stop)
+    index = int(key)
+    if index < 0:
+        index += n_samples
+    if index < 0 or (index >= n_samples and not grow):
+        raise IndexError('Index {} is out of bounds for recorder with size {}'.format(key, n_samples))
+    return index, index + 1
+
+
+class EventRecorder:
+    """
+    Sparse recorder for event-like channels (marks, choices, cues, ...), which are almost entirely zeros.
+    Keeps (sample_index, value) change points instead of dense samples, supports numpy-like assignment and slicing
+    (slicing expands samples to dense array), writing beyond n_samples grows the recorder
+    """
+    def __init__(self, n_samples, fill_value=np.nan):
+        self.n_samples = n_samples
+        self.fill_value = fill_value
+        self.indices = []
+        self.values = []
+
+    @property
+    def shape(self):
+        return (self.n_samples, )
+
+    def __len__(self):
+        return self.n_samples
+
+    def clear(self):
+        self.indices = []
+        self.values = []
+
+
+    def value_at(self, index):
+        j = bisect_right(self.indices, index) - 1
+        return self.values[j] if j >= 0 else self.fill_value
+
+    def __setitem__(self, key, value):
+        start, stop = _get_range(key, self.n_samples, grow=True)
+        if start == stop:
+            return
+        self.n_samples = max(self.n_samples, stop)
+        value = np.nan if value is None else float(value)
+        before = self.value_at(start - 1) if start > 0 else self.fill_value
+        after = self.value_at(stop) if stop < self.n_samples else value
+        new_indices = []
+        new_values = []
+        if not _equal(value, before):
+            new_indices.append(start)
+            new_values.append(value)
+        if not _equal(after, value):
+            new_indices.append(stop)
+            new_values.append(after)
+        i = bisect_left(self.indices, start)
+        k = bisect_right(self.indices, stop)
+        self.indices[i:k] = new_indices
+        self.values[i:k] = new_values
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.to_dense(*_get_range(key, self.n_samples))
+        return self.value_at(_get_range(key, self.n_samples)[0])
+
+    def events(self, start=0, stop=None):
+        """
+        Get change points in [start, stop) range
+        :return: samples indices array, values array
+        """
+        stop = self.n_samples if stop is None else stop
+        i = bisect_left(self.indices, start)
+        k = bisect_left(self.indices, stop)
+        return np.array(self.indices[i:k], dtype=int), np.array(self.values[i:k], dtype='float64')
+
+    def to_dense(self, start=0, stop=None):
+        stop = self.n_samples if stop is None else stop
+        indices, values = self.events(start + 1, stop)
+        indices = np.concatenate([[start], indices]) - start
+        values = np.concatenate([[self.value_at(start)], values])
+        return expand_events(indices, values, stop - start, self.fill_value)
+
+
+class SpillRecorder:
+    """
+    Dense recorder with bounded RAM: samples [offset, offset + window) are kept in memory, older samples are spilled
+    to a memory-mapped file. Supports numpy-like slicing and assignment along the samples axis; not written samples
+    are read as fill_value, writing beyond n_samples grows the recorder, so its length is limited only by disk
+    """
+    def __init__(self, n_samples, sample_shape=(), window=60000, file_path=None, dtype='float64', fill_value=np.nan):
+        """
+        :param n_samples: initial number of samples (recorder grows on writing beyond it)
+        :param sample_shape: shape of single sample (e.g. (n_channels, ))
+        :param window: number of samples kept in memory
+        :param file_path: path to spill file, temporary file is used if None
+        """
+        self.n_samples = n_samples
+        self.sample_shape = tuple(sample_shape)
+        self.window = window
+        self.dtype = np.dtype(dtype)
+        self.fill_value = fill_value
+        if file_path is None:
+            with NamedTemporaryFile(suffix='.dat', delete=False) as f:
+                file_path = f.name
+        self.file_path = file_path
+        self._memory = np.full((window, ) + self.sample_shape, fill_value, dtype=self.dtype)
+        self._offset = 0
+        self._disk = None
+        self._disk_n_samples = 0
+
+    @property
+    def shape(self):
+        return (self.n_samples, ) + self.sample_shape
+
+    def __len__(self):
+        return self.n_samples
+
+    def _grow_disk(self, n_samples):
+        if n_samples <= self._disk_n_samples:
+            return
+        n_samples = max(n_samples, 2 * self._disk_n_samples)
+        if self._disk is not None:
+            self._disk.flush()
+            self._disk = None
+        sample_n_bytes = self.dtype.itemsize * int(np.prod(self.sample_shape))
+        with open(self.file_path, 'ab') as f:
+            f.truncate(n_samples * sample_n_bytes)
+        self._disk = np.memmap(self.file_path, dtype=self.dtype, mode='r+', shape=(n_samples, ) + self.sample_shape)
+        self._disk[self._disk_n_samples:] = self.fill_value
+        self._disk_n_samples = n_samples
+
+    def _spill(self, offset):
+        # move samples [self._offset, offset) from memory to disk
+        n = min(offset - self._offset, self.window)
+        self._grow_disk(offset)
+        self._disk[self._offset:self._offset + n] = self._memory[:n]
+        self._memory[:self.window - n] = self._memory[n:]
+        self._memory[self.window - n:] = self.fill_value
+        self._offset = offset
+
+    def __setitem__(self, key, value):
+        start, stop = _get_range(key, self.n_samples, grow=True)
+        if start == stop:
+            return
+        self.n_samples = max(self.n_samples, stop)
+        if stop > self._offset + self.window:
+            self._spill(stop - (self.window // 2 if stop - start <= self.window // 2 else self.window))
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype), (stop - start, ) + self.sample_shape)
+        if start < self._offset:
+            self._disk[start:min(stop, self._offset)] = value[:self._offset - start]
+        if stop > self._offset:
+            begin = max(start, self._offset)
+            self._memory[begin - self._offset:stop - self._offset] = value[begin - start:]
+
+    def _read(self, start, stop):
+        data = np.full((stop - start, ) + self.sample_shape, self.fill_value, dtype=self.dtype)
+        if start < self._offset:
+            data[:min(stop, self._offset) - start] = self._disk[start:min(stop, self._offset)]
+        begin = max(start, self._offset)
+        end = min(stop, self._offset + self.window)
+        if end > begin:
+            data[begin - start:end - start] = self._memory[begin - self._offset:end - self._offset]
+        return data
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self[key[0]][(slice(None), ) + key[1:] if isinstance(key[0], slice) else key[1:]]
+        start, stop = _get_range(key, self.n_samples, grow=True)
+        return self._read(start, stop) if isinstance(key, slice) else self._read(start, stop)[0]
+
+    def view(self, start=0, stop=None):
+        """
+        Lazy view of [start, stop) samples: it has the same slicing interface, samples are read on request
+        """
+        return RecorderView(self, start, self.n_samples if stop is None else stop)
+
+    def reset(self):
+        """
+        Drop all samples, so recorder is rewritten from the first sample (spill file is truncated)
+        """
+        self._memory[:] = self.fill_value
+        self._offset = 0
+        self._disk = None
+        self._disk_n_samples = 0
+        if os.path.isfile(self.file_path):
+            with open(self.file_path, 'r+b') as f:
+                f.truncate(0)
+
+    def close(self):
+        self._disk = None
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+
+
+class RecorderView:
+    """
+    Lazy read-only view of [start, stop) samples of recorder
+    """
+    def __init__(self, recorder, start, stop):
+        self.recorder = recorder
+        self.start = start
+        self.stop = stop
+
+    @property
+    def shape(self):
+        return (self.stop - self.start, ) + self.recorder.sample_shape
+
+    @property
+    def dtype(self):
+        return self.recorder.dtype
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self[key[0]][(slice(None), ) + key[1:] if isinstance(key[0], slice) else key[1:]]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            return self.recorder[self.start + start:self.start + max(start, stop):step]
+        index = int(key) + (len(self) if int(key) < 0 else 0)
+        if not 0 <= index < len(self):
+            raise IndexError('Index {} is out of bounds for view with size {}'.format(key, len(self)))
+        return self.recorder[self.start + index]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.recorder[self.start:self.stop]
+        return data if dtype is None else data.astype(dtype)
@@ -0,0 +1,276 @@
+"""
+Deterministic replay of recorded experiment_data.h5 through the signals pipeline as fast as possible: recorded raw
+chunks (boundaries from chunk_data) are fed to signals rebuilt from settings.xml, signals statistics, spatial
+filters, bandpass and rejections are restored at each protocol start from the saved signals_stats, and time is
+driven by a virtual clock instead of QTimer and wall time. Recomputed signals_data and reward_data are compared with
+the recorded ones.
+
+Usage:
+    python -m pynfb.replay results/experiment_01-01_00-00-00/experiment_data.h5 [--tolerance 1e-3]
+"""
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from pynfb.reward import Reward
+from pynfb.serializers.hdf5 import has_protocol_dataset, read_protocol_dataset
+from pynfb.serializers.reader import ExperimentReader
+from pynfb.serializers.xml_ import xml_file_to_params
+from pynfb.signal_processing.filters import SpatialRejection
+from pynfb.signals import DerivedSignal, CompositeSignal, SpatialFilterBank
+from pynfb.signals.rejections import Rejections
+
+# protocols types with enabled reward (FeedbackProtocol instances in Experiment)
+REWARD_PROTOCOLS_TYPES = ['Feedback', 'CircleFeedback']
+# iRandomBound of feedback protocols with baseline corrected threshold (Bar, Gabor, Plot and Posner painters)
+BC_THRESHOLD_BOUNDS = [2, 3, 4, 5]
+
+ProtocolReplay = namedtuple('ProtocolReplay', ['number', 'name', 'n_samples', 'n_chunks', 'signals_errors',
+                                               'reward_error', 'passed'])
+ProtocolReplay.__doc__ = """
+Protocol replay result: protocol number and name, samples and chunks count, max normalized error of each replayed
+signal (dict: signal name -> error), max abs reward score error (None if reward is not replayed) and check flag
+"""
+
+
+class VirtualClock:
+    """
+    Clock advanced by replayed samples instead of wall time
+    """
+    def __init__(self, fs, start=0.):
+        self.fs = fs
+        self.start = start
+        self.n_samples = 0
+
+    def time(self):
+        return self.start + self.n_samples / self.fs
+
+    def advance(self, n_samples):
+        self.n_samples += n_samples
+        return self.time()
+
+
+class ExperimentReplay:
+    def __init__(self, file_path, reward_threshold=None, reward_factor=1, default_chunk_size=8):
+        """
+        :param file_path: path to experiment_data.h5 with settings.xml
+        :param reward_threshold: reward threshold (threshold of Experiment if None: baseline corrected threshold if
+        bUseBCThreshold, otherwise dAAIThresholdMean)
+        :param reward_factor: reward factor (-1 for flipped reward signal)
+        :param default_chunk_size: chunk size for protocols without chunk_data
+        """
+        self.reader = ExperimentReader(file_path, mmap=True)
+        self.fs = self.reader.fs
+        self.channels = self.reader.channels
+        self.n_channels = len(self.channels)
+        self.params = xml_file_to_params(_decode(self.reader.file['settings.xml'][0]))
+        self.protocols_params = {protocol['sProtocolName']: protocol for protocol in self.params['vProtocols']}
+        self.default_chunk_size = default_chunk_size
+        self.clock = VirtualClock(self.fs)
+
+        # signals as in Experiment.restart, BCI signals are not replayed (classifiers are not saved)
+        initial_stats = self.reader.file['protocol0/signals_stats'] if 'protocol0' in self.reader.file else {}
+        self.signals = []
+        for ind, signal in enumerate([s for s in self.params['vSignals']['DerivedSignal'] if not s['bBCIMode']]):
+            spatial_filter = initial_stats[signal['sSignalName']]['spatial_filter'][:] \
+                if signal['sSignalName'] in initial_stats else None
+            self.signals.append(DerivedSignal.from_params(ind, self.fs, self.n_channels, self.channels, signal,
+                                                          spatial_filter=spatial_filter,
+                                                          avg_window=signal['dSmoothingWindow'],
+                                                          enable_smoothing=signal['bSmoothingEnabled'],
+                                                          stc_mode=signal['bSTCMode']))
+        self.signals += [CompositeSignal([s for s in self.signals], signal['sExpression'], signal['sSignalName'],
+                                         ind + len(self.signals), self.fs, avg_window=signal['dSmoothingWindow'],
+                                         enable_smoothing=signal['bSmoothingEnabled'])
+                         for ind, signal in enumerate(self.params['vSignals']['CompositeSignal'])]
+        self.spatial_filter_bank = SpatialFilterBank(self.signals)
+        self.signals_names = [signal.name for signal in self.signals]
+        self.signals_columns = [self.reader.signals.index(name) for name in self.signals_names]
+        self.dtype = self.params['sRecorderDtype']
+
+        # reward (score is cumulative over session), median of reward signal of the last baseline as in Experiment
+        self.reward_threshold = reward_threshold
+        self.mean_reward_signal = 0
+        self.reward = Reward(0, threshold=self.get_reward_threshold(None),
+                             rate_of_increase=self.params['fRewardPeriodS'], fs=self.fs)
+        self.reward.reward_factor = reward_factor
+
+    def close(self):
+        self.reader.close()
+
+    def load_signals_stats(self, number):
+        """
+        Restore signals state saved at the end of protocol number (0 - initial state)
+        """
+        group_name = 'protocol{}/signals_stats'.format(number)
+        if group_name not in self.reader.file:
+            return
+        stats = self.reader.file[group_name]
+        for signal in self.signals:
+            if signal.name not in stats:
+                continue
+            signal_stats = stats[signal.name]
+            if isinstance(signal, DerivedSignal):
+                rejections = signal_stats['rejections']
+                rejections_list = []
+                for k in range(len([key for key in rejections if not key.endswith('_topographies')])):
+                    dataset = rejections['rejection{}'.format(k + 1)]
+                    rejections_list.append(SpatialRejection(dataset[:], rank=dataset.attrs['rank'],
+                                                            type_str=dataset.attrs['type'],
+                                                            topographies=rejections[
+                                                                'rejection{}_topographies'.format(k + 1)][:]))
+                has_ica = len(rejections_list) > 0 and rejections_list[0].type_str == 'ica'
+                signal.rejections = Rejections(self.n_channels, rejections_list[1:] if has_ica else rejections_list,
+                                               ica=rejections_list[0] if has_ica else None)
+                signal.update_spatial_filter(signal_stats['spatial_filter'][:])
+                bandpass = tuple(signal_stats['bandpass'][:])
+                if bandpass != tuple(signal.bandpass):
+                    # new estimator as after SSD bandpass update
+                    signal.update_bandpass(bandpass)
+            signal.mean = float(signal_stats['mean'][()])
+            signal.std = float(signal_stats['std'][()])
+            signal.scaling_flag = bool(np.isfinite(signal.mean) and np.isfinite(signal.std))
+
+    def get_reward_threshold(self, protocol_params):
+        """
+        Reward threshold of protocol as in Experiment.next_protocol: the last baseline median of reward signal plus
+        dBCThresholdAdd for Bar, Gabor, Plot and Posner feedback if bUseBCThreshold, dAAIThresholdMean otherwise
+        """
+        if self.reward_threshold is not None:
+            return self.reward_threshold
+        bc_threshold = None
+        if (protocol_params is not None and protocol_params['sFb_type'] in REWARD_PROTOCOLS_TYPES and
+                int(protocol_params['iRandomBound']) in BC_THRESHOLD_BOUNDS and self.params['bUseBCThreshold']):
+            bc_threshold = self.mean_reward_signal + self.params['dBCThresholdAdd']
+        # zero threshold falls back to dAAIThresholdMean as in Experiment
+        return bc_threshold if bc_threshold else self.params['dAAIThresholdMean']
+
+    def get_signal_index(self, name):
+        # index of replayed signal by name (the first signal if it is not set or not replayed)
+        return self.signals_names.index(name) if name in self.signals_names else 0
+
+    def chunks_boundaries(self, number, n_samples):
+        """
+        Recorded chunks stops of protocol (chunk sizes are saved at the last sample of each chunk)
+        """
+        group = self.reader.file['protocol{}'.format(number)]
+        stops = []
+        if has_protocol_dataset(group, 'chunk_data'):
+            # other samples of chunks are 0 (or NaN if chunk_data was not recorded)
+            chunk_sizes = np.nan_to_num(read_protocol_dataset(group, 'chunk_data'))
+            stops = list(np.flatnonzero(chunk_sizes > 0) + 1)
+        if len(stops) == 0:
+            stops = list(range(self.default_chunk_size, n_samples, self.default_chunk_size))
+        if len(stops) == 0 or stops[-1] < n_samples:
+            stops.append(n_samples)
+        return np.array(stops)
+
+    def replay_protocol(self, info, tolerance=1e-3):
+        """
+        Replay protocol chunk by chunk
+        :param info: protocol index entry (reader.protocols)
+        :param tolerance: max allowed signals error normalized by recorded signal std and reward score tolerance
+        :return: ProtocolReplay
+        """
+        group = self.reader.file['protocol{}'.format(info.number)]
+        self.load_signals_stats(info.number - 1)
+        raw = self.reader.dataset(info.number, 'raw_data')[:]
+        recorded_signals = self.reader.dataset(info.number, 'signals_data')[:, self.signals_columns]
+        recorded_reward = group['reward_data'][:] if 'reward_data' in group else None
+        protocol_params = self.protocols_params.get(info.name)
+        # reward of mock protocols (previous protocol or mock file signals) is not replayed
+        replay_reward = (recorded_reward is not None and len(recorded_reward) > 0 and protocol_params is not None and
+                         protocol_params['sFb_type'] in REWARD_PROTOCOLS_TYPES and
+                         protocol_params['fbSource'] != 'All' and not group.attrs.get('mock_previous', 0) and
+                         not protocol_params['sMockSignalFilePath'])
+        self.reward.set_enabled(replay_reward)
+        if replay_reward:
+            self.reward.signal_ind = self.get_signal_index(protocol_params['sRewardSignal'])
+            self.reward.threshold = self.get_reward_threshold(protocol_params)
+            if self.reward.get_score() != recorded_reward[0]:
+                # score is continued from previous protocols, recorded score is used after not replayed protocols
+                self.reward.score = float(recorded_reward[0])
+
+        signals = np.zeros((len(raw), len(self.signals)), dtype=self.dtype)
+        reward = np.zeros(len(raw))
+        start = 0
+        stops = self.chunks_boundaries(info.number, len(raw))
+        for stop in stops:
+            chunk = raw[start:stop]
+            sample = signals[start:stop]
+            self.spatial_filter_bank.update(chunk)
+            for i, signal in enumerate(self.signals):
+                if not isinstance(signal, DerivedSignal):
+                    signal.update(chunk)
+                sample[:, i] = signal.current_chunk
+            # reward is recorded before update by the current chunk
+            reward[start:stop] = self.reward.get_score()
+            if replay_reward:
+                self.reward.update(sample[-1][self.reward.signal_ind], len(chunk))
+            self.clock.advance(len(chunk))
+            start = stop
+
+        if protocol_params is not None and protocol_params['sFb_type'] == 'Baseline':
+            # threshold of the next feedback protocols (scaled signals without NaN samples)
+            reward_signal = signals[~np.isnan(signals).any(axis=1), self.get_signal_index(
+                protocol_params['sRewardSignal'])]
+            self.mean_reward_signal = np.median(reward_signal)
+
+        # recorded signals are descaled
+        signals = np.array([signal.descale_recording(data) for signal, data in zip(self.signals, signals.T)]).T
+        signals_errors = {}
+        for name, replayed, recorded in zip(self.signals_names, signals.T, recorded_signals.T):
+            scale = np.nanstd(recorded) if len(recorded) > 0 else 0
+            error = np.nanmax(np.abs(replayed - recorded)) if len(recorded) > 0 else 0.
+            signals_errors[name] = float(error / scale if scale > 0 else error)
+        reward_error = float(np.abs(reward - recorded_reward).max()) if replay_reward else None
+        passed = all(error <= tolerance for error in signals_errors.values()) and (
+            not replay_reward or np.allclose(reward, recorded_reward, rtol=tolerance, atol=tolerance))
+        return ProtocolReplay(info.number, info.name, len(raw), len(stops), signals_errors, reward_error, passed)
+
+    def run(self, tolerance=1e-3, verbose=True):
+        """
+        Replay all protocols in recorded order
+        :return: list of ProtocolReplay
+        """
+        results = []
+        for info in self.reader.protocols:
+            result = self.replay_protocol(info, tolerance)
+            results.append(result)
+            if verbose:
+                print('{:>3} {:<24}{:>10}{:>8}{:>14.2e}{:>10}  {}'.format(
+                    result.number, result.name[:23], result.n_samples, result.n_chunks,
+                    max(result.signals_errors.values(), default=0.),
+                    '-' if result.reward_error is None else '{:g}'.format(result.reward_error),
+                    'ok' if result.passed else 'MISMATCH'))
+        return results
+
+
+def _decode(xml_str):
+    return xml_str.decode('utf-8') if isinstance(xml_str, bytes) else xml_str
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay experiment_data.h5 through signals pipeline and check '
+                                                 'recorded signals and reward')
+    parser.add_argument('file', help='path to experiment_data.h5')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='max signals error (normalized by std)')
+    parser.add_argument('--reward-threshold', type=float, default=None,
+                        help='reward threshold (baseline corrected threshold if bUseBCThreshold or '
+                             'dAAIThresholdMean by default)')
+    parser.add_argument('--reward-factor', type=float, default=1)
+    parser.add_argument('--chunk-size', type=int, default=8, help='chunk size if chunk_data was not recorded')
+    args = parser.parse_args()
+
+    replay = ExperimentReplay(args.file, args.reward_threshold, args.reward_factor, args.chunk_size)
+    print('{:>3} {:<24}{:>10}{:>8}{:>14}{:>10}'.format('#', 'protocol', 'samples', 'chunks', 'signals err',
+                                                         'reward err'))
+    wall_start = time.perf_counter()
+    results = replay.run(args.tolerance)
+    wall_time = time.perf_counter() - wall_start
+    replay.close()
+    print('Replayed {:.1f} s of recording in {:.2f} s ({:.0f}x real time), {} of {} protocols match'.format(
+        replay.clock.time(), wall_time, replay.clock.time() / max(wall_time, 1e-9),
+        sum(result.passed for result in results), len(results)))
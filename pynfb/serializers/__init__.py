@@ -1,5 +1,5 @@
 from numpy import array
-from ..helpers.roi_spatial_filter import get_roi_filter
+from ..helpers.roi_spatial_filter import get_roi_filter_from_bank
 
 
 def read_spatial_filter(filepath_or_str, fs, channel_labels=None, roi_label=[], source_nfb=False):
@@ -33,7 +33,7 @@ def read_spatial_filter(filepath_or_str, fs, channel_labels=None, roi_label=[],
                 else:
                     raise ValueError ('Empty file or wrong format')
     else:
-        _filter = get_roi_filter(roi_label, fs, channel_labels, show=False)
+        _filter = get_roi_filter_from_bank(roi_label, fs, channel_labels)
     return _filter
 
 
@@ -24,6 +24,7 @@ vectors_defaults = OrderedDict([
     ('sInletType', 'lsl'),
     ('sStreamName', 'NVX136_Data'),
     ('sEventsStreamName', ''),
+    ('sAuxAlignment', 'sparse'),
     ('bUseEvents', 0),
     ('sRawDataFilePath', ''),
     ('sFTHostnamePort', 'localhost:1972'),
@@ -38,6 +39,13 @@ vectors_defaults = OrderedDict([
     ('bUseExpyriment', 0),
     ('bShowPhotoRectangle', 0),
     ('sVizNotchFilters', '0'),
+    ('sRecorderDtype', 'float64'),
+    ('fRecorderWindowS', 120),
+    ('sRawStorage', 'gzip:1 shuffle chunk=262144'),
+    ('sSignalsStorage', 'gzip:1 shuffle chunk=65536'),
+    ('sMarkersStorage', 'gzip:4 chunk=16384'),
+    ('iProtocolCacheMB', 1024),
+    ('fLineFreqHz', 50),
     ('vSignals', OrderedDict([
         ('DerivedSignal', [OrderedDict([     # DerivedSignal is list!
             ('sSignalName', 'Signal'),
@@ -50,6 +58,7 @@ vectors_defaults = OrderedDict([
             ('fAverage', ''),
             ('fStdDev', ''),
             ('bBCIMode', 0),
+            ('fBCIDecisionRateHz', 20),
             ('bSTCMode', 0),
             ('lROILabel', []),
             ('bNFBType', 0),
@@ -100,7 +109,7 @@ vectors_defaults = OrderedDict([
             ('fBlinkThreshold', 0),
             ('fEyeRange', 100),
             ('sMockSignalFilePath', ''),
-            ('sMockSignalFileDataset', 'protocol1'),
+            ('sMockSignalFileDataset', ''),
             ('iMockPrevious', 0),
             ('bReverseMockPrevious', 0),
             ('bRandomMockPrevious', 0),
@@ -1,7 +1,12 @@
+import queue
+import threading
+from collections import OrderedDict
 import numpy as np
 import h5py
 import logging
 from ..signals import DerivedSignal, CompositeSignal, BCISignal
+from ..recorders import expand_events
+from .reader import ExperimentReader
 
 
 def save_h5py(file_path, data, dataset_name='dataset'):
@@ -24,6 +29,64 @@ def load_h5py_protocols_raw(file_path, protocol_indxs=None):
             data.append(f['protocol{}/raw_data'.format(j + 1)][:])
     return data
 
+class ProtocolCache:
+    """
+    Session-wide LRU cache of protocols datasets (e.g. raw_data, signals_data) under bytes budget. Datasets missing
+    in cache are transparently loaded from experiment_data.h5. Returned arrays are shared and should not be modified
+    """
+    def __init__(self, file_path, max_n_bytes=2 ** 30):
+        """
+        :param file_path: path to experiment_data.h5
+        :param max_n_bytes: cache bytes budget
+        """
+        self.file_path = file_path
+        self.max_n_bytes = max_n_bytes
+        self.n_bytes = 0
+        self._cache = OrderedDict()
+
+    def put(self, number, name, data):
+        """
+        Put protocol dataset to cache, least recently used datasets are evicted to fit the budget
+        :param number: protocol number (as in 'protocol<number>' group)
+        :param data: array or array-like (e.g. recorder view), it's materialized only if it fits the budget
+        :return: cached array or data as is (if it doesn't fit the budget)
+        """
+        n_bytes = int(np.prod(data.shape)) * np.dtype(data.dtype).itemsize
+        self.pop(number, name)
+        if n_bytes > self.max_n_bytes:
+            return data
+        while self.n_bytes + n_bytes > self.max_n_bytes:
+            self.n_bytes -= self._cache.popitem(last=False)[1].nbytes
+        data = np.asarray(data)
+        self._cache[(number, name)] = data
+        self.n_bytes += data.nbytes
+        return data
+
+    def pop(self, number, name):
+        data = self._cache.pop((number, name), None)
+        if data is not None:
+            self.n_bytes -= data.nbytes
+        return data
+
+    def get(self, number, name):
+        """
+        Get protocol dataset from cache or from file (loaded dataset is cached)
+        """
+        key = (number, name)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return self.put(number, name, load_h5py(self.file_path, 'protocol{}/{}'.format(number, name)))
+
+    def get_protocols_raw(self, protocol_indxs=None):
+        """
+        Cached version of load_h5py_protocols_raw
+        """
+        if protocol_indxs is None:
+            return None
+        return [self.get(j + 1, 'raw_data') for j in protocol_indxs]
+
+
 def load_h5py_protocol_signals(file_path, protocol_name='protocol1'):
     with h5py.File(file_path, 'r') as f:
         if isinstance(f[protocol_name], h5py.Dataset):
@@ -36,11 +99,25 @@ def load_h5py_protocol_signals(file_path, protocol_name='protocol1'):
 def load_h5py_all_samples(file_path, raw=True):
     with h5py.File(file_path, 'r') as f:
         if isinstance(f['protocol1'], h5py.Dataset):
-            data = [f['protocol' + str(j + 1)][:] for j in range(len(f.keys()))]
-        else:
-            keys = ['protocol{}/{}_data'.format(j + 1, 'raw' if raw else 'signals') for  j in range(len(f.keys()) - 1)]
-            data = [f[key][:] for key in keys if key in f]
-    return np.vstack(data)
+            return np.vstack([f['protocol' + str(j + 1)][:] for j in range(len(f.keys()))])
+    with ExperimentReader(file_path) as reader:
+        return reader.session('raw_data' if raw else 'signals_data')[:]
+
+
+def has_protocol_dataset(group, name):
+    return name in group or 'events/' + name in group
+
+
+def read_protocol_dataset(group, name):
+    """
+    Read protocol dataset as dense array, dataset can be stored as is or as (sample_index, value) events table
+    :param group: protocol group (e.g. f['protocol1'])
+    :param name: dataset name (e.g. 'mark_data')
+    """
+    if name in group:
+        return group[name][:]
+    table = group['events/' + name][:]
+    return expand_events(table[:, 0].astype(int), table[:, 1], group['events'].attrs['n_samples'])
 
 
 def save_channels_and_fs(file_path, channels, fs):
@@ -55,66 +132,150 @@ def load_channels_and_fs(file_path):
         return [s.decode('utf-8') for s in f['channels'][:]], int(f['fs'][()])
 
 
+def save_signals_stats(main_group, signals):
+    signals_group = main_group.create_group('signals_stats')
+    for signal in signals:
+        signal_group = signals_group.create_group(signal.name)
+        if isinstance(signal, DerivedSignal):
+            signal_group.attrs['type'] = u'derived'
+            rejections_group = signal_group.create_group('rejections')
+            for k, rejection in enumerate(signal.rejections.list):
+                dataset = rejections_group.create_dataset('rejection'+str(k+1), data=np.array(rejection.val))
+                rejections_group.create_dataset('rejection' + str(k + 1) + '_topographies',
+                                                data=np.array(rejection.topographies))
+                dataset.attrs['type'] = rejection.type_str
+                dataset.attrs['rank'] = rejection.rank
+            signal_group.create_dataset('spatial_filter', data=np.array(signal.spatial_filter))
+            signal_group.create_dataset('bandpass', data=np.array(signal.bandpass))
+        elif isinstance(signal, CompositeSignal):
+            signal_group.attrs['type'] = u'composite'
+        elif isinstance(signal, BCISignal):
+            signal_group.attrs['type'] = u'bci'
+        else:
+            raise TypeError ('Bad signal type')
+        signal_group.create_dataset('mean', data=np.array(signal.mean))
+        signal_group.create_dataset('std', data=np.array(signal.std))
+
+
+class StoragePolicy:
+    """
+    HDF5 dataset storage policy: compression codec and level, byte-shuffle filter and chunk size in bytes.
+    Codecs: 'none', 'gzip', 'lzf' (built into h5py) and 'zstd', 'lz4', 'blosc-<cname>' (require hdf5plugin)
+    """
+    codecs = ('none', 'gzip', 'lzf', 'zstd', 'lz4', 'blosc-lz4', 'blosc-lz4hc', 'blosc-zstd', 'blosc-zlib')
+
+    def __init__(self, codec='gzip', level=None, shuffle=False, chunk_n_bytes=2 ** 16):
+        if codec not in self.codecs:
+            raise ValueError('Unknown codec "{}", use one of {}'.format(codec, self.codecs))
+        self.codec = codec
+        self.level = level
+        self.shuffle = shuffle
+        self.chunk_n_bytes = chunk_n_bytes
+
+    @classmethod
+    def from_str(cls, string):
+        """
+        Parse policy string "codec[:level] [shuffle] [chunk=n_bytes]", e.g. "gzip:1 shuffle" or "lzf chunk=262144"
+        """
+        tokens = string.split()
+        codec, _, level = tokens[0].partition(':')
+        kwargs = dict(codec=codec, level=int(level) if level else None)
+        for token in tokens[1:]:
+            if token == 'shuffle':
+                kwargs['shuffle'] = True
+            elif token.startswith('chunk='):
+                kwargs['chunk_n_bytes'] = int(token[6:])
+            else:
+                raise ValueError('Bad storage policy token "{}" in "{}"'.format(token, string))
+        return cls(**kwargs)
+
+    def __str__(self):
+        return ' '.join([self.codec + ('' if self.level is None else ':{}'.format(self.level))] +
+                        (['shuffle'] if self.shuffle else []) + ['chunk={}'.format(self.chunk_n_bytes)])
+
+    def _filters(self):
+        if self.codec == 'none':
+            return dict(shuffle=self.shuffle)
+        if self.codec == 'gzip':
+            return dict(compression='gzip', compression_opts=4 if self.level is None else self.level,
+                        shuffle=self.shuffle)
+        if self.codec == 'lzf':
+            return dict(compression='lzf', shuffle=self.shuffle)
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ImportError('Codec "{}" requires hdf5plugin package'.format(self.codec))
+        if self.codec == 'zstd':
+            return dict(hdf5plugin.Zstd(clevel=3 if self.level is None else self.level), shuffle=self.shuffle)
+        if self.codec == 'lz4':
+            return dict(hdf5plugin.LZ4(), shuffle=self.shuffle)
+        # blosc applies its own (faster) shuffle
+        return dict(hdf5plugin.Blosc(cname=self.codec[6:], clevel=5 if self.level is None else self.level,
+                                     shuffle=hdf5plugin.Blosc.SHUFFLE if self.shuffle else hdf5plugin.Blosc.NOSHUFFLE))
+
+    def dataset_kwargs(self, sample_shape, dtype, n_samples=None):
+        """
+        Get h5py create_dataset kwargs (chunks and filters)
+        :param sample_shape: shape of single sample
+        :param n_samples: number of samples of fixed size dataset, None for resizable dataset
+        """
+        sample_shape = tuple(sample_shape)
+        chunk_len = max(1, self.chunk_n_bytes // (np.dtype(dtype).itemsize * int(np.prod(sample_shape))))
+        if n_samples is not None:
+            if n_samples == 0:
+                return {}
+            chunk_len = min(chunk_len, n_samples)
+        kwargs = self._filters()
+        kwargs['chunks'] = (chunk_len, ) + sample_shape
+        return kwargs
+
+
+# storage policies of datasets kinds (see DATASETS_KINDS), can be changed by sRawStorage, sSignalsStorage and
+# sMarkersStorage settings
+DEFAULT_STORAGE_POLICIES = {'raw': 'gzip:1 shuffle chunk=262144', 'signals': 'gzip:1 shuffle chunk=65536',
+                            'markers': 'gzip:4 chunk=16384'}
+DATASETS_KINDS = {'raw_data': 'raw', 'raw_other_data': 'raw', 'signals_data': 'signals', 'timestamp_data': 'signals',
+                  'reward_data': 'signals'}
+
+
+def get_storage_policies(params=None):
+    """
+    Get dict of datasets kind -> StoragePolicy from experiment params (defaults are used for missing params)
+    """
+    params = params or {}
+    strings = {'raw': params.get('sRawStorage'), 'signals': params.get('sSignalsStorage'),
+               'markers': params.get('sMarkersStorage')}
+    return {kind: StoragePolicy.from_str(strings[kind] or DEFAULT_STORAGE_POLICIES[kind]) for kind in strings}
+
+
+def get_dataset_policy(policies, name):
+    """
+    Get storage policy of dataset by name (event-like datasets are 'markers')
+    """
+    return (policies or get_storage_policies())[DATASETS_KINDS.get(name, 'markers')]
+
+
 def save_signals(file_path, signals, group_name='protocol0', raw_data=None, timestamp_data=None, signals_data=None,
                  raw_other_data=None, reward_data=None, protocol_name='unknown', mock_previous=0, mark_data=None,
-                 choice_data=None, answer_data=None, probe_data=None, chunk_data=None, cue_data=None, posner_stim_data=None, posner_stim_time=None, response_data=None):
+                 choice_data=None, answer_data=None, probe_data=None, chunk_data=None, cue_data=None, posner_stim_data=None, posner_stim_time=None, response_data=None,
+                 storage_policies=None):
     print('Signals stats saving', group_name)
+    datasets = [('raw_data', raw_data), ('timestamp_data', timestamp_data), ('signals_data', signals_data),
+                ('raw_other_data', raw_other_data), ('reward_data', reward_data), ('mark_data', mark_data),
+                ('choice_data', choice_data), ('answer_data', answer_data), ('probe_data', probe_data),
+                ('chunk_data', chunk_data), ('cue_data', cue_data), ('posner_stim_data', posner_stim_data),
+                ('posner_stim_time', posner_stim_time), ('response_data', response_data)]
     with h5py.File(file_path, 'a') as f:
         main_group = f.create_group(group_name)
         main_group.attrs['name'] = protocol_name
         main_group.attrs['mock_previous'] = mock_previous
-        signals_group = main_group.create_group('signals_stats')
-        for signal in signals:
-            signal_group = signals_group.create_group(signal.name)
-            if isinstance(signal, DerivedSignal):
-                signal_group.attrs['type'] = u'derived'
-                rejections_group = signal_group.create_group('rejections')
-                for k, rejection in enumerate(signal.rejections.list):
-                    dataset = rejections_group.create_dataset('rejection'+str(k+1), data=np.array(rejection.val))
-                    rejections_group.create_dataset('rejection' + str(k + 1) + '_topographies',
-                                                    data=np.array(rejection.topographies))
-                    dataset.attrs['type'] = rejection.type_str
-                    dataset.attrs['rank'] = rejection.rank
-                signal_group.create_dataset('spatial_filter', data=np.array(signal.spatial_filter))
-                signal_group.create_dataset('bandpass', data=np.array(signal.bandpass))
-            elif isinstance(signal, CompositeSignal):
-                signal_group.attrs['type'] = u'composite'
-            elif isinstance(signal, BCISignal):
-                signal_group.attrs['type'] = u'bci'
-            else:
-                raise TypeError ('Bad signal type')
-            signal_group.create_dataset('mean', data=np.array(signal.mean))
-            signal_group.create_dataset('std', data=np.array(signal.std))
-        if raw_data is not None:
-            main_group.create_dataset('raw_data', data=raw_data, compression="gzip")
-        if timestamp_data is not None:
-            main_group.create_dataset('timestamp_data', data=timestamp_data, compression="gzip")
-        if signals_data is not None:
-            main_group.create_dataset('signals_data', data=signals_data, compression="gzip")
-        if raw_other_data is not None:
-            main_group.create_dataset('raw_other_data', data=raw_other_data, compression="gzip")
-        if reward_data is not None:
-            main_group.create_dataset('reward_data', data=reward_data, compression="gzip")
-        if mark_data is not None:
-            main_group.create_dataset('mark_data', data=mark_data, compression="gzip")
-        if choice_data is not None:
-            main_group.create_dataset('choice_data', data=choice_data, compression="gzip")
-        if answer_data is not None:
-            main_group.create_dataset('answer_data', data=answer_data, compression="gzip")
-        if probe_data is not None:
-            main_group.create_dataset('probe_data', data=probe_data, compression="gzip")
-        if chunk_data is not None:
-            main_group.create_dataset('chunk_data', data=chunk_data, compression="gzip")
-        if cue_data is not None:
-            main_group.create_dataset('cue_data', data=cue_data, compression="gzip")
-        if posner_stim_data is not None:
-            main_group.create_dataset('posner_stim_data', data=posner_stim_data, compression="gzip")
-        if posner_stim_time is not None:
-            main_group.create_dataset('posner_stim_time', data=posner_stim_time, compression="gzip")
-        if response_data is not None:
-            main_group.create_dataset('response_data', data=response_data, compression="gzip")
-
-    pass
+        save_signals_stats(main_group, signals)
+        for name, data in datasets:
+            if data is not None:
+                data = np.asarray(data)
+                policy = get_dataset_policy(storage_policies, name)
+                main_group.create_dataset(name, data=data,
+                                          **policy.dataset_kwargs(data.shape[1:], data.dtype, data.shape[0]))
 
 
 def save_xml_str_to_hdf5_dataset(file_path, xml='', dataset_name='something.xml'):
@@ -137,6 +298,185 @@ class DatasetNotFound(Exception):
     pass
 
 
+class HDF5StreamWriter:
+    """
+    Background writer: appends recorded chunks to resizable chunked datasets of the current protocol group, so
+    protocol switch only closes the group. Resulting file layout is the same as the one of save_signals, except
+    event-like channels, which are stored as compact (sample_index, value) tables in 'events' subgroup
+    (use read_protocol_dataset to read them as dense arrays)
+    """
+    def __init__(self, file_path, datasets_shapes, events_names=(), storage_policies=None):
+        """
+        :param file_path: path to experiment_data.h5
+        :param datasets_shapes: dict of dataset name -> sample shape (e.g. {'raw_data': (n_channels, ), 'reward_data': ()})
+        :param events_names: names of event-like datasets (e.g. ['mark_data', 'choice_data'])
+        :param storage_policies: dict of datasets kind -> StoragePolicy (see get_storage_policies)
+        """
+        self.file_path = file_path
+        self.datasets_shapes = datasets_shapes
+        self.events_names = list(events_names)
+        self.storage_policies = storage_policies or get_storage_policies()
+        self._file = None
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, group_name, events=None, **data):
+        """
+        Queue chunk of data (dataset name -> array of samples) to append to group. Arrays should not be modified after
+        :param events: dict of events dataset name -> (samples indices, values) change points of the chunk
+        """
+        self._queue.put(('append', group_name, dict(events=events or {}, data=data)))
+
+    def release(self):
+        """
+        Write all queued chunks and close file, so it can be read by others
+        """
+        self._queue.put(('release', None, None))
+        self.wait()
+
+    def close_group(self, group_name, signals, protocol_name='unknown', mock_previous=0):
+        """
+        Write protocol attributes and signals stats, create datasets for missing (empty) data and close file
+        """
+        self._queue.put(('close', group_name, dict(signals=signals, protocol_name=protocol_name,
+                                                   mock_previous=mock_previous)))
+        self.wait()
+
+    def wait(self):
+        self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    self._close_file()
+                    break
+                action, group_name, kwargs = job
+                if action == 'append':
+                    self._append(group_name, **kwargs)
+                elif action == 'close':
+                    self._close_group(group_name, **kwargs)
+                else:
+                    self._close_file()
+            except Exception as e:
+                logging.exception('HDF5 stream writer error')
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _get_group(self, group_name):
+        if self._file is None:
+            self._file = h5py.File(self.file_path, 'a')
+        return self._file.require_group(group_name)
+
+    def _create_dataset(self, group, name, dtype='float64'):
+        shape = tuple(self.datasets_shapes[name])
+        policy = get_dataset_policy(self.storage_policies, name)
+        return group.create_dataset(name, shape=(0, ) + shape, maxshape=(None, ) + shape, dtype=dtype,
+                                    **policy.dataset_kwargs(shape, dtype))
+
+    def _create_events_dataset(self, group, name):
+        policy = get_dataset_policy(self.storage_policies, name)
+        return group.require_group('events').create_dataset(name, shape=(0, 2), maxshape=(None, 2), dtype='float64',
+                                                            **policy.dataset_kwargs((2, ), 'float64'))
+
+    def _append(self, group_name, events, data):
+        group = self._get_group(group_name)
+        for name, x in data.items():
+            dataset = group[name] if name in group else self._create_dataset(group, name, x.dtype)
+            n = dataset.shape[0]
+            dataset.resize(n + x.shape[0], axis=0)
+            dataset[n:] = x
+        for name, (indices, values) in events.items():
+            dataset = group['events/' + name] if 'events/' + name in group else self._create_events_dataset(group, name)
+            if len(indices) > 0:
+                n = dataset.shape[0]
+                dataset.resize(n + len(indices), axis=0)
+                dataset[n:] = np.column_stack([indices, values])
+
+    def _close_group(self, group_name, signals, protocol_name, mock_previous):
+        group = self._get_group(group_name)
+        group.attrs['name'] = protocol_name
+        group.attrs['mock_previous'] = mock_previous
+        save_signals_stats(group, signals)
+        for name in self.datasets_shapes:
+            if name not in group:
+                self._create_dataset(group, name)
+        for name in self.events_names:
+            if 'events/' + name not in group:
+                self._create_events_dataset(group, name)
+        if self.events_names:
+            group['events'].attrs['n_samples'] = group[next(iter(self.datasets_shapes))].shape[0]
+        self._close_file()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+
+class RecordersStreamer:
+    """
+    Appends samples of protocol recorders to HDF5StreamWriter during recording. The last `delay` samples can still
+    be rewritten (event-like channels are written over the current chunk length, also while recording is paused), so
+    update appends only older samples and the rest is appended by flush when protocol is closed
+    """
+    def __init__(self, writer, recorders, events_recorders, delay=0, transforms=None):
+        """
+        :param writer: HDF5StreamWriter
+        :param recorders: dict of dataset name -> dense recorder (slicing should return a copy, e.g. SpillRecorder)
+        :param events_recorders: dict of dataset name -> EventRecorder
+        :param delay: initial number of mutable last samples (grows up to the max chunk length)
+        :param transforms: dict of dataset name -> function applied to samples before writing (e.g. descaling)
+        """
+        self.writer = writer
+        self.recorders = recorders
+        self.events_recorders = events_recorders
+        self.delay = delay
+        self.transforms = transforms or {}
+        self.n_saved = 0
+
+    def update(self, group_name, n_samples, chunk_size=0):
+        """
+        Append immutable samples of n_samples recorded samples
+        :param chunk_size: length of the last chunk
+        """
+        self.delay = max(self.delay, chunk_size)
+        self._append(group_name, n_samples - self.delay)
+
+    def flush(self, group_name, n_samples):
+        """
+        Append all not written samples of n_samples recorded samples
+        """
+        self._append(group_name, n_samples)
+
+    def reset(self):
+        self.n_saved = 0
+
+    def _append(self, group_name, stop):
+        if stop <= self.n_saved:
+            return
+        start = self.n_saved
+        data = {name: self.transforms.get(name, _identity)(recorder[start:stop])
+                for name, recorder in self.recorders.items()}
+        self.writer.append(group_name, events={name: recorder.events(start, stop)
+                                               for name, recorder in self.events_recorders.items()}, **data)
+        self.n_saved = stop
+
+
+def _identity(data):
+    return data
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+import h5py
+import numpy as np
+
+
+class MockSignalsSource:
+    """
+    Preindexed sham (mock) signals source. Donor files are indexed once at experiment start, donor protocols are
+    mapped to current protocols and their signals_data are cached to memory-mapped files, so protocol switch is constant
+    time and mapping errors are raised before the experiment starts.
+    Protocol mock dataset setting (sMockSignalFileDataset) defines mapping:
+        '' - by name: k-th protocol with the same name in donor file (k is occurrence number in current sequence),
+             by protocol number for donor files without protocols names
+        'protocol1' - by protocol number: donor protocol<i+1> for i-th protocol of current sequence (legacy default,
+                      stored in older designs)
+        'protocol<n>' - explicit donor protocol group
+        other - by donor protocol name (k-th occurrence of the name)
+    """
+    legacy_dataset = 'protocol1'
+
+    def __init__(self, protocols_sequence):
+        """
+        :param protocols_sequence: list of protocols, protocols with mock_samples_file_path are mapped to donors
+        :raise ValueError: if some of protocols can't be mapped
+        """
+        self.cache_dir = None
+        self.mapping = {}
+        self._buffers = {}
+        indexes = {}
+        occurrences = {}
+        errors = []
+        for k, protocol in enumerate(protocols_sequence):
+            if protocol.mock_samples_file_path is None:
+                continue
+            file_path = protocol.mock_samples_file_path
+            key = protocol.mock_samples_protocol or protocol.name
+            occurrences[(file_path, key)] = occurrences.get((file_path, key), -1) + 1
+            try:
+                if file_path not in indexes:
+                    indexes[file_path] = self.index_file(file_path)
+                self.mapping[k] = (file_path, self._find_donor(indexes[file_path], protocol, k,
+                                                                occurrences[(file_path, key)]))
+            except (OSError, KeyError) as e:
+                errors.append('protocol{} "{}": {}'.format(k + 1, protocol.name,
+                                                           e.args[0] if isinstance(e, KeyError) else e))
+        if errors:
+            raise ValueError('Mock signals mapping errors:\n' + '\n'.join(errors))
+        for k, (file_path, (group_name, _, _)) in sorted(self.mapping.items()):
+            logging.info('Mock signals of protocol{} "{}": {}/{}'.format(k + 1, protocols_sequence[k].name, file_path,
+                                                                         group_name))
+        self._load()
+
+    @staticmethod
+    def index_file(file_path):
+        """
+        Index donor file
+        :return: list of (group name, protocol name or None, signals dataset path) sorted by protocol number
+        """
+        index = []
+        with h5py.File(file_path, 'r') as f:
+            numbers = sorted(int(key[8:]) for key in f.keys() if re.fullmatch(r'protocol\d+', key) and key != 'protocol0')
+            for number in numbers:
+                group_name = 'protocol{}'.format(number)
+                if isinstance(f[group_name], h5py.Dataset):
+                    index.append((group_name, None, group_name))
+                elif 'signals_data' in f[group_name]:
+                    index.append((group_name, f[group_name].attrs.get('name'), group_name + '/signals_data'))
+        return index
+
+    @staticmethod
+    def _find_donor(index, protocol, sequence_index, occurrence):
+        if protocol.mock_samples_protocol == MockSignalsSource.legacy_dataset or (
+                not protocol.mock_samples_protocol and all(name is None for _, name, _ in index)):
+            donors = [item for item in index if item[0] == 'protocol{}'.format(sequence_index + 1)]
+            if not donors:
+                raise KeyError('donor protocol{} not found'.format(sequence_index + 1))
+            return donors[0]
+        if re.fullmatch(r'protocol\d+', protocol.mock_samples_protocol or ''):
+            donors = [item for item in index if item[0] == protocol.mock_samples_protocol]
+            if not donors:
+                raise KeyError('donor protocol {} not found'.format(protocol.mock_samples_protocol))
+            return donors[0]
+        name = protocol.mock_samples_protocol or protocol.name
+        donors = [item for item in index if item[1] == name]
+        if len(donors) <= occurrence:
+            raise KeyError('donor file has {} protocols named "{}", but #{} is required'.format(len(donors), name,
+                                                                                               occurrence + 1))
+        return donors[occurrence]
+
+    def _load(self):
+        # cache mapped donor signals to memory-mapped files
+        self.cache_dir = tempfile.mkdtemp(prefix='nfb_mock_')
+        for file_path, (group_name, _, dataset_path) in set(self.mapping.values()):
+            with h5py.File(file_path, 'r') as f:
+                data = f[dataset_path][:]
+            cache_path = os.path.join(self.cache_dir, '{}_{}.npy'.format(len(self._buffers), group_name))
+            np.save(cache_path, data)
+            self._buffers[(file_path, group_name)] = np.load(cache_path, mmap_mode='r')
+
+    def get(self, sequence_index):
+        """
+        Get mock signals of protocol
+        :param sequence_index: index of protocol in protocols sequence
+        :return: memory-mapped (n_samples, n_signals) array
+        """
+        file_path, (group_name, _, _) = self.mapping[sequence_index]
+        return self._buffers[(file_path, group_name)]
+
+    def __contains__(self, sequence_index):
+        return sequence_index in self.mapping
+
+    def close(self):
+        self._buffers = {}
+        if self.cache_dir is not None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            self.cache_dir = None
@@ -0,0 +1,281 @@
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import h5py
+import numpy as np
+
+from ..recorders import EventRecorder
+
+
+ProtocolInfo = namedtuple('ProtocolInfo', ['number', 'name', 'start', 'stop', 'duration'])
+ProtocolInfo.__doc__ = """
+Protocol index entry: protocol number (as in 'protocol<number>' group), name, session samples range [start, stop) and
+duration [s]
+"""
+
+
+def get_channels_and_fs_from_xml(xml_str):
+    root = ET.fromstring(xml_str)
+    if root.find('desc').find('channels') is not None:
+        channels = [k.find('label').text for k in root.find('desc').find('channels').findall('channel')]
+    else:
+        channels = [k.find('name').text for k in root.find('desc').findall('channel')]
+    fs = int(root.find('nominal_srate').text)
+    return channels, fs
+
+
+def get_signals_names_from_xml(xml_str):
+    root = ET.fromstring(xml_str)
+    derived = [s.find('sSignalName').text for s in root.find('vSignals').findall('DerivedSignal')]
+    composite = []
+    if root.find('vSignals').findall('CompositeSignal')[0].find('sSignalName') is not None:
+        composite = [s.find('sSignalName').text for s in root.find('vSignals').findall('CompositeSignal')]
+    return derived + composite
+
+
+def _columns_indices(columns, names):
+    """
+    Convert columns selection (name, int, slice or list of names/ints) to indices array or slice
+    """
+    if isinstance(columns, slice):
+        return columns
+    single = isinstance(columns, (str, int, np.integer))
+    indices = []
+    for column in [columns] if single else columns:
+        if isinstance(column, str):
+            if names is None or column not in names:
+                raise KeyError('Column "{}" not found in {}'.format(column, names))
+            column = names.index(column)
+        indices.append(int(column))
+    return indices[0] if single else np.array(indices, dtype=int)
+
+
+class DatasetView:
+    """
+    Lazy view of protocol dataset: numpy-like [rows, columns] slicing reads only requested samples, columns can be
+    selected by names (channels for raw_data, signals names for signals_data). Uncompressed contiguous datasets are
+    memory-mapped if mmap is True
+    """
+    def __init__(self, dataset, columns_names=None, mmap=False):
+        self.dataset = dataset
+        self.columns_names = columns_names
+        self._data = dataset
+        if mmap and dataset.chunks is None and dataset.compression is None and dataset.id.get_offset() is not None:
+            self._data = np.memmap(dataset.file.filename, dtype=dataset.dtype, mode='r', shape=dataset.shape,
+                                   offset=dataset.id.get_offset())
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            rows = slice(start, max(start, stop), step)
+        columns = _columns_indices(columns, self.columns_names)
+        if isinstance(columns, np.ndarray) and not isinstance(self._data, np.ndarray):
+            # h5py supports only increasing unique indices
+            unique, inverse = np.unique(columns, return_inverse=True)
+            return self._data[rows, list(unique)][..., inverse]
+        return self._data[rows, columns] if len(self.shape) > 1 else self._data[rows]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
+class EventsView:
+    """
+    Lazy view of event-like dataset stored as (sample_index, value) table: slicing expands only requested samples
+    """
+    def __init__(self, group, name):
+        table = group['events/' + name][:]
+        self.recorder = EventRecorder(int(group['events'].attrs['n_samples']))
+        self.recorder.indices = [int(index) for index in table[:, 0]]
+        self.recorder.values = list(table[:, 1])
+
+    @property
+    def shape(self):
+        return self.recorder.shape
+
+    def __len__(self):
+        return len(self.recorder)
+
+    def __getitem__(self, key):
+        return self.recorder[key]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
+class SessionView:
+    """
+    Lazy view of dataset concatenated across protocols, slicing reads only protocols overlapping requested samples
+    """
+    def __init__(self, views, offsets):
+        self.views = views
+        self.offsets = offsets
+
+    @property
+    def shape(self):
+        return (self.offsets[-1], ) + self.views[0].shape[1:] if self.views else (0, )
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if not isinstance(rows, slice):
+            index = int(rows) + (len(self) if int(rows) < 0 else 0)
+            k = np.searchsorted(self.offsets, index, side='right') - 1
+            if not 0 <= index < len(self):
+                raise IndexError('Index {} is out of bounds for session with size {}'.format(rows, len(self)))
+            return self.views[k][(index - self.offsets[k], columns) if len(self.shape) > 1 else index - self.offsets[k]]
+        start, stop, step = rows.indices(len(self))
+        if step != 1:
+            raise IndexError('SessionView supports only contiguous slices')
+        chunks = []
+        for view, offset, end in zip(self.views, self.offsets[:-1], self.offsets[1:]):
+            if offset < stop and end > start:
+                rows = slice(max(start, offset) - offset, min(stop, end) - offset)
+                chunks.append(view[(rows, columns) if len(self.shape) > 1 else rows])
+        if not chunks:
+            return self.views[0][(slice(0, 0), columns) if len(self.shape) > 1 else slice(0, 0)]
+        return np.concatenate(chunks)
+
+
+class ExperimentReader:
+    """
+    Lazy reader of experiment_data.h5: protocols index is built from metadata only, data is read on slicing.
+    Example:
+        with ExperimentReader('results/experiment_01-01_00-00-00/experiment_data.h5') as reader:
+            print(reader.protocols)
+            alpha = reader.protocol('Baseline').signals[:, 'Alpha']
+            cz = reader.time_range(60, 120, 'raw_data', columns=['Cz'])
+    """
+    def __init__(self, file_path, mmap=False):
+        """
+        :param file_path: path to experiment_data.h5
+        :param mmap: memory-map uncompressed contiguous datasets
+        """
+        self.file_path = file_path
+        self.mmap = mmap
+        self.file = h5py.File(file_path, 'r')
+        if 'channels' in self.file:
+            self.channels = [ch.decode('utf-8') for ch in self.file['channels'][:]]
+            self.fs = int(self.file['fs'][()])
+        else:
+            self.channels, self.fs = get_channels_and_fs_from_xml(self.file['stream_info.xml'][0])
+        if 'settings.xml' in self.file:
+            self.signals = get_signals_names_from_xml(self.file['settings.xml'][0])
+        else:
+            self.signals = list(self.file['protocol0/signals_stats']) if 'protocol0' in self.file else []
+
+        # protocols index
+        self.protocols = []
+        start = 0
+        number = 1
+        while 'protocol{}'.format(number) in self.file:
+            group = self.file['protocol{}'.format(number)]
+            n_samples = group['raw_data'].shape[0] if 'raw_data' in group else int(group['events'].attrs['n_samples'])
+            self.protocols.append(ProtocolInfo(number, group.attrs['name'], start, start + n_samples,
+                                               n_samples / self.fs))
+            start += n_samples
+            number += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.protocols[-1].stop if self.protocols else 0
+
+    def _columns_names(self, name):
+        return {'raw_data': self.channels, 'signals_data': self.signals}.get(name)
+
+    def protocol_info(self, key):
+        """
+        Get protocol index entry by number (as in 'protocol<number>' group) or by name (first protocol with the name)
+        """
+        for info in self.protocols:
+            if info.number == key or info.name == key:
+                return info
+        raise KeyError('Protocol {} not found in {}'.format(key, self.file_path))
+
+    def protocol(self, key):
+        """
+        Get lazy protocol data by number or name
+        """
+        return ProtocolView(self, self.protocol_info(key))
+
+    def dataset(self, number, name):
+        """
+        Lazy view of protocol dataset
+        :param number: protocol number
+        :param name: dataset name (e.g. 'raw_data', 'signals_data', 'mark_data')
+        """
+        group = self.file['protocol{}'.format(number)]
+        if name in group:
+            return DatasetView(group[name], self._columns_names(name), self.mmap)
+        if 'events/' + name in group:
+            return EventsView(group, name)
+        raise KeyError('Dataset {} not found in protocol{}'.format(name, number))
+
+    def session(self, name='raw_data', protocols=None):
+        """
+        Lazy view of dataset concatenated across protocols
+        :param protocols: list of protocols numbers or names (all protocols if None)
+        """
+        infos = self.protocols if protocols is None else [self.protocol_info(key) for key in protocols]
+        views = [self.dataset(info.number, name) for info in infos]
+        return SessionView(views, np.cumsum([0] + [len(view) for view in views]))
+
+    def time_range(self, t_start=0, t_stop=None, name='raw_data', columns=slice(None)):
+        """
+        Read session samples in [t_start, t_stop) time range [s] across protocols
+        """
+        stop = None if t_stop is None else int(round(t_stop * self.fs))
+        return self.session(name)[int(round(t_start * self.fs)):stop, columns]
+
+
+class ProtocolView:
+    """
+    Lazy protocol data, datasets are available as attributes: raw, signals, timestamps, or by dataset(name)
+    """
+    def __init__(self, reader, info):
+        self.reader = reader
+        self.info = info
+
+    @property
+    def raw(self):
+        return self.dataset('raw_data')
+
+    @property
+    def signals(self):
+        return self.dataset('signals_data')
+
+    @property
+    def timestamps(self):
+        return self.dataset('timestamp_data')
+
+    def dataset(self, name):
+        return self.reader.dataset(self.info.number, name)
+
+    def time_range(self, t_start=0, t_stop=None, name='raw_data', columns=slice(None)):
+        """
+        Read protocol samples in [t_start, t_stop) time range [s] from protocol start
+        """
+        stop = None if t_stop is None else int(round(t_stop * self.reader.fs))
+        view = self.dataset(name)
+        rows = slice(int(round(t_start * self.reader.fs)), stop)
+        return view[(rows, columns) if len(view.shape) > 1 else rows]
@@ -2,6 +2,8 @@ from PyQt5 import QtGui, QtWidgets
 from PyQt5.QtCore import pyqtSignal
 from pynfb.helpers.beep import SingleBeep
 from .inlet import InletSettingsWidget, EventsInletSettingsWidget
+from ..inlets.stream_merger import ALIGNMENT_POLICIES
+from ..serializers.hdf5 import StoragePolicy, DEFAULT_STORAGE_POLICIES
 
 
 class BandWidget(QtWidgets.QWidget):
@@ -59,6 +61,14 @@ class GeneralSettingsWidget(QtWidgets.QWidget):
         self.events_inlet = EventsInletSettingsWidget(parent=self)
         self.form_layout.addRow('&Events inlet:', self.events_inlet)
 
+        # alignment of aux streams (names after the first in inlet stream names) to main stream samples
+        self.aux_alignment = QtWidgets.QComboBox()
+        for policy in ALIGNMENT_POLICIES:
+            self.aux_alignment.addItem(policy)
+        self.aux_alignment.setMaximumWidth(100)
+        self.aux_alignment.currentIndexChanged.connect(self.aux_alignment_changed_event)
+        self.form_layout.addRow('&Aux streams alignment:', self.aux_alignment)
+
         # reference
         self.form_layout.addRow('Reference:', None)
         self.reference = QtWidgets.QLineEdit(self)
@@ -146,6 +156,43 @@ class GeneralSettingsWidget(QtWidgets.QWidget):
         self.form_layout.addRow('&AAI max:', self.aai_threshold_max)
 
 
+        # raw and signals recording precision
+        self.recorder_dtype = QtWidgets.QComboBox()
+        for dtype in ['float64', 'float32']:
+            self.recorder_dtype.addItem(dtype)
+        self.recorder_dtype.setMaximumWidth(100)
+        self.recorder_dtype.currentIndexChanged.connect(self.recorder_dtype_changed_event)
+        self.form_layout.addRow('&Recording precision:', self.recorder_dtype)
+
+        # in-memory recording window (older samples are spilled to disk)
+        self.recorder_window = QtWidgets.QDoubleSpinBox()
+        self.recorder_window.setRange(10, 3600)
+        self.recorder_window.setMaximumWidth(100)
+        self.recorder_window.valueChanged.connect(self.recorder_window_changed_event)
+        self.form_layout.addRow('&In-memory recording [s]:', self.recorder_window)
+
+        # in-memory cache of recorded protocols
+        self.protocol_cache = QtWidgets.QSpinBox()
+        self.protocol_cache.setRange(0, 65536)
+        self.protocol_cache.setMaximumWidth(100)
+        self.protocol_cache.valueChanged.connect(self.protocol_cache_changed_event)
+        self.form_layout.addRow('&Protocols cache [MB]:', self.protocol_cache)
+
+        # power line frequency (line noise detection of channels quality monitor)
+        self.line_freq = QtWidgets.QDoubleSpinBox()
+        self.line_freq.setRange(1, 1000)
+        self.line_freq.setMaximumWidth(100)
+        self.line_freq.valueChanged.connect(self.line_freq_changed_event)
+        self.form_layout.addRow('&Power line frequency [Hz]:', self.line_freq)
+
+        # hdf5 storage policies ("codec[:level] [shuffle] [chunk=n_bytes]")
+        self.storage = {}
+        for key, kind in [('sRawStorage', 'raw'), ('sSignalsStorage', 'signals'), ('sMarkersStorage', 'markers')]:
+            self.storage[key] = QtWidgets.QLineEdit(self)
+            self.storage[key].setPlaceholderText('Default: ' + DEFAULT_STORAGE_POLICIES[kind])
+            self.storage[key].editingFinished.connect(lambda key=key: self.storage_changed_event(key))
+            self.form_layout.addRow('&{} storage:'.format(kind.capitalize()), self.storage[key])
+
         # pre-filtering band:
         self.prefilter_band = BandWidget()
         self.prefilter_band.bandChanged.connect(self.band_changed_event)
@@ -206,6 +253,32 @@ class GeneralSettingsWidget(QtWidgets.QWidget):
         self.params['sPrefilterBand'] = self.prefilter_band.get_band()
 
 
+    def aux_alignment_changed_event(self):
+        self.params['sAuxAlignment'] = self.aux_alignment.currentText()
+
+    def recorder_dtype_changed_event(self):
+        self.params['sRecorderDtype'] = self.recorder_dtype.currentText()
+
+    def recorder_window_changed_event(self):
+        self.params['fRecorderWindowS'] = self.recorder_window.value()
+
+    def protocol_cache_changed_event(self):
+        self.params['iProtocolCacheMB'] = self.protocol_cache.value()
+
+    def line_freq_changed_event(self):
+        self.params['fLineFreqHz'] = self.line_freq.value()
+
+    def storage_changed_event(self, key):
+        text = self.storage[key].text().strip()
+        try:
+            if text:
+                StoragePolicy.from_str(text)
+        except (ValueError, IndexError) as e:
+            QtWidgets.QMessageBox.warning(self, 'Bad storage policy', str(e))
+            self.storage[key].setText(self.params[key])
+            return
+        self.params[key] = text
+
     def reward_period_changed_event(self):
         self.params['fRewardPeriodS'] = self.reward_period.value()
 
@@ -223,6 +296,13 @@ class GeneralSettingsWidget(QtWidgets.QWidget):
         self.dc_check.setChecked(self.params['bDC'])
         self.show_photo_rect.setChecked(self.params['bShowPhotoRectangle'])
         self.prefilter_band.set_band(self.params['sPrefilterBand'])
+        self.aux_alignment.setCurrentIndex(ALIGNMENT_POLICIES.index(self.params['sAuxAlignment']))
+        self.recorder_dtype.setCurrentIndex(['float64', 'float32'].index(self.params['sRecorderDtype']))
+        self.recorder_window.setValue(self.params['fRecorderWindowS'])
+        self.protocol_cache.setValue(self.params['iProtocolCacheMB'])
+        self.line_freq.setValue(self.params['fLineFreqHz'])
+        for key, widget in self.storage.items():
+            widget.setText(self.params[key])
         self.enable_bc_threshold.setChecked(self.params['bUseBCThreshold'])
         self.bc_threshold_add.setValue(self.params['dBCThresholdAdd'])
         self.enable_aai_threshold.setChecked(self.params['bUseAAIThreshold'])
@@ -220,7 +220,11 @@ class ProtocolDialog(QtWidgets.QDialog):
         # self.form_layout.addRow('&Enable mock signals:', self.mock_checkbox)
         self.mock_file = FileSelectorLine()
         self.form_layout.addRow('&Mock signals file:', self.mock_file)
-        self.mock_dataset = QtWidgets.QLineEdit('protocol1')
+        self.mock_dataset = QtWidgets.QLineEdit('')
+        self.mock_dataset.setPlaceholderText('same name')
+        self.mock_dataset.setToolTip('Donor protocol: empty - protocol with the same name, "protocol1" - protocol '
+                                     'with the same number, "protocol<n>" - n-th protocol, other - protocol with the '
+                                     'name')
         self.form_layout.addRow('&Mock signals file\ndataset:', self.mock_dataset)
 
 
@@ -141,6 +141,12 @@ class SignalDialog(QtWidgets.QDialog):
         self.bci_checkbox = QtWidgets.QCheckBox('BCI mode')
         self.bci_checkbox.stateChanged.connect(self.bci_mode_changed)
         self.form_layout.addRow('&BCI mode:', self.bci_checkbox)
+        self.bci_decision_rate = QtWidgets.QDoubleSpinBox()
+        self.bci_decision_rate.setRange(0, 1000)
+        self.bci_decision_rate.setSuffix(' Hz')
+        self.bci_decision_rate.setToolTip('BCI classification rate (0 - each sample)')
+        self.bci_decision_rate.setEnabled(self.bci_checkbox.isChecked())
+        self.form_layout.addRow('&BCI decision rate:', self.bci_decision_rate)
 
         # Source estimation mode
         self.stc_source_checkbock = QtWidgets.QCheckBox('stc source')
@@ -159,6 +165,7 @@ class SignalDialog(QtWidgets.QDialog):
     def bci_mode_changed(self):
         self.spatial_filter.setDisabled(self.bci_checkbox.isChecked())
         self.temporal_settings.setDisabled(self.bci_checkbox.isChecked())
+        self.bci_decision_rate.setEnabled(self.bci_checkbox.isChecked())
 
     def stc_mode_changed(self):
         self.spatial_filter.setDisabled(self.stc_source_checkbock.isChecked())
@@ -167,6 +174,9 @@ class SignalDialog(QtWidgets.QDialog):
     def reset_items(self):
         current_signal_index = self.parent().list.currentRow()
         self.bci_checkbox.setChecked(self.params[current_signal_index]['bBCIMode'])
+        self.bci_decision_rate.setValue(self.params[current_signal_index]['fBCIDecisionRateHz'])
+        # stateChanged is not emitted if the loaded mode equals the current one
+        self.bci_decision_rate.setEnabled(self.bci_checkbox.isChecked())
         self.stc_source_checkbock.setChecked(self.params[current_signal_index]['bSTCMode'])
         self.spatial_filter.file.path.setText(self.params[current_signal_index]['SpatialFilterMatrix'])
         roi_label = self.params[current_signal_index]['lROILabel']
@@ -184,6 +194,7 @@ class SignalDialog(QtWidgets.QDialog):
         self.params[current_signal_index]['lROILabel'] = roi_labels
         self.params[current_signal_index]['bNFBType'] = int(self.spatial_filter.nfb_type.isChecked())
         self.params[current_signal_index]['bBCIMode'] = int(self.bci_checkbox.isChecked())
+        self.params[current_signal_index]['fBCIDecisionRateHz'] = self.bci_decision_rate.value()
         self.params[current_signal_index]['bSTCMode'] = int(self.stc_source_checkbock.isChecked())
         for key, val in self.temporal_settings.get_params().items():
             self.params[current_signal_index][key] = val
@@ -1,3 +1,8 @@
+import hashlib
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from mne import create_info
 from mne.io import RawArray
@@ -7,7 +12,7 @@ import mne
 from ..signal_processing.filters import SpatialFilter, ButterFilter, FilterSequence, FilterStack, SpatialRejection
 from ..signal_processing.helpers import get_outliers_mask, stimulus_split
 from ..widgets.helpers import ch_names_to_2d_pos
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, filtfilt, welch
 from scipy.linalg import eigh, inv
 from sklearn.metrics import mutual_info_score
 
@@ -16,6 +21,15 @@ DEFAULTS = {'bandpass_low': 3,
             'bandpass_high': 45}
 BAND_DEFAULT = (DEFAULTS['bandpass_low'], DEFAULTS['bandpass_high'])
 
+# ICA backends ('picard' requires python-picard package)
+ICA_METHODS = ['infomax', 'fastica', 'picard']
+ICA_DEFAULTS = {'method': 'infomax',
+                'n_components': None,  # number of PCA components or explained variance fraction (None - all)
+                'decimation': 1}
+# in-session cache of ICA decompositions: (data fingerprint, parameters) -> results
+ICA_CACHE_SIZE = 8
+_ica_cache = OrderedDict()
+
 
 def mutual_info(x, y, bins=100):
     c_xy = np.histogram2d(x, y, bins)[0]
@@ -23,6 +37,91 @@ def mutual_info(x, y, bins=100):
     return mi
 
 
+# components scores (see score_components)
+COMPONENT_SCORES = ['mutual_info', 'correlation', 'band_power_ratio']
+# max number of histogram indexes kept in memory by mutual_info_scores
+MUTUAL_INFO_BATCH_SIZE = 2 ** 22
+
+
+def _histogram_indexes(x, bins):
+    # bin indexes of columns of x as in np.histogram (bins of equal width from min to max)
+    low, high = x.min(0), x.max(0)
+    constant = high == low
+    low, high = np.where(constant, low - 0.5, low), np.where(constant, high + 0.5, high)
+    indexes = ((x - low) * (bins / (high - low))).astype(np.int64)
+    return np.minimum(indexes, bins - 1, out=indexes)
+
+
+def mutual_info_scores(components, reference, bins=100, max_samples=None):
+    """
+    Mutual information of each component with reference (as mutual_info for each column of components): joint
+    histograms of all components are counted by one bincount per batch of components
+    :param components: array (n_samples x n_components)
+    :param reference: reference signal (n_samples, )
+    :param max_samples: max number of (evenly subsampled) samples used (all samples if None)
+    :return: array (n_components, )
+    """
+    if max_samples is not None and components.shape[0] > max_samples:
+        step = int(np.ceil(components.shape[0] / max_samples))
+        components, reference = components[::step], reference[::step]
+    n_samples, n_components = components.shape
+    reference_indexes = _histogram_indexes(reference[:, None], bins)
+    joint = np.zeros((n_components, bins, bins))
+    batch_size = max(1, MUTUAL_INFO_BATCH_SIZE // max(n_samples, 1))
+    for start in range(0, n_components, batch_size):
+        stop = min(start + batch_size, n_components)
+        indexes = _histogram_indexes(components[:, start:stop], bins) * bins + reference_indexes
+        indexes += np.arange(stop - start) * bins ** 2
+        joint[start:stop] = np.bincount(indexes.ravel(), minlength=(stop - start) * bins ** 2).reshape(-1, bins, bins)
+
+    # mutual information of contingency tables (as sklearn.metrics.mutual_info_score)
+    p_xy = joint / n_samples
+    p_x = p_xy.sum(2, keepdims=True)
+    p_y = p_xy.sum(1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = p_xy * (np.log(p_xy) - np.log(p_x) - np.log(p_y))
+    return np.clip(np.where(joint > 0, terms, 0).sum((1, 2)), 0, None)
+
+
+def score_components(components, reference=None, scores=('mutual_info', ), fs=None, band=None, bins=100,
+                     max_samples=None):
+    """
+    Scores of all components for sorting of ICA/CSP components tables computed in one pass
+    :param components: array (n_samples x n_components)
+    :param reference: reference channel (n_samples, ) or channels (n_samples x n_channels), e.g. EOG channels,
+    for mutual_info and correlation scores (max over reference channels)
+    :param scores: names of scores from COMPONENT_SCORES
+    :param fs: sampling frequency (band_power_ratio)
+    :param band: band of band_power_ratio - power in band to total power ratio
+    :param max_samples: max number of (evenly subsampled) samples used by mutual_info and correlation
+    :return: dict score name -> array (n_components, )
+    """
+    unknown = [score for score in scores if score not in COMPONENT_SCORES]
+    if len(unknown) > 0:
+        raise ValueError('Unknown scores {}, use {}'.format(unknown, COMPONENT_SCORES))
+    result = {}
+    if 'mutual_info' in scores or 'correlation' in scores:
+        reference = reference[:, None] if reference.ndim == 1 else reference
+        x, r = components, reference
+        if max_samples is not None and x.shape[0] > max_samples:
+            step = int(np.ceil(x.shape[0] / max_samples))
+            x, r = x[::step], r[::step]
+        if 'mutual_info' in scores:
+            result['mutual_info'] = np.max([mutual_info_scores(x, r[:, j], bins) for j in range(r.shape[1])], 0)
+        if 'correlation' in scores:
+            x = x - x.mean(0)
+            r = r - r.mean(0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlation = np.dot(r.T, x) / np.outer(np.linalg.norm(r, axis=0), np.linalg.norm(x, axis=0))
+            result['correlation'] = np.nan_to_num(np.abs(correlation)).max(0)
+    if 'band_power_ratio' in scores:
+        freqs, pxx = welch(components, fs, nperseg=min(components.shape[0], int(2 * fs)), axis=0)
+        in_band = (freqs >= band[0]) & (freqs <= band[1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['band_power_ratio'] = np.nan_to_num(pxx[in_band].sum(0) / pxx.sum(0))
+    return result
+
+
 class SpatialDecomposition:
     def __init__(self, channel_names, fs, band=None):
         self.channel_names = channel_names
@@ -83,7 +182,13 @@ class CSPDecomposition(SpatialDecomposition):
             raise ValueError('Y is None, but it must includes labels for CSP')
         states = [X[~y.astype(bool)], X[y.astype(bool)]]
         covs = [np.dot(state.T, state) / state.shape[0] for state in states]
+        return self.decompose_covariances(covs)
 
+    def decompose_covariances(self, covs):
+        """
+        CSP of two states covariance matrices
+        :param covs: [covariance of state 0, covariance of state 1]
+        """
         # find filters
         regularization = lambda z: z + self.reg_coef * np.trace(z) * np.eye(z.shape[0]) / z.shape[0]
         vals, vecs = eigh(regularization(covs[0]), regularization(covs[1]))
@@ -94,6 +199,17 @@ class CSPDecomposition(SpatialDecomposition):
         topo = inv(vecs[:, reversed_slice]).T
         return vals[reversed_slice], vecs[:, reversed_slice], topo
 
+    def fit_covariances(self, covs, zi=None, outliers_mask=None):
+        """
+        Fit by covariance matrices of temporally filtered data (see FilterBankCovariances)
+        :param zi: temporal filter state after filtering of training data
+        """
+        self.scores, self.filters, self.topographies = self.decompose_covariances(covs)
+        if zi is not None:
+            self.temporal_filter.zi = zi.copy()
+        self.outliers_mask = outliers_mask
+        return self
+
     def set_parameters(self, **parameters):
         super(CSPDecomposition, self).set_parameters(**parameters)
         self.reg_coef = parameters['regularizator']
@@ -118,33 +234,192 @@ class CSPDecompositionStimulus(CSPDecomposition):
         return super(CSPDecompositionStimulus, self).decompose(X[y>=0], y[y>=0])
 
 
+def get_ica_methods():
+    """
+    ICA_METHODS available in the environment
+    """
+    return [method for method in ICA_METHODS if method != 'picard' or importlib.util.find_spec('picard') is not None]
+
+
+def fit_ica(X, fs, method='infomax', channel_names=None, random_state=0):
+    """
+    ICA un-mixing matrix of data
+    :param X: data (n_samples x n_channels)
+    :param method: one of ICA_METHODS
+    :return: filters (n_channels x n_channels)
+    """
+    if method == 'fastica':
+        from sklearn.decomposition import FastICA
+        ica = FastICA(random_state=random_state, max_iter=1000)
+        ica.fit(X)
+        return ica.components_.T
+    if method not in ICA_METHODS:
+        raise ValueError('Unknown ICA method {}, use one of {}'.format(method, ICA_METHODS))
+    channel_names = channel_names or ['c{}'.format(j) for j in range(X.shape[1])]
+    raw_inst = RawArray(X.T, create_info(channel_names, fs, 'eeg', None), verbose=False)
+    if method == 'picard':
+        if importlib.util.find_spec('picard') is None:
+            raise ImportError('ICA method "picard" requires python-picard package')
+        ica = ICA(method='picard', fit_params=dict(ortho=False, extended=True), random_state=random_state)
+    elif tuple(int(v) for v in mne.__version__.split('.')[:2]) >= (0, 19):  # validate mne version (mne 0.19+)
+        ica = ICA(method='infomax', fit_params=dict(extended=True), random_state=random_state)
+    else:
+        ica = ICA(method='extended-infomax', random_state=random_state)
+    ica.fit(raw_inst, verbose=False)
+    return np.dot(ica.unmixing_matrix_, ica.pca_components_[:ica.n_components_]).T
+
+
+def get_pca_basis(X, n_components):
+    """
+    Principal axes of data
+    :param n_components: number of components or explained variance fraction (if < 1)
+    :return: basis (n_channels x n_components) or None if all components are kept
+    """
+    vals, vecs = np.linalg.eigh(np.cov(X.T))
+    vals, vecs = vals[::-1], vecs[:, ::-1]
+    if n_components < 1:
+        n_components = np.searchsorted(np.cumsum(vals) / np.sum(vals), n_components) + 1
+    n_components = int(n_components)
+    return vecs[:, :n_components] if n_components < X.shape[1] else None
+
+
+def get_rejection_matrix(filters, topographies, indexes):
+    """
+    Spatial matrix projecting components out of data (I - W_idx A_idx^T), un-mixing matrix can be non-square
+    :param filters: un-mixing matrix W (n_channels x n_components)
+    :param topographies: A = pinv(W).T (n_channels x n_components)
+    :param indexes: indexes of rejected components
+    """
+    return np.eye(filters.shape[0]) - np.dot(filters[:, indexes], topographies[:, indexes].T)
+
+
 class ICADecomposition(SpatialDecomposition):
-    def __init__(self, channel_names, fs, band=None):
+    def __init__(self, channel_names, fs, band=None, method=None, n_components=None, decimation=None):
+        """
+        :param method: ICA backend (one of ICA_METHODS)
+        :param n_components: number of PCA components or explained variance fraction to keep before ICA (None - all)
+        :param decimation: decimation factor of filtered data used for fitting
+        """
         super(ICADecomposition, self).__init__(channel_names, fs, band)
+        self.method = method or ICA_DEFAULTS['method']
+        self.n_components = n_components or ICA_DEFAULTS['n_components']
+        self.decimation = decimation or ICA_DEFAULTS['decimation']
         self.sorted_channel_index = 0
         self.name = 'ica'
 
+    def fit(self, X, y=None):
+        # the same data with the same parameters are decomposed once per session
+        key = (hashlib.sha1(np.ascontiguousarray(X).view(np.uint8)).hexdigest(), X.shape, str(X.dtype),
+               tuple(self.band), self.method, self.n_components, self.decimation, tuple(self.channel_names), self.fs)
+        if key in _ica_cache:
+            _ica_cache.move_to_end(key)
+            scores, filters, topographies, self.outliers_mask, self.sorted_channel_index = _ica_cache[key]
+            self.scores, self.filters, self.topographies = list(scores), filters.copy(), topographies.copy()
+            # temporal filter state is the same as after fitting
+            self.temporal_filter.apply(X)
+            return self
+        super(ICADecomposition, self).fit(X, y)
+        _ica_cache[key] = (list(self.scores), self.filters.copy(), self.topographies.copy(), self.outliers_mask,
+                           self.sorted_channel_index)
+        while len(_ica_cache) > ICA_CACHE_SIZE:
+            _ica_cache.popitem(last=False)
+        return self
+
     def decompose(self, X, y=None):
-        raw_inst = RawArray(X.T, create_info(self.channel_names, self.fs, 'eeg', None))
-        if int(mne.__version__.split('.')[1]) >= 19:  # validate mne version (mne 0.19+)
-            ica = ICA(method='infomax', fit_params=dict(extended=True))
+        X_fit = X[::self.decimation]
+        basis = get_pca_basis(X_fit, self.n_components) if self.n_components else None
+        if basis is None:
+            filters = fit_ica(X_fit, self.fs / self.decimation, self.method, self.channel_names)
         else:
-            ica = ICA(method='extended-infomax')
-        ica.fit(raw_inst)
-        filters = np.dot(ica.unmixing_matrix_, ica.pca_components_[:ica.n_components_]).T
-        topographies = np.linalg.inv(filters).T
+            filters = np.dot(basis, fit_ica(np.dot(X_fit, basis), self.fs / self.decimation, self.method))
+        topographies = np.linalg.pinv(filters).T
         scores = self.get_scores(X, filters)
         return scores, filters, topographies
 
+    def set_parameters(self, **parameters):
+        super(ICADecomposition, self).set_parameters(**parameters)
+        self.method = parameters.get('ica_method', self.method)
+        if 'ica_variance' in parameters:
+            self.n_components = parameters['ica_variance'] / 100 if parameters['ica_variance'] < 100 else None
+        self.decimation = int(parameters.get('ica_decimation', self.decimation))
+
     def get_scores(self, X, filters, ch_name=None, index=None):
         if index is None:
             index = np.argmax(self.pos[:, 1]) if ch_name is None else self.channel_names.index(ch_name)
         self.sorted_channel_index = index
-        components = np.dot(X, filters)
-        scores = [mutual_info(components[:, j], X[:, index]) for j in range(components.shape[1])]
+        scores = list(mutual_info_scores(np.dot(X, filters), X[:, index]))
         return scores
 
 
+class FilterBankCovariances:
+    """
+    Per-class covariance matrices of data filtered by a bank of bands (ButterFilter and outliers rejection as in
+    SpatialDecomposition.fit). Data are filtered once per band, bands are processed in parallel threads. One instance
+    is shared by CSP decompositions of all pools and states labels with the same bands
+    """
+    def __init__(self, fs, bands, n_channels, n_jobs=None):
+        """
+        :param n_jobs: number of threads (one per band if None)
+        """
+        self.fs = fs
+        self.bands = [tuple(band) for band in bands]
+        self.n_channels = n_channels
+        self.n_jobs = n_jobs or len(self.bands)
+        self.labels = None
+        self.covs = None  # per band: {label: (sum of x.T x, n_samples)}
+        self.total = None  # per band: (sum of x.T x, n_samples)
+        self.zi = None  # per band: temporal filter state after training data
+        self.outliers_masks = None
+        self.filtered = None  # per band: filtered data if fitted with keep_filtered
+
+    def _fit_band(self, X, y, band, keep_filtered):
+        temporal_filter = ButterFilter(band, self.fs, self.n_channels)
+        X = temporal_filter.apply(X)
+        outliers_mask = get_outliers_mask(X)
+        good_mask = ~outliers_mask
+        X_good, y_good = X[good_mask], y[good_mask]
+        covs = {}
+        for label in self.labels:
+            state = X_good[y_good == label]
+            covs[label] = (np.dot(state.T, state), state.shape[0])
+        return (covs, (np.dot(X_good.T, X_good), X_good.shape[0]), temporal_filter.zi, outliers_mask,
+                X if keep_filtered else None)
+
+    def fit(self, X, y, keep_filtered=False):
+        """
+        :param y: samples labels
+        :param keep_filtered: keep filtered data of each band in self.filtered (see transform)
+        """
+        y = np.asarray(y)
+        self.labels = list(np.unique(y))
+        with ThreadPoolExecutor(self.n_jobs) as pool:
+            results = list(pool.map(lambda band: self._fit_band(X, y, band, keep_filtered), self.bands))
+        self.covs, self.total, self.zi, self.outliers_masks, filtered = map(list, zip(*results))
+        self.filtered = filtered if keep_filtered else None
+        return self
+
+    def get_covariances(self, band, label):
+        """
+        Covariance matrices of samples not labeled and labeled by label in band
+        :return: [covariance of other states, covariance of label state]
+        """
+        k = self.bands.index(tuple(band))
+        total, n_total = self.total[k]
+        cov, n = self.covs[k][label] if label in self.covs[k] else (np.zeros_like(total), 0)
+        return [(total - cov) / max(n_total - n, 1), cov / max(n, 1)]
+
+    def transform(self, bands_filters):
+        """
+        Apply spatial filters to kept filtered data
+        :param bands_filters: list of (band, spatial filters matrix) pairs
+        :return: horizontally stacked outputs
+        """
+        if self.filtered is None:
+            raise ValueError('Filtered data is not kept, fit with keep_filtered=True')
+        return np.hstack([np.dot(self.filtered[self.bands.index(tuple(band))], filters)
+                          for band, filters in bands_filters])
+
+
 class SpatialDecompositionPool:
     def __init__(self, channel_names, fs, bands=None, dec_class='csp', indexes=None):
         Decomposition = {'ica': ICADecomposition, 'csp': CSPDecomposition}[dec_class]
@@ -154,10 +429,31 @@ class SpatialDecompositionPool:
         if self.indexes.ndim == 1:
             self.indexes = self.indexes[None, :].repeat(len(self.bands), 0)
         self.pool = [Decomposition(channel_names, fs, band) for band in self.bands]
+        self.dec_class = dec_class
+        self.channel_names = channel_names
+        self.fs = fs
 
-    def fit(self, X, y=None):
+    def fit(self, X, y=None, filter_bank=None, label=True):
+        """
+        :param filter_bank: fitted FilterBankCovariances shared with other pools (CSP only, computed if None)
+        :param label: label of y (or of filter_bank labels) for state 1 of CSP
+        """
+        if self.dec_class != 'csp':
+            for decomposer in self.pool:
+                decomposer.fit(X, y)
+            return
+        if filter_bank is None:
+            filter_bank = FilterBankCovariances(self.fs, self.bands, len(self.channel_names)).fit(X, y)
         for decomposer in self.pool:
-            decomposer.fit(X, y)
+            k = filter_bank.bands.index(tuple(decomposer.band))
+            decomposer.fit_covariances(filter_bank.get_covariances(decomposer.band, label), filter_bank.zi[k],
+                                       filter_bank.outliers_masks[k])
+
+    def get_bands_filters(self):
+        """
+        :return: list of (band, spatial filters matrix) pairs in get_filter_stack outputs order
+        """
+        return [(dec.band, dec.filters[:, index]) for dec, index in zip(self.pool, self.indexes)]
 
     def get_filter(self):
         filters = [dec.filters[:, index] for dec, index in zip(self.pool, self.indexes)]
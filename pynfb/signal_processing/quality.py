@@ -0,0 +1,144 @@
+import numpy as np
+from scipy.signal import lfilter
+
+# channel status flags (status vector of ChannelQualityMonitor is bitwise or of flags)
+QUALITY_FLAGS = {'variance': 1, 'flat': 2, 'line_noise': 4, 'clipping': 8}
+
+
+class ChannelQualityMonitor:
+    """
+    Streaming per-channel signal quality: each chunk updates exponentially weighted variance (short and baseline),
+    flat signal run length, fraction of samples on plateaus at peak value (clipping) and line noise power by block
+    Goertzel algorithm, so no data window is kept and each chunk costs O(chunk size x channels)
+    """
+    def __init__(self, fs, n_channels, line_freq=50, window=1., baseline_window=30., std_ratio=7., flat_duration=0.5,
+                 flat_eps=0., line_noise_ratio=0.5, clipping_ratio=0.005, clipping_level=0.99, peak_window=10.):
+        """
+        :param line_freq: power line frequency [Hz]
+        :param window: short variance time constant [s], variance is checked after 2 windows
+        :param baseline_window: baseline variance time constant [s]
+        :param std_ratio: max short to baseline std ratio
+        :param flat_duration: min duration of flat signal [s]
+        :param flat_eps: max abs difference of neighboring samples of flat signal
+        :param line_noise_ratio: max ratio of line frequency power to channel variance (Goertzel block is 1 s)
+        :param clipping_ratio: max fraction of samples on plateaus at the channel peak (short window average)
+        :param clipping_level: min abs value of clipping plateau relative to the channel peak abs value
+        :param peak_window: channel peak abs value decay time constant [s] (peak of artifact is forgotten)
+        """
+        self.fs = fs
+        self.n_channels = n_channels
+        self.std_ratio = std_ratio
+        self.flat_eps = flat_eps
+        self.line_noise_ratio = line_noise_ratio
+        self.clipping_ratio = clipping_ratio
+        self.clipping_level = clipping_level
+        self.alpha = 1 / (window * fs)
+        self.baseline_alpha = 1 / (baseline_window * fs)
+        self.peak_alpha = 1 / (peak_window * fs)
+        self.warmup_samples = int(2 * window * fs)
+        self.flat_samples = max(int(flat_duration * fs), 1)
+
+        # goertzel bin of line frequency over 1 s blocks (integer number of line cycles)
+        self.block_size = int(fs)
+        self.goertzel_coef = 2 * np.cos(2 * np.pi * line_freq / fs)
+        self.reset()
+
+    def reset(self):
+        self.n_samples = 0
+        self.mean = np.zeros(self.n_channels)
+        self.mean_square = np.zeros(self.n_channels)
+        self.baseline_variance = None
+        self.last_sample = None
+        self.flat_run = np.zeros(self.n_channels, dtype=int)
+        self.clipping = np.zeros(self.n_channels)  # fraction of samples on peak plateaus
+        self.peak = np.zeros(self.n_channels)
+        self.goertzel_state = np.zeros((2, self.n_channels))  # s[n-1], s[n-2]
+        self.block_samples = 0
+        self.line_noise = np.zeros(self.n_channels)  # line power to variance ratio of the last block
+        self.status = np.zeros(self.n_channels, dtype=np.uint8)
+
+    @property
+    def variance(self):
+        return np.maximum(self.mean_square - self.mean ** 2, 0)
+
+    def update(self, chunk):
+        """
+        Update statistics by chunk
+        :param chunk: array (n_samples x n_channels)
+        :return: status vector (n_channels, ) of QUALITY_FLAGS
+        """
+        # integer streams are not converted by ChannelsSelector if processing is off
+        chunk = np.asarray(chunk, dtype=float)
+        n = chunk.shape[0]
+        if n == 0:
+            return self.status
+
+        # exponentially weighted moments (chunk is weighted as a whole)
+        weight = 1 - (1 - self.alpha) ** n
+        self.mean += weight * (chunk.mean(0) - self.mean)
+        self.mean_square += weight * ((chunk ** 2).mean(0) - self.mean_square)
+        self.n_samples += n
+        variance = self.variance
+
+        # run length of flat signal and fraction of samples on plateaus at peak abs value
+        previous = chunk[:1] if self.last_sample is None else self.last_sample[None]
+        flat = np.abs(np.diff(np.vstack([previous, chunk]), axis=0)) <= self.flat_eps
+        self.peak = np.maximum(self.peak * (1 - self.peak_alpha) ** n, np.abs(chunk).max(0))
+        plateau = flat & (np.abs(chunk) >= self.clipping_level * self.peak) & (self.peak > 0)
+        self.flat_run = _update_run(self.flat_run, flat)
+        self.clipping += weight * (plateau.mean(0) - self.clipping)
+        self.last_sample = chunk[-1].copy()
+
+        # line noise
+        self._update_goertzel(chunk)
+
+        # status
+        status = np.zeros(self.n_channels, dtype=np.uint8)
+        if self.n_samples >= self.warmup_samples:
+            if self.baseline_variance is None:
+                self.baseline_variance = variance.copy()
+            else:
+                status[variance > self.std_ratio ** 2 * self.baseline_variance] |= QUALITY_FLAGS['variance']
+                baseline_weight = 1 - (1 - self.baseline_alpha) ** n
+                self.baseline_variance += baseline_weight * (variance - self.baseline_variance)
+        status[self.flat_run >= self.flat_samples] |= QUALITY_FLAGS['flat']
+        status[self.line_noise > self.line_noise_ratio] |= QUALITY_FLAGS['line_noise']
+        status[self.clipping > self.clipping_ratio] |= QUALITY_FLAGS['clipping']
+        self.status = status
+        return status
+
+    def _update_goertzel(self, chunk):
+        start = 0
+        while start < chunk.shape[0]:
+            stop = min(start + self.block_size - self.block_samples, chunk.shape[0])
+            s1, s2 = self.goertzel_state
+            y, _ = lfilter([1.], [1., -self.goertzel_coef, 1.], chunk[start:stop] - self.mean, axis=0,
+                           zi=np.array([self.goertzel_coef * s1 - s2, -s1]))
+            self.goertzel_state = np.vstack([y[-1], y[-2] if len(y) > 1 else s1])
+            self.block_samples += stop - start
+            start = stop
+            if self.block_samples == self.block_size:
+                # power of line frequency sinusoid (2|X|^2/N^2) to variance ratio
+                s1, s2 = self.goertzel_state
+                power = 2 * (s1 ** 2 + s2 ** 2 - self.goertzel_coef * s1 * s2) / self.block_size ** 2
+                variance = self.variance
+                self.line_noise = np.where(variance > 0, power / np.where(variance > 0, variance, 1), 0)
+                self.goertzel_state = np.zeros((2, self.n_channels))
+                self.block_samples = 0
+
+    def get_troubled_channels(self, channels_names, flags=None):
+        """
+        :param flags: flags to check (all QUALITY_FLAGS if None)
+        :return: list of "channel (problems)" strings
+        """
+        flags = QUALITY_FLAGS if flags is None else {key: QUALITY_FLAGS[key] for key in flags}
+        return ['{} ({})'.format(name, ', '.join(key for key, flag in flags.items() if status & flag))
+                for name, status in zip(channels_names, self.status) if any(status & flag for flag in flags.values())]
+
+
+def _update_run(run, mask):
+    # consecutive True samples at the end of mask (n_samples x n_channels) added to previous run lengths
+    n = mask.shape[0]
+    not_mask = ~mask
+    last_false = np.where(not_mask.any(0), n - 1 - np.argmax(not_mask[::-1], 0), -1)
+    return np.where(last_false < 0, run + n, n - 1 - last_false)
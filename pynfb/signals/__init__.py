@@ -1,3 +1,3 @@
-from .derived import DerivedSignal
+from .derived import DerivedSignal, SpatialFilterBank
 from .composite import CompositeSignal
 from .bci import BCISignal
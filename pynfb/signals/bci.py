@@ -1,5 +1,5 @@
 from ..signal_processing.filters import ButterFilter, FilterSequence, FilterStack, InstantaneousVarianceFilter
-from ..signal_processing.decompositions import SpatialDecompositionPool
+from ..signal_processing.decompositions import SpatialDecompositionPool, FilterBankCovariances
 from sklearn.neural_network import MLPClassifier
 from sklearn.ensemble import RandomForestClassifier
 import numpy as np
@@ -16,6 +16,7 @@ class BCIModel():
     def __init__(self, fs, bands, ch_names, states_labels, indexes):
         self.states_labels = states_labels
         self.bands = bands
+        self.fs = fs
         self.prefilter = FilterSequence([ButterFilter((0.5, 45), fs, len(ch_names))])
         self.csp_pools = [SpatialDecompositionPool(ch_names, fs, bands, 'csp', indexes) for _label in states_labels]
         self.csp_transformer = None
@@ -26,17 +27,21 @@ class BCIModel():
 
     def fit(self, X, y=None):
         X = self.prefilter.apply(X)
+        # training data are filtered once per band, per-label covariances are shared by all pools
+        filter_bank = FilterBankCovariances(self.fs, self.bands, X.shape[1]).fit(X, y, keep_filtered=True)
         for csp_pool, label in zip(self.csp_pools, self.states_labels):
-            csp_pool.fit(X, y == label)
+            csp_pool.fit(X, y == label, filter_bank=filter_bank, label=label)
         self.csp_transformer = FilterStack([pool.get_filter_stack() for pool in self.csp_pools])
-        X = self.csp_transformer.apply(X)
+        X = filter_bank.transform([band_filters for pool in self.csp_pools
+                                   for band_filters in pool.get_bands_filters()])
         X = self.var_detector.apply(X)
         X = self.scaler.fit_transform(X)
         self.classifier.fit(X, y)
-        accuracies = [sum(self.classifier.predict(X) == y)/len(y)]
+        predicted = self.classifier.predict(X)
+        accuracies = [sum(predicted == y)/len(y)]
         print('Fit accuracy {}'.format(accuracies[0]))
         for label in self.states_labels:
-            accuracies.append(sum(self.classifier.predict(X[y == label]) == label) / sum(y == label))
+            accuracies.append(sum(predicted[y == label] == label) / sum(y == label))
             print('Fit accuracy label {}: {}'.format(label,accuracies[-1]))
         return accuracies
 
@@ -46,16 +51,36 @@ class BCIModel():
             accuracies.append(sum(self.apply(X[y == label]) == label) / sum(y == label))
         return accuracies
 
-    def apply(self, chunk: np.ndarray):
+    def get_features(self, chunk: np.ndarray):
+        """
+        Streaming features of chunk samples (filters states are updated by each sample)
+        """
         chunk = self.prefilter.apply(chunk)
         chunk = self.csp_transformer.apply(chunk)
-        chunk = self.var_detector.apply(chunk)
-        chunk = self.scaler.transform(chunk)
-        predicted_labels = self.classifier.predict(chunk)
+        return self.var_detector.apply(chunk)
+
+    def predict(self, features: np.ndarray):
+        return self.classifier.predict(self.scaler.transform(features))
+
+    def apply(self, chunk: np.ndarray):
+        predicted_labels = self.predict(self.get_features(chunk))
         return predicted_labels
 
+def fit_bci_model(model_args, X, y):
+    """
+    Fit new BCIModel (worker process task)
+    :return: fitted model and accuracies
+    """
+    model = BCIModel(*model_args)
+    accuracies = model.fit(X, y)
+    return model, accuracies
+
+
 class BCISignal():
-    def __init__(self, fs, ch_names, name, id, bands=None, states_labels=None, indexes=None):
+    def __init__(self, fs, ch_names, name, id, bands=None, states_labels=None, indexes=None, decision_rate=None):
+        """
+        :param decision_rate: classification rate [Hz], labels are held between decisions (each sample if None or 0)
+        """
         bands = bands if bands is not None else BANDS_DEFAULT
         states_labels = states_labels if states_labels is not None else STATES_LABELS_DEFAULT
         indexes = indexes if indexes is not None else INDEXES_DEFAULT
@@ -69,11 +94,19 @@ class BCISignal():
         self.scaling_flag = False
         self.model_fitted = False
         self.current_chunk = None
+        # features are streamed by each sample, classifier is applied only to decision samples
+        self.decision_period = fs / decision_rate if decision_rate else 1
+        self.n_samples = 0
 
     def update(self, chunk):
+        model = self.model
         if self.model_fitted:
-            labels = self.model.apply(chunk)
-            self.current_sample = Counter(labels).most_common(1)[0][0]
+            features = model.get_features(chunk)
+            decisions = self.get_decision_indexes(len(chunk))
+            if len(decisions) > 0:
+                labels = model.predict(features[decisions])
+                self.current_sample = Counter(labels).most_common(1)[0][0]
+        self.n_samples += len(chunk)
         self.current_chunk = self.current_sample * np.ones(len(chunk))
         with open("bci_current_state.pkl", "w", encoding="utf-8") as fp:
             fp.write(str(self.current_sample))
@@ -82,11 +115,31 @@ class BCISignal():
     def apply(self, chunk):
         return self.model.apply(chunk)
 
+    def get_decision_indexes(self, n_samples):
+        """
+        Indexes of decision samples of the next chunk (each decision_period sample of stream)
+        """
+        periods = np.floor((self.n_samples + np.arange(-1, n_samples)) / self.decision_period)
+        return np.flatnonzero(np.diff(periods) > 0)
+
     def fit_model(self, X, y):
         accuracies = self.model.fit(X, y)
         self.model_fitted = True
         return accuracies
 
+    def fit_model_async(self, X, y, executor):
+        """
+        Fit new model in a worker process on a snapshot of data, current model is used until set_model call
+        :param executor: process pool executor shared by fits of the experiment
+        :return: concurrent.futures.Future of (model, accuracies)
+        """
+        return executor.submit(fit_bci_model, self.model_args, np.array(X), np.array(y))
+
+    def set_model(self, model):
+        # single reference swap: update uses either previous or new model
+        self.model = model
+        self.model_fitted = True
+
     def reset_model(self):
         self.model = BCIModel(*self.model_args)
 
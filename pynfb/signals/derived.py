@@ -180,8 +180,12 @@ class DerivedSignal:
     def spatial_filter_is_zeros(self):
         return (self.spatial_filter == 0).all()
 
-    def update(self, chunk):
-        filtered_chunk = np.dot(chunk, self.spatial_matrix)
+    def update(self, chunk, filtered_chunk=None):
+        """
+        :param filtered_chunk: spatially filtered chunk (computed from chunk if None, see SpatialFilterBank)
+        """
+        if filtered_chunk is None:
+            filtered_chunk = np.dot(chunk, self.spatial_matrix)
         # Todo - only do one set of processing (currently we get the filter and the stc - and also apply both
         # This below method of doing source makes the program quite unresponsive
         if self.stc_mode:
@@ -294,4 +298,33 @@ class DerivedSignal:
                         vector=False, source_nn=self.source_nn,
                         src_type=src_type)
         vertno_max_idx, time_max = stc.get_peak(hemi=None, vert_as_index=True)
-        return stc.data[vertno_max_idx]
\ No newline at end of file
+        return stc.data[vertno_max_idx]
+
+class SpatialFilterBank:
+    """
+    Spatial matrices of derived signals stacked to one (n_channels x n_signals) matrix, so all derived signals of
+    a chunk are spatially filtered by a single matrix product. The matrix is restacked when any signal spatial matrix
+    is replaced (spatial filter or rejections update)
+    """
+    def __init__(self, signals):
+        self.signals = [signal for signal in signals if isinstance(signal, DerivedSignal)]
+        self.spatial_matrices = None
+        self.matrix = None
+
+    def apply(self, chunk):
+        """
+        :return: filtered chunk (n_samples x n_signals), columns are in order of derived signals
+        """
+        spatial_matrices = [signal.spatial_matrix for signal in self.signals]
+        if self.spatial_matrices is None or any(a is not b for a, b in zip(spatial_matrices, self.spatial_matrices)):
+            self.matrix = np.stack(spatial_matrices, 1) if spatial_matrices else np.zeros((chunk.shape[1], 0))
+            self.spatial_matrices = spatial_matrices
+        return np.dot(chunk, self.matrix)
+
+    def update(self, chunk):
+        """
+        Update all derived signals by chunk
+        """
+        filtered_chunk = self.apply(chunk)
+        for k, signal in enumerate(self.signals):
+            signal.update(chunk, filtered_chunk[:, k])
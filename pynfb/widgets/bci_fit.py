@@ -1,5 +1,6 @@
 from PyQt5 import QtGui, QtWidgets
 from PyQt5 import QtCore, QtWidgets
+from time import time
 
 class BCIFitWidget(QtWidgets.QWidget):
     fit_clicked = QtCore.pyqtSignal()
@@ -18,6 +19,79 @@ class BCIFitWidget(QtWidgets.QWidget):
         layout.addWidget(fit_button)
 
 
+
+class BackgroundBCIFit(QtCore.QObject):
+    """
+    Fits BCI model of signal in a worker process (BCISignal.fit_model_async) while experiment is running. Fitted model
+    is swapped in GUI thread, then ready signal is emitted. Progress is shown in status bar.
+    """
+    ready = QtCore.pyqtSignal(list)
+    failed = QtCore.pyqtSignal(str)
+    _done = QtCore.pyqtSignal(object)
+
+    def __init__(self, bci_signal, executor, status_bar=None, parent=None):
+        super(BackgroundBCIFit, self).__init__(parent)
+        self.bci_signal = bci_signal
+        self.executor = executor
+        self.status_bar = status_bar
+        self.future = None
+        self.start_time = None
+        # future callbacks are called from executor thread, results are passed to GUI thread by queued signal
+        self._done.connect(self._finish)
+        self.progress_timer = QtCore.QTimer(self)
+        self.progress_timer.timeout.connect(self._show_progress)
+
+    def is_running(self):
+        return self.future is not None
+
+    def start(self, X, y):
+        """
+        Start fitting (result of running fitting is dropped)
+        """
+        self.start_time = time()
+        future = self.bci_signal.fit_model_async(X, y, self.executor)
+        self.future = future
+        future.add_done_callback(lambda f: self._done.emit(f))
+        print('Fitting BCI model "{}" in background on {} samples'.format(self.bci_signal.name, len(X)))
+        self._show_progress()
+        self.progress_timer.start(1000)
+
+    def cancel(self):
+        """
+        Cancel pending fitting (result of already started fitting is dropped)
+        """
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+        self.progress_timer.stop()
+
+    def _show_progress(self):
+        if self.status_bar is not None:
+            self.status_bar.showMessage('Fitting BCI model "{}"... {:.0f} s'.format(self.bci_signal.name,
+                                                                                 time() - self.start_time))
+
+    def _show_message(self, message, timeout=0):
+        print(message)
+        if self.status_bar is not None:
+            self.status_bar.showMessage(message, timeout)
+
+    def _finish(self, future):
+        if future is not self.future:
+            return
+        self.future = None
+        self.progress_timer.stop()
+        try:
+            model, accuracies = future.result()
+        except Exception as e:
+            self._show_message('BCI model "{}" fitting failed: {}'.format(self.bci_signal.name, e))
+            self.failed.emit(str(e))
+            return
+        self.bci_signal.set_model(model)
+        self._show_message('BCI model "{}" is ready (fit accuracy {:.2f}, {:.0f} s)'.format(
+            self.bci_signal.name, accuracies[0], time() - self.start_time), 10000)
+        self.ready.emit(list(accuracies))
+
+
 if __name__ == '__main__':
     app = QtWidgets.QApplication([])
 
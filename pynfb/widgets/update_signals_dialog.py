@@ -8,6 +8,7 @@ from pynfb.protocols import SelectSSDFilterWidget
 from pynfb.protocols.signals_manager.band_selector import BandSelectorWidget
 from pynfb.protocols.ssd.topomap_canvas import TopographicMapCanvas
 from pynfb.protocols.ssd.topomap_selector_ica import ICADialog
+from pynfb.protocols.ssd.ssd import BandCovariances
 from pynfb.widgets.rejections_editor import RejectionsWidget
 from pynfb.widgets.spatial_filter_setup import SpatialFilterSetup
 from pynfb.widgets.check_table import CheckTable
@@ -191,7 +192,7 @@ class SignalsSSDManager(QtWidgets.QDialog):
     test_signal = QtCore.pyqtSignal()
     test_closed_signal = QtCore.pyqtSignal()
     def __init__(self, signals, x, montage, protocol, signals_rec, protocols, sampling_freq=1000,
-                 message=None, protocol_seq=None, marks=None, **kwargs):
+                 message=None, protocol_seq=None, marks=None, csd=None, **kwargs):
         super(SignalsSSDManager, self).__init__(**kwargs)
 
         # name
@@ -203,6 +204,7 @@ class SignalsSSDManager(QtWidgets.QDialog):
         self.init_signals = deepcopy(self.signals)
         self.all_signals = signals
         self.x = x
+        self.csd = csd  # CrossSpectrumAccumulator of each protocol of x (or None)
         self.montage = montage
         self.pos = self.montage.get_pos('EEG')
         self.channels_names = self.montage.get_names('EEG')
@@ -381,8 +383,8 @@ class SignalsSSDManager(QtWidgets.QDialog):
         x = concatenate([self.x[j] for j in ind[0]])
         if csp:
             x = concatenate([x] + [self.x[j] for j in ind[1]])
-        x = dot(x, self.signals[row].rejections.get_prod())
-        x = x[:, self.channels_mask]
+        transform = self.signals[row].rejections.get_prod()[:, self.channels_mask]
+        x = dot(x, transform)
 
         to_all = False
         ica_rejection = None
@@ -401,15 +403,19 @@ class SignalsSSDManager(QtWidgets.QDialog):
                 ica_rejection, filter, topography, self.ica_unmixing_matrix, bandpass, to_all = result
             rejections = []
         elif csp:
+            covariances = (self.get_covariances(ind[0], transform), self.get_covariances(ind[1], transform))
             rejection, filter, topography, _, bandpass, to_all = ICADialog.get_rejection(
                 x, self.channels_names, self.sampling_freq, mode='csp', _stimulus_split=self.stimulus_split.isChecked(),
-                marks=self.marks, band=self.table.cellWidget(row, self.table.columns.index('Band')).get_band())
+                marks=self.marks, band=self.table.cellWidget(row, self.table.columns.index('Band')).get_band(),
+                covariances=covariances if None not in covariances else None)
             rejections = [rejection] if rejection is not None else []
         else:
+            covariances = self.get_covariances(ind[0], transform)
             filter, topography, bandpass, rejections = SelectSSDFilterWidget.select_filter_and_bandpass(x, self.pos,
                                                                                          self.channels_names,
                                                                                          sampling_freq=
-                                                                                         self.sampling_freq)
+                                                                                         self.sampling_freq,
+                                                                                         covariances=covariances)
         if filter is not None:
             filter_copy = np.zeros(len(self.channels_mask))
             filter_copy[self.channels_mask] = filter
@@ -439,6 +445,17 @@ class SignalsSSDManager(QtWidgets.QDialog):
             modified_flag = len(rejections)>0 or bandpass is not None or filter is not None
             self.table.update_row(row_, modified=modified_flag)
 
+    def get_covariances(self, protocols, transform):
+        """
+        Band covariances of protocols data transformed by matrix (None if cross-spectra were not accumulated)
+        """
+        if self.csd is None or len(protocols) == 0 or any(j >= len(self.csd) for j in protocols):
+            return None
+        accumulators = [self.csd[j] for j in protocols]
+        if sum(accumulator.n_segments for accumulator in accumulators) == 0:
+            return None
+        return BandCovariances.from_accumulators(accumulators).transform(transform)
+
     def ok_button_action(self):
         for row in range(self.table.rowCount()):
             band = self.table.cellWidget(row, self.table.columns.index('Band')).get_band()
@@ -456,8 +473,8 @@ class SignalsSSDManager(QtWidgets.QDialog):
         y = concatenate(y, 0)
         print('x', X.shape)
         print('y', y.shape)
-        self.bci_signals[0].fit_model(X, y)
-        print('bxi print action')
+        # model is fitted in background and swapped in when ready
+        self.protocol.experiment.fit_bci_model(self.bci_signals[0], X, y)
 
 
 if __name__ == '__main__':
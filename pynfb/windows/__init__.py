@@ -201,6 +201,10 @@ class MainWindow(QtWidgets.QMainWindow):
         layout.layout.setRowStretch(2, 2)
         self.setCentralWidget(layout)
 
+        # channels quality (permanent, status bar messages are used by BCI fitting)
+        self.channels_quality_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.channels_quality_label)
+
         # main window settings
         self.resize(800, 600)
         self.show()
@@ -0,0 +1,121 @@
+from concurrent.futures import Executor, Future
+
+import numpy as np
+import pytest
+
+from pynfb.signals import bci
+from pynfb.signals.bci import BCISignal
+
+FS = 250
+CHANNELS = ['C3', 'Cz', 'C4']
+
+
+class SynchronousExecutor(Executor):
+    # runs task in caller thread, so the task sees patched module attributes
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class ModelMock:
+    """
+    BCIModel interface: features are samples, the first channel is the label
+    """
+    def __init__(self, fs, bands, ch_names, states_labels, indexes):
+        self.X = None
+
+    def fit(self, X, y=None):
+        if len(X) == 0:
+            raise ValueError('No samples')
+        self.X = X
+        return [1.]
+
+    def get_features(self, chunk):
+        return chunk
+
+    def predict(self, features):
+        return features[:, 0]
+
+
+@pytest.fixture
+def bci_signal(monkeypatch):
+    monkeypatch.setattr(bci, 'BCIModel', ModelMock)
+    return BCISignal(FS, CHANNELS, 'bci', 0)
+
+
+def test_fit_model_async_keeps_current_model(bci_signal):
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((100, len(CHANNELS)))
+    y = rng.integers(0, 3, 100)
+    previous_model = bci_signal.model
+    future = bci_signal.fit_model_async(X, y, SynchronousExecutor())
+    # model is fitted on a snapshot of data
+    fitted_X = X.copy()
+    X[:] = 0
+    model, accuracies = future.result()
+    assert accuracies == [1.]
+    np.testing.assert_array_equal(model.X, fitted_X)
+    assert bci_signal.model is previous_model and not bci_signal.model_fitted
+    bci_signal.set_model(model)
+    assert bci_signal.model is model and bci_signal.model_fitted
+
+
+def test_fit_model_async_error(bci_signal):
+    future = bci_signal.fit_model_async(np.zeros((0, len(CHANNELS))), np.zeros(0), SynchronousExecutor())
+    with pytest.raises(ValueError):
+        future.result()
+    assert not bci_signal.model_fitted
+
+
+def get_chunks_decisions(bci_signal, n_samples, rng, max_chunk):
+    # stream indexes of decision samples for random chunks
+    decisions = []
+    start = 0
+    while start < n_samples:
+        stop = min(start + int(rng.integers(1, max_chunk)), n_samples)
+        decisions.extend(start + bci_signal.get_decision_indexes(stop - start))
+        bci_signal.n_samples = stop
+        start = stop
+    return np.array(decisions)
+
+
+@pytest.mark.parametrize('decision_rate', [3, 10, 250, 1000, None])
+def test_decision_indexes_do_not_depend_on_chunking(decision_rate, monkeypatch):
+    monkeypatch.setattr(bci, 'BCIModel', ModelMock)
+    rng = np.random.default_rng(1)
+    n_samples = FS * 10
+    period = FS / decision_rate if decision_rate and decision_rate < FS else 1
+    expected = np.flatnonzero(np.diff(np.floor(np.arange(-1, n_samples) / period)) > 0)
+    for max_chunk in [2, 40, 500]:
+        bci_signal = BCISignal(FS, CHANNELS, 'bci', 0, decision_rate=decision_rate)
+        np.testing.assert_array_equal(get_chunks_decisions(bci_signal, n_samples, rng, max_chunk), expected)
+    # one decision each fs / decision_rate samples from the first sample
+    assert expected[0] == 0 and len(expected) == np.ceil(n_samples / period)
+    assert set(np.diff(expected)) <= {np.floor(period), np.ceil(period)}
+
+
+def test_labels_are_held_between_decisions(monkeypatch, tmp_path):
+    monkeypatch.setattr(bci, 'BCIModel', ModelMock)
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(2)
+    bci_signal = BCISignal(FS, CHANNELS, 'bci', 0, decision_rate=3)
+    bci_signal.set_model(ModelMock(*bci_signal.model_args))
+    # label of each sample is the first channel
+    x = rng.standard_normal((FS * 10, len(CHANNELS)))
+    x[:, 0] = rng.integers(0, 3, len(x))
+    decisions = np.flatnonzero(np.diff(np.floor(np.arange(-1, len(x)) / (FS / 3))) > 0)
+    start = 0
+    while start < len(x):
+        # chunks shorter than decision period contain at most one decision
+        stop = min(start + int(rng.integers(1, FS // 3)), len(x))
+        bci_signal.update(x[start:stop])
+        last_decision = decisions[decisions < stop][-1]
+        assert bci_signal.current_sample == x[last_decision, 0]
+        np.testing.assert_array_equal(bci_signal.current_chunk, x[last_decision, 0])
+        start = stop
+    assert bci_signal.n_samples == len(x)
+    assert (tmp_path / 'bci_current_state.pkl').read_text() == str(bci_signal.current_sample)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from pynfb.inlets.channels_selector import ChannelsSelector, EVENTS_CHANNEL_NAME
+
+
+class Inlet:
+    def __init__(self, labels, chunks, fs=100):
+        self.labels = labels
+        self.n_channels = len(labels)
+        self.chunks = list(chunks)
+        self.fs = fs
+
+    def get_channels_labels(self):
+        return self.labels
+
+    def get_frequency(self):
+        return self.fs
+
+    def get_next_chunk(self):
+        return self.chunks.pop(0) if self.chunks else (None, None)
+
+
+def test_channels_names_match_merged_columns():
+    timestamp = np.arange(10) / 100
+    main = Inlet(['Cz', 'Pz'], [(np.ones((10, 2)), timestamp)])
+    events = Inlet(['events'], [(np.array([[7.]]), timestamp[[4]])])
+    aux = Inlet(['Photo', 'Resp'], [(np.array([[2., 3.]]), timestamp[[6]])])
+    selector = ChannelsSelector(main, events_inlet=events, aux_inlets=[aux])
+    assert selector.channels_names == ['CZ', 'PZ', EVENTS_CHANNEL_NAME, 'Photo', 'Resp']
+    chunk, _other, _timestamp = selector.get_next_chunk()
+    columns = dict(zip(selector.channels_names, chunk.T))
+    assert columns[EVENTS_CHANNEL_NAME][4] == 7 and np.sum(columns[EVENTS_CHANNEL_NAME]) == 7
+    assert columns['Photo'][6] == 2 and columns['Resp'][6] == 3
+    np.testing.assert_array_equal(columns['CZ'], np.ones(10))
@@ -0,0 +1,203 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from pynfb.signal_processing import decompositions
+from pynfb.signal_processing.decompositions import CSPDecomposition, FilterBankCovariances, SpatialDecompositionPool, \
+    ICADecomposition, get_pca_basis, get_rejection_matrix, get_ica_methods, mutual_info, mutual_info_scores, \
+    score_components, COMPONENT_SCORES
+from pynfb.signal_processing.filters import ButterFilter
+from pynfb.signals.bci import BCIModel
+
+FS = 250
+CHANNELS = ['C3', 'Cz', 'C4', 'P3', 'Pz', 'P4']
+BANDS = [(6, 10), (8, 12), (18, 22)]
+
+
+def get_states_data(rng, n_states=3, duration=10):
+    """
+    Noise of states with different power of mu (10 Hz) and beta (20 Hz) sources
+    :return: data and states labels
+    """
+    n = FS * duration
+    t = np.arange(n * n_states) / FS
+    mixing = rng.standard_normal((2, len(CHANNELS)))
+    y = np.repeat(np.arange(n_states), n)
+    power = np.array([[1, 1], [0.2, 1], [1, 0.2]])[y]
+    sources = np.array([np.sin(2 * np.pi * 10 * t), np.sin(2 * np.pi * 20 * t + 1)]).T * power * 3
+    x = rng.standard_normal((len(t), len(CHANNELS))) + np.dot(sources, mixing)
+    x[len(t) // 3] += 100  # outlier
+    return x, y
+
+
+@pytest.mark.parametrize('label', [0, 1, 2])
+def test_filter_bank_csp_equals_csp_fit(label):
+    x, y = get_states_data(np.random.default_rng(0))
+    filter_bank = FilterBankCovariances(FS, BANDS, len(CHANNELS)).fit(x, y)
+    pool = SpatialDecompositionPool(CHANNELS, FS, BANDS, 'csp')
+    pool.fit(x, y, filter_bank=filter_bank, label=label)
+    for decomposer in pool.pool:
+        csp = CSPDecomposition(CHANNELS, FS, decomposer.band).fit(x, y == label)
+        np.testing.assert_allclose(decomposer.filters, csp.filters, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(decomposer.topographies, csp.topographies, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(decomposer.scores, csp.scores, rtol=1e-8)
+        np.testing.assert_array_equal(decomposer.outliers_mask, csp.outliers_mask)
+        # temporal filter continues after training data
+        np.testing.assert_allclose(decomposer.temporal_filter.zi, csp.temporal_filter.zi)
+
+
+def test_pool_fit_without_filter_bank():
+    x, y = get_states_data(np.random.default_rng(1))
+    pool = SpatialDecompositionPool(CHANNELS, FS, BANDS, 'csp')
+    pool.fit(x, y == 1)
+    shared = SpatialDecompositionPool(CHANNELS, FS, BANDS, 'csp')
+    shared.fit(x, y, filter_bank=FilterBankCovariances(FS, BANDS, len(CHANNELS)).fit(x, y), label=1)
+    for (band, filters), (shared_band, shared_filters) in zip(pool.get_bands_filters(), shared.get_bands_filters()):
+        assert band == shared_band
+        np.testing.assert_allclose(filters, shared_filters, rtol=1e-8, atol=1e-10)
+    with pytest.raises(ValueError):
+        FilterBankCovariances(FS, BANDS, len(CHANNELS)).fit(x, y).transform([(BANDS[0], np.eye(len(CHANNELS)))])
+
+
+def test_bci_model_features_equal_csp_transformer():
+    x, y = get_states_data(np.random.default_rng(2))
+    model = BCIModel(FS, BANDS, CHANNELS, [0, 1, 2], [1, -1])
+    # spatially filtered data of fit (input of variance detector)
+    fit_features = []
+    var_detector_apply = model.var_detector.apply
+    model.var_detector.apply = lambda X: var_detector_apply(fit_features.append(X) or X)
+    accuracies = model.fit(x, y)
+    assert len(accuracies) == 4 and accuracies[0] > 0.8
+    # the same outputs are computed by transformer from the beginning of training data
+    prefiltered = ButterFilter((0.5, 45), FS, len(CHANNELS)).apply(x)
+    for pool in model.csp_pools:
+        for decomposer in pool.pool:
+            decomposer.temporal_filter.reset()
+    np.testing.assert_allclose(model.csp_transformer.apply(prefiltered), fit_features[0], rtol=1e-8, atol=1e-10)
+
+
+def get_mixed_sources(rng, n_sources=3, duration=20, noise=1e-3):
+    # non-gaussian sources mixed into channels (rank of data is n_sources)
+    sources = rng.laplace(size=(FS * duration, n_sources))
+    return np.dot(sources, rng.standard_normal((n_sources, len(CHANNELS)))) + \
+        noise * rng.standard_normal((FS * duration, len(CHANNELS)))
+
+
+@pytest.fixture
+def fit_ica_calls(monkeypatch):
+    # empty session cache and arguments of fit_ica calls
+    monkeypatch.setattr(decompositions, '_ica_cache', OrderedDict())
+    calls = []
+    fit_ica = decompositions.fit_ica
+
+    def fit_ica_mock(X, fs, *args, **kwargs):
+        calls.append((X.shape, fs))
+        return fit_ica(X, fs, *args, **kwargs)
+
+    monkeypatch.setattr(decompositions, 'fit_ica', fit_ica_mock)
+    return calls
+
+
+def test_ica_cache(fit_ica_calls, monkeypatch):
+    x = get_mixed_sources(np.random.default_rng(3))
+    ica = ICADecomposition(CHANNELS, FS, method='fastica').fit(x)
+    cached = ICADecomposition(CHANNELS, FS, method='fastica').fit(x)
+    assert len(fit_ica_calls) == 1
+    np.testing.assert_array_equal(cached.filters, ica.filters)
+    assert cached.scores == ica.scores and cached.sorted_channel_index == ica.sorted_channel_index
+    # temporal filter state of cache hit is the same as after fitting
+    np.testing.assert_allclose(cached.temporal_filter.zi, ica.temporal_filter.zi)
+    np.testing.assert_allclose(cached.temporal_filter.apply(x[:100]), ica.temporal_filter.apply(x[:100]))
+    # cached arrays are not shared with decompositions
+    cached.filters[:] = 0
+    assert np.any(ICADecomposition(CHANNELS, FS, method='fastica').fit(x).filters)
+    # other parameters or data are fitted, least recently used decompositions are evicted
+    monkeypatch.setattr(decompositions, 'ICA_CACHE_SIZE', 2)
+    ICADecomposition(CHANNELS, FS, method='fastica', decimation=2).fit(x)
+    ICADecomposition(CHANNELS, FS, method='fastica').fit(x[1:])
+    assert len(fit_ica_calls) == 3 and len(decompositions._ica_cache) == 2
+    ICADecomposition(CHANNELS, FS, method='fastica').fit(x)
+    assert len(fit_ica_calls) == 4
+
+
+def test_ica_pca_reduction_and_decimation(fit_ica_calls):
+    x = get_mixed_sources(np.random.default_rng(4))
+    assert get_pca_basis(x, 0.99).shape == (len(CHANNELS), 3)
+    assert get_pca_basis(x, 2).shape == (len(CHANNELS), 2)
+    assert get_pca_basis(x, len(CHANNELS)) is None
+    ica = ICADecomposition(CHANNELS, FS, method='fastica', n_components=0.99, decimation=3).fit(x)
+    # ica is fitted on decimated pca components, scores are computed for all samples
+    n_good = np.sum(~ica.outliers_mask)
+    assert fit_ica_calls == [((len(range(0, n_good, 3)), 3), FS / 3)]
+    assert ica.filters.shape == ica.topographies.shape == (len(CHANNELS), 3) and len(ica.scores) == 3
+    np.testing.assert_allclose(np.dot(ica.topographies.T, ica.filters), np.eye(3), atol=1e-8)
+
+
+def test_ica_rejection_matrix():
+    rng = np.random.default_rng(5)
+    x = get_mixed_sources(rng)
+    # non-square un-mixing matrix (pca reduction)
+    filters = rng.standard_normal((len(CHANNELS), 3))
+    topographies = np.linalg.pinv(filters).T
+    rejected = np.dot(x, get_rejection_matrix(filters, topographies, [0, 2]))
+    components = np.dot(rejected, filters)
+    np.testing.assert_allclose(components[:, [0, 2]], 0, atol=1e-8)
+    np.testing.assert_allclose(components[:, 1], np.dot(x, filters[:, 1]))
+    # the same as zeroing of components of square un-mixing matrix
+    filters = rng.standard_normal((len(CHANNELS), len(CHANNELS)))
+    zeroed = filters.copy()
+    zeroed[:, [1, 4]] = 0
+    np.testing.assert_allclose(get_rejection_matrix(filters, np.linalg.inv(filters).T, [1, 4]),
+                               np.dot(zeroed, np.linalg.inv(filters)), atol=1e-8)
+
+
+def test_ica_methods_without_picard(monkeypatch):
+    find_spec = decompositions.importlib.util.find_spec
+    monkeypatch.setattr(decompositions.importlib.util, 'find_spec',
+                        lambda name, *args: None if name == 'picard' else find_spec(name, *args))
+    assert 'picard' not in get_ica_methods() and 'infomax' in get_ica_methods()
+    with pytest.raises(ImportError):
+        decompositions.fit_ica(get_mixed_sources(np.random.default_rng(6), duration=2), FS, 'picard')
+
+
+def get_eog_components(rng, n_samples=5000):
+    # components of different dependence on eog reference (the last one is constant)
+    eog = rng.laplace(size=n_samples)
+    noise = rng.standard_normal((n_samples, 4))
+    components = np.array([eog + 0.1 * noise[:, 0], eog ** 2 + noise[:, 1], noise[:, 2], 0.5 * eog + noise[:, 3],
+                           np.ones(n_samples)]).T
+    return components, eog
+
+
+@pytest.mark.parametrize('batch_size', [2 ** 22, 5000, 1])
+def test_mutual_info_scores_equal_mutual_info(batch_size, monkeypatch):
+    monkeypatch.setattr(decompositions, 'MUTUAL_INFO_BATCH_SIZE', batch_size)
+    components, eog = get_eog_components(np.random.default_rng(7))
+    for bins in [10, 100]:
+        expected = [mutual_info(components[:, j], eog, bins) for j in range(components.shape[1])]
+        np.testing.assert_allclose(mutual_info_scores(components, eog, bins), expected, rtol=1e-10, atol=1e-12)
+    # evenly subsampled samples
+    expected = [mutual_info(components[::3, j], eog[::3]) for j in range(components.shape[1])]
+    np.testing.assert_allclose(mutual_info_scores(components, eog, max_samples=2000), expected, rtol=1e-10, atol=1e-12)
+    np.testing.assert_array_equal(mutual_info_scores(components, eog, max_samples=5000), mutual_info_scores(components, eog))
+
+
+def test_score_components():
+    rng = np.random.default_rng(8)
+    components, eog = get_eog_components(rng)
+    reference = np.array([rng.standard_normal(len(eog)), eog]).T
+    scores = score_components(components, reference, COMPONENT_SCORES, fs=FS, band=(8, 12), max_samples=2500)
+    assert sorted(scores) == sorted(COMPONENT_SCORES)
+    # max over reference channels of subsampled data
+    np.testing.assert_allclose(scores['mutual_info'], np.max(
+        [mutual_info_scores(components[::2], reference[::2, j]) for j in range(2)], 0), rtol=1e-10)
+    expected = [abs(np.corrcoef(components[::2, j], eog[::2])[0, 1]) for j in range(4)]
+    np.testing.assert_allclose(scores['correlation'][:4], expected, atol=0.05)
+    assert scores['correlation'][4] == 0 and np.argmax(scores['correlation']) == 0
+    # band power ratio of white noise is band width to nyquist frequency ratio, constant has no power in band
+    np.testing.assert_allclose(scores['band_power_ratio'][2], 4 / (FS / 2), rtol=0.3)
+    assert scores['band_power_ratio'][4] == 0
+    assert list(score_components(components, eog)) == ['mutual_info']
+    with pytest.raises(ValueError):
+        score_components(components, eog, ['kurtosis'])
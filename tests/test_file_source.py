@@ -0,0 +1,43 @@
+import h5py
+import numpy as np
+import pytest
+
+from pynfb.generators import FileSource, DEFAULT_FILE_FS, ch_names32, stream_file_in_a_thread
+from pynfb.serializers.hdf5 import save_channels_and_fs
+
+
+def write_protocols(file_path, protocols_data, names=None):
+    with h5py.File(file_path, 'w') as f:
+        for number, data in enumerate(protocols_data, 1):
+            group = f.create_group('protocol{}'.format(number))
+            group['raw_data'] = data
+            group.attrs['name'] = names[number - 1] if names else 'p{}'.format(number)
+
+
+def test_file_source_reads_selected_protocols(tmp_path):
+    file_path = str(tmp_path / 'experiment_data.h5')
+    data = [np.random.default_rng(k).standard_normal((50 * (k + 1), 3)) for k in range(3)]
+    write_protocols(file_path, data, names=['Baseline', 'FB', 'FB'])
+    save_channels_and_fs(file_path, ['Cz', 'Pz', 'O1'], 250)
+    source = FileSource(file_path, exclude=['pz'], protocols=['FB'])
+    assert source.labels == ['Cz', 'O1'] and source.fs == 250 and source.n_samples == 250
+    np.testing.assert_allclose(source.read(90, 110), np.vstack(data[1:])[90:110][:, [0, 2]].astype('float32'))
+    source.close()
+
+
+def test_file_source_default_labels_and_fs(tmp_path):
+    file_path = str(tmp_path / 'experiment_data.h5')
+    write_protocols(file_path, [np.zeros((20, 4)), np.ones((10, 4))])
+    source = FileSource(file_path)
+    assert source.labels == ch_names32[:4] and source.fs == DEFAULT_FILE_FS and source.n_samples == 30
+    np.testing.assert_array_equal(source.read(15, 25)[:, 0], [0] * 5 + [1] * 5)
+    source.close()
+
+
+def test_stream_file_errors_are_raised_before_playback_process(tmp_path):
+    with pytest.raises(OSError):
+        stream_file_in_a_thread(str(tmp_path / 'missing.h5'), '', 'playback')
+    file_path = str(tmp_path / 'experiment_data.h5')
+    write_protocols(file_path, [np.zeros((20, 4))])
+    with pytest.raises(ValueError, match='No protocols'):
+        stream_file_in_a_thread(file_path, '', 'playback', protocols=[5])
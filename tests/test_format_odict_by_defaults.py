@@ -1,3 +1,15 @@
-from pynfb.serializers import *
+from pynfb.serializers.defaults import vectors_defaults
+from pynfb.serializers.xml_ import xml_file_to_odict, format_odict_by_defaults
 
-odict = xml_io.read_xml_to_dict('pynfb/serializers/settings/pilot.xml')
+
+def test_format_odict_by_defaults():
+    odict = format_odict_by_defaults(xml_file_to_odict('tests/designs/alpha_nfb_settings.xml'), vectors_defaults)
+    # keys and order of defaults, values of file
+    assert list(odict.keys()) == list(vectors_defaults.keys())
+    assert odict['sExperimentName'] == 'alpha-nfb-example'
+    signal = odict['vSignals']['DerivedSignal'][0]
+    assert list(signal.keys()) == list(vectors_defaults['vSignals']['DerivedSignal'][0].keys())
+    assert signal['sSignalName'] == 'Alpha'
+    assert signal['fBandpassLowHz'] == 9
+    # missing keys are taken from defaults
+    assert signal['iDelayMs'] == vectors_defaults['vSignals']['DerivedSignal'][0]['iDelayMs']
@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+import pytest
+
+from pynfb.inlets.FieldTrip import Client, DATATYPE_FLOAT32, DATATYPE_FLOAT64
+from pynfb.inlets.ftbuffer_inlet import FieldTripBufferInlet
+from pynfb.inlets.ftbuffer_server import FieldTripBufferServer, run_ftbuffer_generator
+
+LABELS = ['Cz', 'Pz', 'O1']
+FS = 500
+
+
+@pytest.fixture
+def server():
+    server = FieldTripBufferServer(port=0).start_in_a_thread()
+    yield server
+    server.stop()
+
+
+def get_client(server):
+    client = Client()
+    client.connect(server.host, server.port)
+    return client
+
+
+def test_inlet_without_header_raises(server):
+    with pytest.raises(IOError, match='no header'):
+        FieldTripBufferInlet(server.host, server.port, header_timeout=0.3)
+
+
+def test_inlet_waits_for_header(server):
+    client = get_client(server)
+    timer = threading.Timer(0.3, lambda: client.putHeader(len(LABELS), FS, DATATYPE_FLOAT32, labels=LABELS))
+    timer.start()
+    inlet = FieldTripBufferInlet(server.host, server.port, header_timeout=5)
+    timer.join()
+    assert inlet.get_frequency() == FS and inlet.get_n_channels() == len(LABELS)
+    assert inlet.get_channels_labels() == LABELS
+    inlet.disconnect()
+    client.disconnect()
+
+
+def test_inlet_detects_header_change(server):
+    client = get_client(server)
+    client.putHeader(len(LABELS), FS, DATATYPE_FLOAT32, labels=LABELS)
+    inlet = FieldTripBufferInlet(server.host, server.port)
+    client.putData(np.ones((10, len(LABELS)), dtype='float32'))
+    assert inlet.get_next_chunk()[0] is not None
+    client.putHeader(len(LABELS) + 1, FS, DATATYPE_FLOAT32)
+    client.putData(np.ones((5, len(LABELS) + 1), dtype='float32'))
+    with pytest.raises(IOError, match='header is changed'):
+        inlet.get_next_chunk()
+    inlet.disconnect()
+    client.disconnect()
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_inlet_reads_pushed_samples(server, dtype):
+    client = get_client(server)
+    client.putHeader(len(LABELS), FS, DATATYPE_FLOAT64 if dtype == 'float64' else DATATYPE_FLOAT32, labels=LABELS)
+    inlet = FieldTripBufferInlet(server.host, server.port, wait_timeout=1000)
+    data = np.random.default_rng(0).standard_normal((100, len(LABELS))).astype(dtype)
+    # the first chunk is the last sample of the buffer, then all new samples
+    client.putData(data[:10])
+    chunk, timestamp = inlet.get_next_chunk()
+    np.testing.assert_array_equal(chunk, data[9:10])
+    assert chunk.dtype == 'float64' and len(timestamp) == 1
+    received = []
+    for start in range(10, 100, 30):
+        client.putData(data[start:start + 30])
+        chunk, _timestamp = inlet.get_next_chunk()
+        received.append(chunk.copy())
+    np.testing.assert_array_equal(np.concatenate(received), data[10:])
+    # no new samples
+    inlet.wait_timeout = 10
+    assert inlet.get_next_chunk() == (None, None)
+    inlet.disconnect()
+    client.disconnect()
+
+
+def test_generator_streams_to_inlet(server):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_ftbuffer_generator, args=(server.host, server.port, 8, 1000),
+                              kwargs=dict(stop_event=stop_event, dtype='float64'))
+    thread.start()
+    try:
+        inlet = FieldTripBufferInlet(server.host, server.port, wait_timeout=1000)
+        assert inlet.get_n_channels() == 8 and inlet.get_channels_labels()[0] == 'Ch1'
+        n_samples = sum(len(inlet.get_next_chunk()[0]) for _k in range(5))
+        assert n_samples > 5
+        inlet.disconnect()
+    finally:
+        stop_event.set()
+        thread.join()
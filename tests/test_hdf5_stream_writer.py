@@ -0,0 +1,88 @@
+import h5py
+import numpy as np
+
+from pynfb.recorders import SpillRecorder, EventRecorder
+from pynfb.serializers.hdf5 import HDF5StreamWriter, RecordersStreamer, read_protocol_dataset
+from pynfb.signals import DerivedSignal
+
+N_CHANNELS = 3
+MAX_CHUNK = 16
+
+
+def record_protocol(streamer, group_name, recorders, events_recorders, rng, n_chunks=60):
+    """
+    Recording loop as in Experiment.update: event channels are written over the current chunk length, also while
+    recording is paused, so the last samples are rewritten after they are recorded
+    """
+    n_samples = 0
+    for k in range(n_chunks):
+        n = int(rng.integers(1, MAX_CHUNK))
+        paused = k % 7 == 3
+        if not paused:
+            recorders['raw_data'][n_samples:n_samples + n] = rng.standard_normal((n, N_CHANNELS))
+            recorders['reward_data'][n_samples:n_samples + n] = k
+            n_samples += n
+            events_recorders['chunk_data'][n_samples - n:n_samples] = 0
+            events_recorders['chunk_data'][n_samples - 1] = n
+        events_recorders['probe_data'][max(n_samples - n, 0):n_samples] = 0
+        events_recorders['probe_data'][n_samples - 1] = k
+        streamer.update(group_name, n_samples, n)
+    streamer.flush(group_name, n_samples)
+    return n_samples
+
+
+def test_streamed_file_equals_recorders(tmp_path):
+    rng = np.random.default_rng(0)
+    file_path = str(tmp_path / 'experiment_data.h5')
+    recorders = {'raw_data': SpillRecorder(100, (N_CHANNELS, ), window=40, file_path=str(tmp_path / 'raw.dat')),
+                 'reward_data': SpillRecorder(100, (), window=40, file_path=str(tmp_path / 'reward.dat'))}
+    events_recorders = {'chunk_data': EventRecorder(100), 'probe_data': EventRecorder(100)}
+    writer = HDF5StreamWriter(file_path, {'raw_data': (N_CHANNELS, ), 'reward_data': ()},
+                              events_names=list(events_recorders))
+    streamer = RecordersStreamer(writer, recorders, events_recorders, delay=4,
+                                 transforms={'reward_data': lambda data: 2 * data})
+    signals = [DerivedSignal(0, 500, N_CHANNELS, name='alpha')]
+    expected = []
+    for protocol in range(2):
+        group_name = 'protocol{}'.format(protocol + 1)
+        n_samples = record_protocol(streamer, group_name, recorders, events_recorders, rng)
+        writer.release()
+        writer.close_group(group_name, signals, protocol_name='p{}'.format(protocol + 1))
+        expected.append({'raw_data': recorders['raw_data'][:n_samples],
+                         'reward_data': 2 * recorders['reward_data'][:n_samples]})
+        expected[-1].update({name: recorder[:n_samples] for name, recorder in events_recorders.items()})
+        streamer.reset()
+        for recorder in events_recorders.values():
+            recorder.clear()
+    writer.stop()
+
+    with h5py.File(file_path, 'r') as f:
+        for protocol, datasets in enumerate(expected):
+            group = f['protocol{}'.format(protocol + 1)]
+            assert group.attrs['name'] == 'p{}'.format(protocol + 1)
+            for name, data in datasets.items():
+                np.testing.assert_array_equal(read_protocol_dataset(group, name), data, err_msg=name)
+    for recorder in recorders.values():
+        recorder.close()
+
+
+def test_streamer_keeps_mutable_tail(tmp_path):
+    recorder = SpillRecorder(100, (), window=100, file_path=str(tmp_path / 'data.dat'))
+    appended = []
+
+    class Writer:
+        def append(self, group_name, events=None, **data):
+            appended.append(data['x'])
+
+    streamer = RecordersStreamer(Writer(), {'x': recorder}, {}, delay=5)
+    recorder[0:20] = np.arange(20)
+    streamer.update('protocol1', 20)
+    assert len(appended[0]) == 15
+    # longer chunk increases delay
+    recorder[20:30] = np.arange(20, 30)
+    streamer.update('protocol1', 30, chunk_size=8)
+    assert len(appended[1]) == 7
+    recorder[29] = -1
+    streamer.flush('protocol1', 30)
+    np.testing.assert_array_equal(np.concatenate(appended), np.append(np.arange(29), -1))
+    recorder.close()
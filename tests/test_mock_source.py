@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import h5py
+import numpy as np
+import pytest
+
+from pynfb.serializers.mock_source import MockSignalsSource
+
+DONOR_PROTOCOLS = ['Baseline', 'FB', 'Rest', 'FB']
+
+
+@pytest.fixture
+def donor_file(tmp_path):
+    file_path = str(tmp_path / 'donor.h5')
+    with h5py.File(file_path, 'w') as f:
+        for number, name in enumerate(DONOR_PROTOCOLS, 1):
+            group = f.create_group('protocol{}'.format(number))
+            group.attrs['name'] = name
+            group['signals_data'] = np.full((10 * number, 2), number, dtype='float64')
+    return file_path
+
+
+def get_protocols(file_path, names, dataset):
+    return [SimpleNamespace(name=name, mock_samples_file_path=file_path, mock_samples_protocol=dataset)
+            for name in names]
+
+
+def get_donors(source, n_protocols):
+    return [int(source.get(k)[0, 0]) for k in range(n_protocols)]
+
+
+def test_legacy_dataset_maps_protocol_n_to_donor_protocol_n(donor_file):
+    # designs store default 'protocol1' in all protocols
+    source = MockSignalsSource(get_protocols(donor_file, ['A', 'B', 'C', 'D'], 'protocol1'))
+    assert get_donors(source, 4) == [1, 2, 3, 4]
+    assert source.get(2).shape == (30, 2)
+    source.close()
+
+
+def test_mapping_by_name_and_explicit_group(donor_file):
+    protocols = get_protocols(donor_file, ['FB', 'Baseline', 'FB'], '')
+    protocols.append(SimpleNamespace(name='X', mock_samples_file_path=donor_file, mock_samples_protocol='protocol3'))
+    protocols.append(SimpleNamespace(name='Y', mock_samples_file_path=None, mock_samples_protocol=''))
+    source = MockSignalsSource(protocols)
+    assert get_donors(source, 4) == [2, 1, 4, 3]
+    assert 4 not in source
+    source.close()
+
+
+def test_mapping_errors_are_raised_at_start(donor_file):
+    protocols = get_protocols(donor_file, ['A', 'B', 'C', 'D', 'E'], 'protocol1')
+    protocols += get_protocols(donor_file, ['Rest', 'Rest'], '')
+    with pytest.raises(ValueError) as error:
+        MockSignalsSource(protocols)
+    assert 'protocol5' in str(error.value) and 'protocol7' in str(error.value)
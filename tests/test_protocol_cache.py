@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from pynfb.recorders import SpillRecorder
+from pynfb.serializers.hdf5 import HDF5StreamWriter, ProtocolCache
+
+N_CHANNELS = 4
+N_SAMPLES = 100
+# bytes of single protocol dataset
+N_BYTES = N_SAMPLES * N_CHANNELS * 8
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    """
+    experiment_data.h5 with raw_data of 3 protocols
+    """
+    rng = np.random.default_rng(0)
+    file_path = str(tmp_path / 'experiment_data.h5')
+    writer = HDF5StreamWriter(file_path, {'raw_data': (N_CHANNELS, )})
+    data = []
+    for number in range(1, 4):
+        data.append(rng.standard_normal((N_SAMPLES, N_CHANNELS)))
+        writer.append('protocol{}'.format(number), raw_data=data[-1])
+        writer.close_group('protocol{}'.format(number), [], protocol_name='p{}'.format(number))
+    writer.stop()
+    return file_path, data
+
+
+def test_cache_evicts_least_recently_used(experiment):
+    file_path, data = experiment
+    cache = ProtocolCache(file_path, max_n_bytes=2 * N_BYTES)
+    for number in [1, 2]:
+        cache.put(number, 'raw_data', data[number - 1])
+    # protocol 1 is used, so protocol 2 is evicted by protocol 3
+    cache.get(1, 'raw_data')
+    cache.put(3, 'raw_data', data[2])
+    assert list(cache._cache) == [(1, 'raw_data'), (3, 'raw_data')]
+    assert cache.n_bytes == 2 * N_BYTES
+
+
+def test_cache_budget(experiment):
+    file_path, data = experiment
+    cache = ProtocolCache(file_path, max_n_bytes=int(2.5 * N_BYTES))
+    for number in [1, 2, 3]:
+        cache.put(number, 'raw_data', data[number - 1])
+        assert cache.n_bytes <= cache.max_n_bytes
+    assert list(cache._cache) == [(2, 'raw_data'), (3, 'raw_data')]
+    # replacing dataset doesn't count it twice
+    cache.put(3, 'raw_data', data[2])
+    assert cache.n_bytes == 2 * N_BYTES
+    assert cache.pop(2, 'raw_data') is not None and cache.n_bytes == N_BYTES
+
+
+def test_cache_oversize_put_returns_data(experiment, tmp_path):
+    file_path, data = experiment
+    cache = ProtocolCache(file_path, max_n_bytes=N_BYTES - 1)
+    assert cache.put(1, 'raw_data', data[0]) is data[0]
+    # recorder view is not materialized
+    recorder = SpillRecorder(N_SAMPLES, (N_CHANNELS, ), window=N_SAMPLES, file_path=str(tmp_path / 'raw.dat'))
+    view = recorder.view(0, N_SAMPLES)
+    assert cache.put(1, 'raw_data', view) is view
+    assert cache.n_bytes == 0 and len(cache._cache) == 0
+    recorder.close()
+
+
+def test_cache_loads_missing_datasets_from_file(experiment):
+    file_path, data = experiment
+    cache = ProtocolCache(file_path, max_n_bytes=2 * N_BYTES)
+    np.testing.assert_array_equal(cache.get(2, 'raw_data'), data[1])
+    assert list(cache._cache) == [(2, 'raw_data')]
+    raw = cache.get_protocols_raw([0, 2])
+    for x, expected in zip(raw, [data[0], data[2]]):
+        np.testing.assert_array_equal(x, expected)
+    assert cache.get_protocols_raw() is None
+    # dataset larger than budget is loaded but not cached
+    small_cache = ProtocolCache(file_path, max_n_bytes=N_BYTES // 2)
+    np.testing.assert_array_equal(small_cache.get(3, 'raw_data'), data[2])
+    assert small_cache.n_bytes == 0
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from pynfb.signal_processing.quality import ChannelQualityMonitor, QUALITY_FLAGS
+
+FS = 500
+N_CHANNELS = 6
+
+
+def get_data(rng, duration=60):
+    """
+    Noise with a problem per channel: 0 - clean, 1 - line noise, 2 - flat signal from 20 to 25 s, 3 - variance burst
+    from 30 to 31 s, 4 - clipping from 40 s, 5 - clean
+    """
+    n = FS * duration
+    t = np.arange(n) / FS
+    x = rng.standard_normal((n, N_CHANNELS)) * 10
+    x[:, 1] += 30 * np.sin(2 * np.pi * 50 * t)
+    x[FS * 20:FS * 25, 2] = x[FS * 20, 2]
+    x[FS * 30:FS * 31, 3] *= 20
+    x[FS * 40:, 4] = np.clip(x[FS * 40:, 4] * 5, -60, 60)
+    return x
+
+
+def get_flags_ranges(monitor, x, rng, max_chunk=40, n_channels=N_CHANNELS):
+    # times [s] of the first and the last chunk with flag for each channel
+    ranges = [{} for _ch in range(n_channels)]
+    start = 0
+    while start < len(x):
+        stop = min(start + int(rng.integers(1, max_chunk)), len(x))
+        status = monitor.update(x[start:stop])
+        assert status is monitor.status and status.shape == (n_channels, )
+        for ch in range(n_channels):
+            for name, flag in QUALITY_FLAGS.items():
+                if status[ch] & flag:
+                    ranges[ch].setdefault(name, [stop / FS, stop / FS])[1] = stop / FS
+        start = stop
+    return ranges
+
+
+def test_monitor_detects_channel_problems():
+    rng = np.random.default_rng(0)
+    monitor = ChannelQualityMonitor(FS, N_CHANNELS)
+    ranges = get_flags_ranges(monitor, get_data(rng), rng)
+    assert ranges[0] == {} and ranges[5] == {}
+    assert list(ranges[1]) == ['line_noise'] and ranges[1]['line_noise'][0] <= 1.1
+    assert list(ranges[2]) == ['flat']
+    assert ranges[2]['flat'] == pytest.approx([20.5, 25], abs=0.1)
+    assert list(ranges[3]) == ['variance']
+    assert 30 < ranges[3]['variance'][0] < 30.5 and 30.5 < ranges[3]['variance'][1] < 31.5
+    assert list(ranges[4]) == ['clipping'] and 40 < ranges[4]['clipping'][0] < 41
+    assert monitor.get_troubled_channels(['c{}'.format(ch) for ch in range(N_CHANNELS)]) == \
+        ['c1 (line_noise)', 'c4 (clipping)']
+    assert monitor.get_troubled_channels(['c{}'.format(ch) for ch in range(N_CHANNELS)], flags=['clipping']) == \
+        ['c4 (clipping)']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 250, 1000])
+def test_monitor_flags_do_not_depend_on_chunking(chunk_size):
+    x = get_data(np.random.default_rng(1), duration=30)
+    monitor = ChannelQualityMonitor(FS, N_CHANNELS)
+    reference = ChannelQualityMonitor(FS, N_CHANNELS)
+    # flat run is counted over chunks (the first sample of the flat segment differs from the previous one)
+    for start in range(0, FS * 25, chunk_size):
+        monitor.update(x[start:min(start + chunk_size, FS * 25)])
+    reference.update(x[:FS * 25])
+    assert monitor.flat_run[2] == reference.flat_run[2] == FS * 5 - 1
+    for start in range(FS * 25, len(x), chunk_size):
+        monitor.update(x[start:start + chunk_size])
+    reference.update(x[FS * 25:])
+    # line noise power is computed by 1 s blocks, chunks change only the running mean and variance
+    np.testing.assert_allclose(monitor.line_noise, reference.line_noise, rtol=0.05, atol=0.01)
+    np.testing.assert_array_equal(monitor.status & QUALITY_FLAGS['line_noise'], [0, 4, 0, 0, 0, 0])
+    # empty chunk does not change state
+    status = monitor.status.copy()
+    np.testing.assert_array_equal(monitor.update(x[:0]), status)
+
+
+def test_monitor_integer_stream():
+    # int16 samples of large amplitude overflow if squared without conversion
+    rng = np.random.default_rng(2)
+    x = (rng.standard_normal((FS * 10, 4)) * 3000).astype(np.int16)
+    monitor = ChannelQualityMonitor(FS, 4)
+    for start in range(0, len(x), 32):
+        monitor.update(x[start:start + 32])
+    np.testing.assert_allclose(monitor.variance, 3000 ** 2, rtol=0.3)
+    np.testing.assert_array_equal(monitor.status, 0)
+
+
+def test_monitor_clipping_after_artifact():
+    # peak of a large artifact decays, so later clipping at lower level is detected
+    rng = np.random.default_rng(3)
+    x = rng.standard_normal((FS * 60, 1)) * 10
+    x[FS * 5:FS * 5 + 100] *= 100
+    x[FS * 50:] = np.clip(x[FS * 50:] * 5, -60, 60)
+    monitor = ChannelQualityMonitor(FS, 1, std_ratio=1e4)
+    ranges = get_flags_ranges(monitor, x, rng, n_channels=1)
+    assert list(ranges[0]) == ['clipping'] and 50 < ranges[0]['clipping'][0] < 51
+
+
+@pytest.mark.parametrize('line_freq', [50, 60])
+def test_monitor_line_freq(line_freq):
+    rng = np.random.default_rng(4)
+    t = np.arange(FS * 10) / FS
+    x = rng.standard_normal((len(t), 2)) * 10
+    x[:, 1] += 30 * np.sin(2 * np.pi * 60 * t)
+    monitor = ChannelQualityMonitor(FS, 2, line_freq=line_freq)
+    for start in range(0, len(x), 20):
+        monitor.update(x[start:start + 20])
+    np.testing.assert_array_equal(monitor.status, [0, QUALITY_FLAGS['line_noise'] if line_freq == 60 else 0])
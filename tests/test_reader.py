@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from pynfb.postprocessing.utils import load_data
+from pynfb.recorders import EventRecorder
+from pynfb.serializers.hdf5 import HDF5StreamWriter, save_channels_and_fs, save_signals, load_h5py_all_samples
+from pynfb.serializers.reader import ExperimentReader
+from pynfb.signals import DerivedSignal
+
+CHANNELS = ['Fp1', 'Cz', 'Pz', 'O1']
+FS = 100
+PROTOCOLS = [('Baseline', 150), ('FB', 230), ('Baseline', 70)]
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    """
+    experiment_data.h5 written as by Experiment: raw and signals datasets and mark_data events table per protocol
+    """
+    rng = np.random.default_rng(0)
+    file_path = str(tmp_path / 'experiment_data.h5')
+    signals = [DerivedSignal(0, FS, len(CHANNELS), name='Alpha'), DerivedSignal(1, FS, len(CHANNELS), name='Beta')]
+    save_channels_and_fs(file_path, CHANNELS, FS)
+    save_signals(file_path, signals, 'protocol0')
+    writer = HDF5StreamWriter(file_path, {'raw_data': (len(CHANNELS), ), 'signals_data': (len(signals), )},
+                              events_names=['mark_data'])
+    data = {'raw_data': [], 'signals_data': [], 'mark_data': []}
+    for number, (name, n_samples) in enumerate(PROTOCOLS, 1):
+        marks = EventRecorder(n_samples)
+        marks[:] = 0
+        marks[n_samples // 2] = number
+        raw = rng.standard_normal((n_samples, len(CHANNELS)))
+        signals_data = rng.standard_normal((n_samples, len(signals)))
+        writer.append('protocol{}'.format(number), events={'mark_data': marks.events()}, raw_data=raw,
+                      signals_data=signals_data)
+        writer.close_group('protocol{}'.format(number), signals, protocol_name=name)
+        for key, value in zip(data, [raw, signals_data, marks[:]]):
+            data[key].append(value)
+    writer.stop()
+    return file_path, {key: np.concatenate(value) for key, value in data.items()}
+
+
+def test_reader_protocols_index(experiment):
+    file_path, _data = experiment
+    with ExperimentReader(file_path) as reader:
+        assert reader.channels == CHANNELS and reader.fs == FS
+        assert reader.signals == ['Alpha', 'Beta']
+        assert [(info.name, info.start, info.stop) for info in reader.protocols] == \
+               [('Baseline', 0, 150), ('FB', 150, 380), ('Baseline', 380, 450)]
+        assert reader.protocol_info('FB').duration == 2.3
+        assert reader.protocol('Baseline').info.number == 1
+        with pytest.raises(KeyError):
+            reader.protocol('Rest')
+
+
+def test_reader_slicing(experiment):
+    file_path, data = experiment
+    with ExperimentReader(file_path) as reader:
+        raw = reader.session('raw_data')
+        assert raw.shape == data['raw_data'].shape
+        np.testing.assert_array_equal(raw[100:420], data['raw_data'][100:420])
+        np.testing.assert_array_equal(raw[140:160, ['Pz', 'Fp1']], data['raw_data'][140:160][:, [2, 0]])
+        np.testing.assert_array_equal(raw[-1], data['raw_data'][-1])
+        np.testing.assert_array_equal(reader.protocol('FB').signals[:, 'Beta'], data['signals_data'][150:380, 1])
+        np.testing.assert_array_equal(reader.session('mark_data')[:], data['mark_data'])
+        np.testing.assert_array_equal(reader.time_range(1, 2, columns='Cz'), data['raw_data'][100:200, 1])
+        np.testing.assert_array_equal(reader.protocol(3).time_range(0.5, name='mark_data'), data['mark_data'][430:])
+        with pytest.raises(KeyError):
+            raw[:, 'C3']
+
+
+def test_load_functions_use_reader(experiment):
+    file_path, data = experiment
+    np.testing.assert_array_equal(load_h5py_all_samples(file_path), data['raw_data'])
+    np.testing.assert_array_equal(load_h5py_all_samples(file_path, raw=False), data['signals_data'])
+    df, fs, p_names, channels = load_data(file_path, drop_channels=['Fp1'])
+    assert fs == FS and p_names == ['Baseline', 'FB', 'Baseline'] and channels == CHANNELS[1:]
+    np.testing.assert_array_equal(df[channels].values, data['raw_data'][:, 1:])
+    assert list(df.groupby('block_number')['block_name'].first()) == p_names
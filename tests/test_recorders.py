@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+
+from pynfb.recorders import EventRecorder, SpillRecorder, expand_events
+
+
+def test_event_recorder_equals_dense_array():
+    rng = np.random.default_rng(0)
+    recorder = EventRecorder(200)
+    dense = np.full(200, np.nan)
+    for _k in range(300):
+        start = int(rng.integers(0, 200))
+        stop = int(rng.integers(start, 201))
+        value = float(rng.choice([0, 0, 1, 2, np.nan]))
+        if rng.random() < 0.5:
+            recorder[start:stop] = value
+            dense[start:stop] = value
+        else:
+            recorder[start] = value
+            dense[start] = value
+    np.testing.assert_array_equal(recorder[:], dense)
+    np.testing.assert_array_equal(recorder[37:151], dense[37:151])
+    assert recorder[-1] == dense[-1] or np.isnan(dense[-1])
+    # change points are compact and expand to the same array
+    indices, values = recorder.events()
+    changed = ~((dense[1:] == dense[:-1]) | (np.isnan(dense[1:]) & np.isnan(dense[:-1])))
+    assert len(indices) <= np.sum(changed) + 1
+    np.testing.assert_array_equal(expand_events(indices, values, 200), dense)
+
+
+def test_event_recorder_grows_and_clears():
+    recorder = EventRecorder(10, fill_value=0)
+    recorder[15:20] = 3
+    assert len(recorder) == 20
+    np.testing.assert_array_equal(recorder[10:20], [0] * 5 + [3] * 5)
+    recorder[12] = None
+    assert np.isnan(recorder[12])
+    with pytest.raises(IndexError):
+        recorder[25]
+    recorder.clear()
+    np.testing.assert_array_equal(recorder[:], np.zeros(20))
+
+
+def test_event_recorder_events_range():
+    recorder = EventRecorder(100, fill_value=0)
+    recorder[10] = 1
+    recorder[50:60] = 2
+    indices, values = recorder.events(0, 50)
+    np.testing.assert_array_equal(indices, [10, 11])
+    np.testing.assert_array_equal(values, [1, 0])
+    indices, values = recorder.events(50)
+    np.testing.assert_array_equal(indices, [50, 60])
+    np.testing.assert_array_equal(values, [2, 0])
+
+
+@pytest.fixture
+def spill_recorder(tmp_path):
+    recorder = SpillRecorder(100, (2, ), window=10, file_path=str(tmp_path / 'spill.dat'))
+    yield recorder
+    recorder.close()
+
+
+def test_spill_recorder_reads_never_written_range_past_window(spill_recorder):
+    x = np.arange(60.).reshape(30, 2)
+    spill_recorder[0:30] = x
+    np.testing.assert_array_equal(spill_recorder[40:60], np.full((20, 2), np.nan))
+    np.testing.assert_array_equal(spill_recorder[25:45], np.vstack([x[25:], np.full((15, 2), np.nan)]))
+    np.testing.assert_array_equal(spill_recorder[0:30], x)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 5, 6, 10, 11, 25])
+def test_spill_recorder_equals_dense_array(spill_recorder, chunk_size):
+    rng = np.random.default_rng(chunk_size)
+    dense = np.full((150, 2), np.nan)
+    for start in range(0, 150, chunk_size):
+        stop = min(start + chunk_size, 150)
+        x = rng.standard_normal((stop - start, 2))
+        spill_recorder[start:stop] = x
+        dense[start:stop] = x
+        # the last samples are rewritten (as event channels of the current chunk)
+        spill_recorder[max(start - 2, 0)] = 7
+        dense[max(start - 2, 0)] = 7
+    assert len(spill_recorder) == 150
+    np.testing.assert_array_equal(spill_recorder[:], dense)
+    # read ranges crossing disk/memory boundary and out of written samples
+    for start, stop in [(0, 1), (139, 141), (135, 150), (140, 160), (149, 150), (150, 170), (0, 200)]:
+        np.testing.assert_array_equal(spill_recorder[start:stop], np.vstack([dense, np.full((50, 2), np.nan)])[start:stop])
+    np.testing.assert_array_equal(spill_recorder[-1], dense[-1])
+    np.testing.assert_array_equal(spill_recorder[10:20, 1], dense[10:20, 1])
+    np.testing.assert_array_equal(np.asarray(spill_recorder.view(5, 145)), dense[5:145])
+    np.testing.assert_array_equal(spill_recorder.view(5, 145)[-3:], dense[142:145])
+
+
+def test_spill_recorder_reset(spill_recorder):
+    spill_recorder[0:50] = np.ones((50, 2))
+    assert os.path.getsize(spill_recorder.file_path) > 0
+    spill_recorder.reset()
+    assert os.path.getsize(spill_recorder.file_path) == 0
+    np.testing.assert_array_equal(spill_recorder[0:50], np.full((50, 2), np.nan))
+    spill_recorder[0:5] = 2
+    spill_recorder[5:30] = 3
+    np.testing.assert_array_equal(spill_recorder[0:30], np.vstack([np.full((5, 2), 2), np.full((25, 2), 3)]))
+    np.testing.assert_array_equal(spill_recorder[30:50], np.full((20, 2), np.nan))
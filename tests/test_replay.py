@@ -0,0 +1,130 @@
+import numpy as np
+
+from pynfb.recorders import EventRecorder
+from pynfb.replay import ExperimentReplay
+from pynfb.reward import Reward
+from pynfb.serializers.hdf5 import HDF5StreamWriter, save_channels_and_fs, save_signals, save_xml_str_to_hdf5_dataset
+from pynfb.serializers.xml_ import xml_file_to_params, params_to_xml
+from pynfb.signals import DerivedSignal, CompositeSignal, SpatialFilterBank
+
+CHANNELS = ['Fp1', 'Fz', 'Cz', 'Pz', 'O1', 'O2']
+FS = 250
+
+
+def get_params():
+    params = xml_file_to_params()
+    alpha = params['vSignals']['DerivedSignal'][0]
+    alpha.update(sSignalName='Alpha', fBandpassLowHz=8, fBandpassHighHz=12, fFFTWindowSize=250,
+                 SpatialFilterMatrix='Cz=1;Pz=-1')
+    beta = alpha.copy()
+    beta.update(sSignalName='Beta', fBandpassLowHz=18, fBandpassHighHz=25)
+    params['vSignals']['DerivedSignal'].append(beta)
+    params['vSignals']['CompositeSignal'][0].update(sSignalName='Ratio', sExpression='Alpha-Beta')
+    baseline = params['vProtocols'][0]
+    baseline.update(sProtocolName='Baseline')
+    feedback = baseline.copy()
+    feedback.update(sProtocolName='FB', sFb_type='Feedback', fbSource='Alpha', sRewardSignal='Alpha')
+    params['vProtocols'].append(feedback)
+    # feedback of mock file signals
+    mock = feedback.copy()
+    mock.update(sProtocolName='FBMock', sMockSignalFilePath='mock_experiment_data.h5')
+    params['vProtocols'].append(mock)
+    params['dAAIThresholdMean'] = 0.
+    return params
+
+
+def get_signals(params):
+    # as in Experiment.restart
+    signals = [DerivedSignal.from_params(ind, FS, len(CHANNELS), CHANNELS, signal) for ind, signal in
+               enumerate(params['vSignals']['DerivedSignal'])]
+    signals += [CompositeSignal(list(signals), signal['sExpression'], signal['sSignalName'], ind + len(signals), FS)
+                for ind, signal in enumerate(params['vSignals']['CompositeSignal'])]
+    return signals
+
+
+def record_experiment(file_path, params, rng, protocols=('Baseline', 'FB', 'FB')):
+    """
+    Record experiment_data.h5 as Experiment does: raw chunks of random size are processed by signals, descaled
+    signals, reward score and chunk sizes are recorded, signals stats are saved at the end of each protocol, reward
+    threshold is baseline corrected if bUseBCThreshold, reward of mock protocol is scored by mock signal
+    """
+    signals = get_signals(params)
+    bank = SpatialFilterBank(signals)
+    save_xml_str_to_hdf5_dataset(file_path, params_to_xml(params), 'settings.xml')
+    save_channels_and_fs(file_path, CHANNELS, FS)
+    save_signals(file_path, signals, 'protocol0')
+    writer = HDF5StreamWriter(file_path, {'raw_data': (len(CHANNELS), ), 'signals_data': (len(signals), ),
+                                          'reward_data': ()}, events_names=['chunk_data'])
+    reward = Reward(0, threshold=params['dAAIThresholdMean'], rate_of_increase=params['fRewardPeriodS'], fs=FS)
+    n_chunks = []
+    for number, name in enumerate(protocols, 1):
+        reward.set_enabled(name != 'Baseline')
+        raw = rng.standard_normal((FS * 4, len(CHANNELS)))
+        recorded_signals = np.zeros((len(raw), len(signals)))
+        recorded_reward = np.zeros(len(raw))
+        chunk_recorder = EventRecorder(len(raw))
+        start = 0
+        n_chunks.append(0)
+        while start < len(raw):
+            stop = min(start + int(rng.integers(1, 17)), len(raw))
+            chunk = raw[start:stop]
+            bank.update(chunk)
+            for i, signal in enumerate(signals):
+                if not isinstance(signal, DerivedSignal):
+                    signal.update(chunk)
+                recorded_signals[start:stop, i] = signal.current_chunk
+            chunk_recorder[start:stop] = 0
+            chunk_recorder[stop - 1] = len(chunk)
+            recorded_reward[start:stop] = reward.get_score()
+            reward.update(rng.standard_normal() if name == 'FBMock' else recorded_signals[stop - 1, 0], len(chunk))
+            n_chunks[-1] += 1
+            start = stop
+        if name == 'Baseline' and params['bUseBCThreshold']:
+            reward.threshold = np.median(recorded_signals[:, 0]) + params['dBCThresholdAdd']
+        recorded_signals = np.array([s.descale_recording(x) for s, x in zip(signals, recorded_signals.T)]).T
+        writer.append('protocol{}'.format(number), events={'chunk_data': chunk_recorder.events()}, raw_data=raw,
+                      signals_data=recorded_signals, reward_data=recorded_reward)
+        if name == 'Baseline':
+            # signals statistics are updated after baseline
+            for signal in signals:
+                signal.mean, signal.std, signal.scaling_flag = 0.1, 2., True
+        writer.close_group('protocol{}'.format(number), signals, protocol_name=name)
+    writer.stop()
+    return n_chunks
+
+
+def test_replay_reproduces_recorded_signals_and_reward(tmp_path):
+    file_path = str(tmp_path / 'experiment_data.h5')
+    n_chunks = record_experiment(file_path, get_params(), np.random.default_rng(0))
+    replay = ExperimentReplay(file_path)
+    results = replay.run(verbose=False)
+    replay.close()
+    assert [result.name for result in results] == ['Baseline', 'FB', 'FB']
+    assert [result.n_chunks for result in results] == n_chunks
+    assert results[0].reward_error is None and results[1].reward_error == 0
+    for result in results:
+        assert result.passed, result
+        assert max(result.signals_errors.values()) < 1e-9
+    assert replay.clock.time() == 12
+
+
+def test_replay_baseline_corrected_threshold(tmp_path):
+    file_path = str(tmp_path / 'experiment_data.h5')
+    params = get_params()
+    params.update(bUseBCThreshold=1, dBCThresholdAdd=0.05)
+    # gabor feedback
+    for protocol in params['vProtocols'][1:]:
+        protocol['iRandomBound'] = 3
+    record_experiment(file_path, params, np.random.default_rng(1), protocols=['Baseline', 'FB', 'FB', 'FBMock'])
+    replay = ExperimentReplay(file_path)
+    results = replay.run(verbose=False)
+    assert replay.mean_reward_signal != 0 and replay.reward.threshold == replay.mean_reward_signal + 0.05
+    replay.close()
+    # reward of mock file protocol is not checked
+    assert [result.reward_error for result in results[1:]] == [0, 0, None]
+    assert all(result.passed for result in results)
+    # the same recording doesn't match settings threshold
+    replay = ExperimentReplay(file_path, reward_threshold=params['dAAIThresholdMean'])
+    results = replay.run(verbose=False)
+    replay.close()
+    assert results[1].reward_error > 0 and not results[1].passed
@@ -0,0 +1,109 @@
+import os
+
+import mne
+import numpy as np
+import pytest
+
+from pynfb.helpers import roi_spatial_filter
+from pynfb.helpers.roi_spatial_filter import get_filter, get_label_filters, normalize_filters, \
+    get_roi_filter_from_bank, get_roi_filter_bank, get_roi_filter
+from pynfb.signal_processing.filters import SpatialRejection
+from pynfb.signals import DerivedSignal, SpatialFilterBank
+
+SUBJECTS_DIR = mne.get_config('SUBJECTS_DIR')
+HAS_FSAVERAGE = SUBJECTS_DIR is not None and os.path.isfile(
+    os.path.join(SUBJECTS_DIR, 'fsaverage', 'bem', 'fsaverage-5120-5120-5120-bem-sol.fif'))
+CHANNELS = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'T7', 'C3', 'Cz', 'C4', 'T8', 'P7', 'P3', 'Pz', 'P4', 'P8',
+            'O1', 'O2']
+
+
+def get_source_space(rng, n_vertices=40, n_used=30):
+    # two hemispheres with random normals, a part of vertices is used in source space
+    return [{'vertno': np.sort(rng.choice(n_vertices, n_used, replace=False)),
+             'nn': rng.standard_normal((n_vertices, 3))} for _hemi in range(2)]
+
+
+def test_label_filters_match_single_label_filters():
+    rng = np.random.default_rng(0)
+    src = get_source_space(rng)
+    vertno = [hemi['vertno'] for hemi in src]
+    n_sources = sum(len(v) for v in vertno)
+    K = rng.standard_normal((n_sources, 16))
+    noise_norm = rng.uniform(0.5, 2, (n_sources, 1))
+    labels = [mne.Label(np.sort(rng.choice(40, 12, replace=False)), hemi=hemi, name='label{}-{}'.format(k, hemi))
+              for k in range(3) for hemi in ['lh', 'rh']]
+
+    filters, used_labels = get_label_filters(K, noise_norm, vertno, src, labels)
+    assert filters.shape == (len(labels), K.shape[1])
+    assert used_labels == labels
+
+    for label, bank_filter in zip(labels, filters):
+        # kernel restricted to label vertices as assembled for single label
+        hemi = 0 if label.hemi == 'lh' else 1
+        label_vertno = [np.intersect1d(vertno[0], label.vertices) if hemi == 0 else np.array([], int),
+                        np.intersect1d(vertno[1], label.vertices) if hemi == 1 else np.array([], int)]
+        rows = np.searchsorted(vertno[hemi], label_vertno[hemi]) + hemi * len(vertno[0])
+        w = get_filter(K[rows], label_vertno, {'src': src}, label, noise_norm[rows])
+        np.testing.assert_allclose(bank_filter, normalize_filters(w))
+
+
+def test_label_filters_skip_labels_out_of_source_space():
+    rng = np.random.default_rng(1)
+    src = get_source_space(rng)
+    vertno = [hemi['vertno'] for hemi in src]
+    K = rng.standard_normal((sum(len(v) for v in vertno), 8))
+    unused = np.setdiff1d(np.arange(40), vertno[0])
+    labels = [mne.Label(unused, hemi='lh', name='empty-lh'), mne.Label(vertno[1][:5], hemi='rh', name='used-rh')]
+    filters, used_labels = get_label_filters(K, None, vertno, src, labels)
+    assert [label.name for label in used_labels] == ['used-rh']
+    assert filters.shape == (1, 8)
+
+
+def test_roi_filter_bank_cache(tmp_path, monkeypatch):
+    rng = np.random.default_rng(2)
+    filters = normalize_filters(rng.standard_normal((3, len(CHANNELS))))
+    calls = []
+
+    def get_bank(fs, channels, parc='aparc', method='sLORETA', lambda2=1):
+        calls.append(list(channels))
+        return filters, ['a-lh', 'b-lh', 'c-rh']
+
+    monkeypatch.setattr(roi_spatial_filter, 'get_roi_filter_bank', get_bank)
+    np.testing.assert_allclose(get_roi_filter_from_bank('b-lh', 500, CHANNELS, cache_dir=str(tmp_path)), filters[1])
+    assert os.listdir(str(tmp_path)) == ['roi_filters_aparc_sLORETA_1.h5']
+    # next lookups are rows of stored matrix
+    np.testing.assert_allclose(get_roi_filter_from_bank(['c-rh'], 500, CHANNELS, cache_dir=str(tmp_path)),
+                               filters[2])
+    assert len(calls) == 1
+    # matrix of other channels is recomputed
+    get_roi_filter_from_bank('a-lh', 500, CHANNELS[:-1], cache_dir=str(tmp_path))
+    assert len(calls) == 2
+
+
+def get_signals(n_signals, n_channels, rng):
+    return [DerivedSignal(ind, 500, n_channels, spatial_filter=rng.standard_normal(n_channels),
+                          estimator_type='identity', name='s{}'.format(ind)) for ind in range(n_signals)]
+
+
+def test_spatial_filter_bank_matches_signals_filters():
+    rng = np.random.default_rng(3)
+    n_channels = len(CHANNELS)
+    signals = get_signals(5, n_channels, rng)
+    bank = SpatialFilterBank(signals)
+    chunk = rng.standard_normal((20, n_channels))
+    np.testing.assert_allclose(bank.apply(chunk), np.array([np.dot(chunk, s.spatial_matrix) for s in signals]).T)
+
+    # spatial filter update is applied by the next chunk
+    signals[2].update_spatial_filter(rng.standard_normal(n_channels))
+    signals[4].update_ica_rejection(SpatialRejection(np.eye(n_channels)[:, ::-1], type_str='ica'))
+    bank.update(chunk)
+    for signal in signals:
+        np.testing.assert_allclose(signal.current_chunk, np.dot(chunk, signal.spatial_matrix))
+
+
+@pytest.mark.skipif(not HAS_FSAVERAGE, reason='fsaverage is not downloaded')
+def test_roi_filter_bank_matches_roi_filters():
+    filters, labels = get_roi_filter_bank(500, CHANNELS)
+    for label in ['precentral-lh', 'posteriorcingulate-rh']:
+        np.testing.assert_allclose(filters[labels.index(label)], get_roi_filter(label, 500, list(CHANNELS)),
+                                   atol=1e-10)
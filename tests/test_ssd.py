@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pynfb.protocols.ssd.ssd import CrossSpectrumAccumulator, BandCovariances, ssd, ssd_sweep, get_sweep_bands
+from pynfb.widgets.update_signals_dialog import SignalsSSDManager
+
+FS = 250
+N_CHANNELS = 6
+
+
+def get_data(rng, duration=60, freq=11):
+    """
+    Noise with oscillation source of freq Hz mixed into channels
+    :return: data and source topography
+    """
+    t = np.arange(FS * duration) / FS
+    topography = rng.standard_normal(N_CHANNELS)
+    source = np.sin(2 * np.pi * freq * t + rng.uniform(0, 0.1) * np.cumsum(rng.standard_normal(len(t))) / FS ** 0.5)
+    x = rng.standard_normal((len(t), N_CHANNELS)) + 3 * source[:, None] * topography
+    return x, topography
+
+
+def test_accumulator_stream_equals_batch():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((FS * 20 + 77, N_CHANNELS))
+    batch = CrossSpectrumAccumulator(FS, N_CHANNELS, max_freq=40).add(x, batch_size=5)
+    stream = CrossSpectrumAccumulator(FS, N_CHANNELS, max_freq=40)
+    start = 0
+    while start < len(x):
+        stop = start + int(rng.integers(1, 300))
+        stream.update(x[start:stop])
+        start = stop
+    assert stream.n_segments == batch.n_segments > 0
+    np.testing.assert_allclose(stream.get_csd(), batch.get_csd(), rtol=1e-10, atol=1e-14)
+    assert batch.freqs[-1] >= 40 and batch.max_freq == batch.freqs[-1]
+
+
+def test_band_covariances_traces():
+    rng = np.random.default_rng(1)
+    x, topography = get_data(rng, freq=10)
+    covariances = BandCovariances(x, FS)
+    # full band covariance equals data covariance
+    assert covariances.max_freq == FS / 2
+    np.testing.assert_allclose(np.trace(covariances((0, FS / 2))), np.trace(np.cov(x.T)), rtol=0.02)
+    # oscillation band contains source power (9 / 2 * topography energy) and a part of noise
+    band_trace = np.trace(covariances((8, 12)))
+    noise_trace = N_CHANNELS * 4 / (FS / 2)
+    np.testing.assert_allclose(band_trace, 4.5 * np.sum(topography ** 2) + noise_trace, rtol=0.05)
+    # bands are additive
+    np.testing.assert_allclose(covariances((8, 10)) + covariances((10, 12)), covariances((8, 12)))
+    # covariances of transformed data
+    matrix = rng.standard_normal((N_CHANNELS, 2))
+    np.testing.assert_allclose(covariances.transform(matrix)((8, 12)), matrix.T.dot(covariances((8, 12))).dot(matrix))
+    with pytest.raises(ValueError):
+        BandCovariances(x, FS, max_freq=30)((20, 40))
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_sweep_peak_equals_filtfilt_ssd(n_jobs):
+    rng = np.random.default_rng(2)
+    x, _topography = get_data(rng, freq=11)
+    freqs = np.arange(6, 18)
+    results = sorted(ssd_sweep(x, FS, freqs, n_jobs=n_jobs), key=lambda result: result[0])
+    assert [result[0] for result in results] == list(range(len(freqs)))
+    sweep_vals = np.array([result[1][0] for result in results])
+    ssd_vals = np.array([ssd(x, FS, bands)[0][0] for bands in get_sweep_bands(freqs)])
+    assert freqs[np.argmax(sweep_vals)] == freqs[np.argmax(ssd_vals)] == 11
+
+
+def get_protocols_accumulators(rng, n_protocols=3):
+    # accumulators of protocols as in Experiment (different power of protocols data)
+    data = [rng.standard_normal((FS * (30 + 10 * k), N_CHANNELS)) * (k + 1) for k in range(n_protocols)]
+    accumulators = []
+    for x in data:
+        accumulator = CrossSpectrumAccumulator(FS, N_CHANNELS, max_freq=40)
+        for start in range(0, len(x), 20):
+            accumulator.update(x[start:start + 20])
+        accumulators.append(accumulator.finish())
+    return data, accumulators
+
+
+def test_band_covariances_from_accumulators():
+    rng = np.random.default_rng(3)
+    data, accumulators = get_protocols_accumulators(rng)
+    # the same as segments of both protocols in one accumulator
+    joint = CrossSpectrumAccumulator(FS, N_CHANNELS, max_freq=40).add(data[0]).add(data[2])
+    covariances = BandCovariances.from_accumulators([accumulators[0], accumulators[2]])
+    np.testing.assert_allclose(covariances((8, 12)), BandCovariances.from_accumulators([joint])((8, 12)), rtol=1e-5)
+    assert covariances.max_freq == joint.max_freq
+    # finished accumulator keeps float32 sum
+    assert accumulators[0].csd_sum.dtype == np.float32 and accumulators[0].buffer is None
+    matrix = rng.standard_normal((N_CHANNELS, 3))
+    np.testing.assert_allclose(covariances.transform(matrix)((4, 30)),
+                               matrix.T.dot(covariances((4, 30))).dot(matrix), rtol=1e-10)
+
+
+def test_ssd_manager_covariances_of_checked_protocols():
+    rng = np.random.default_rng(4)
+    data, accumulators = get_protocols_accumulators(rng)
+    manager = SimpleNamespace(csd=accumulators)
+    matrix = np.eye(N_CHANNELS)[:, :4]
+    for protocols in [[0], [1], [0, 2]]:
+        covariances = SignalsSSDManager.get_covariances(manager, protocols, matrix)
+        np.testing.assert_array_equal(covariances((1, 40)), BandCovariances.from_accumulators(
+            [accumulators[k] for k in protocols])((1, 40))[:4, :4])
+        # protocols data variance is (k + 1) ** 2, cross-spectra are weighted by protocols durations
+        variance = sum((k + 1) ** 2 * len(data[k]) for k in protocols) / sum(len(data[k]) for k in protocols)
+        np.testing.assert_allclose(np.mean(np.diag(covariances((1, 40)))), variance * 39 / (FS / 2), rtol=0.05)
+    # no cross-spectra of protocol or recording
+    assert SignalsSSDManager.get_covariances(manager, [3], matrix) is None
+    assert SignalsSSDManager.get_covariances(manager, [], matrix) is None
+    assert SignalsSSDManager.get_covariances(SimpleNamespace(csd=None), [0], matrix) is None
@@ -1,5 +1,11 @@
-from pynfb.serializers.xml_ import *
+from pynfb.serializers.xml_ import xml_file_to_params, params_to_xml_file, params_to_xml
 
-odict = read_xml_to_dict('pynfb/serializers/settings/pilot.xml')
-print(odict)
-write_dict_to_xml(odict, 'tests/test.xml')
\ No newline at end of file
+DESIGN = 'tests/designs/alpha_nfb_settings.xml'
+
+
+def test_params_xml_round_trip(tmp_path):
+    params = xml_file_to_params(DESIGN)
+    file_path = str(tmp_path / 'design.xml')
+    params_to_xml_file(params, file_path)
+    # compared as xml: string defaults (e.g. '0') are parsed to numbers when read back
+    assert params_to_xml(xml_file_to_params(file_path)) == params_to_xml(params)
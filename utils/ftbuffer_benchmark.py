@@ -0,0 +1,101 @@
+"""
+Benchmark of FieldTrip buffer inlet vs. LSL inlet on one machine: synthetic stream is sent through local FieldTrip
+buffer server emulator (pynfb.inlets.ftbuffer_server) and through LSL outlet, and pulled by FieldTripBufferInlet and
+LSLInlet. The first channel of sent samples holds send time, so latency is receive time minus send time of the last
+sample of each pulled chunk. CPU time includes server and generators threads running in the same process.
+
+Usage:
+    python ftbuffer_benchmark.py [--n-channels 64] [--fs 1000] [--chunk-len 10] [--duration 10] [--tick 0.01]
+    [--wait 100]
+"""
+import argparse
+import threading
+from time import perf_counter, sleep, process_time
+
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet
+
+from pynfb.inlets.ftbuffer_server import FieldTripBufferServer, run_ftbuffer_generator
+from pynfb.inlets.ftbuffer_inlet import FieldTripBufferInlet
+from pynfb.inlets.lsl_inlet import LSLInlet
+
+
+def run_lsl_generator(name, n_channels, fs, chunk_len, stop_event):
+    info = StreamInfo(name=name, type='EEG', channel_count=n_channels, nominal_srate=fs, channel_format='double64',
+                      source_id=name)
+    outlet = StreamOutlet(info, chunk_size=chunk_len)
+    chunk = np.random.randn(chunk_len, n_channels)
+    n_sent = 0
+    start = perf_counter()
+    while not stop_event.is_set():
+        n_required = int((perf_counter() - start) * fs)
+        while n_sent + chunk_len <= n_required:
+            chunk[:, 0] = perf_counter()
+            outlet.push_chunk(chunk)
+            n_sent += chunk_len
+        sleep(chunk_len / fs / 4)
+
+
+def benchmark(inlet, duration, tick):
+    """
+    Pull inlet for duration [s] with pause tick [s] between pulls (tick=0 for blocking inlets)
+    :return: samples/s, median and 99% latency [ms], CPU [%]
+    """
+    # skip samples accumulated before start (blocking inlet never returns empty chunk while data is streamed)
+    for _ in range(100):
+        if inlet.get_next_chunk()[0] is None:
+            break
+    latencies = []
+    n_samples = 0
+    cpu_start = process_time()
+    start = perf_counter()
+    while perf_counter() - start < duration:
+        chunk, timestamp = inlet.get_next_chunk()
+        if chunk is not None:
+            latencies.append(perf_counter() - chunk[-1, 0])
+            n_samples += len(chunk)
+        if tick > 0:
+            sleep(tick)
+    cpu_time = process_time() - cpu_start
+    latencies = np.array(latencies) * 1000
+    return n_samples / duration, np.median(latencies), np.percentile(latencies, 99), cpu_time / duration * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FieldTrip buffer inlet vs. LSL inlet benchmark')
+    parser.add_argument('--n-channels', type=int, default=64)
+    parser.add_argument('--fs', type=float, default=1000)
+    parser.add_argument('--chunk-len', type=int, default=10, help='samples per sent chunk')
+    parser.add_argument('--duration', type=float, default=10, help='duration of each benchmark [s]')
+    parser.add_argument('--tick', type=float, default=0.01, help='pause between pulls (timer period) [s]')
+    parser.add_argument('--wait', type=int, default=100, help='FieldTrip WAIT_DAT timeout of blocking inlet [ms]')
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+    server = FieldTripBufferServer(port=0).start_in_a_thread()
+    threading.Thread(target=run_ftbuffer_generator, daemon=True,
+                     kwargs=dict(port=server.port, n_channels=args.n_channels, fs=args.fs, chunk_len=args.chunk_len,
+                                 dtype='float64', stop_event=stop_event, time_channel=True)).start()
+    name = 'nfb_ftbuffer_benchmark'
+    threading.Thread(target=run_lsl_generator, args=(name, args.n_channels, args.fs, args.chunk_len, stop_event),
+                     daemon=True).start()
+    sleep(0.5)
+
+    print('{} channels x {} Hz, chunks of {} samples, {} s per inlet'.format(args.n_channels, args.fs,
+                                                                           args.chunk_len, args.duration))
+    print('{:<36}{:>12}{:>18}{:>15}{:>8}'.format('inlet', 'samples/s', 'median latency ms', '99% latency ms',
+                                                  'CPU %'))
+    inlets = [('LSL, timer {} s'.format(args.tick), LSLInlet(name), args.tick),
+              ('FieldTrip, timer {} s'.format(args.tick), FieldTripBufferInlet(port=server.port), args.tick),
+              ('FieldTrip, blocking WAIT_DAT', FieldTripBufferInlet(port=server.port, wait_timeout=args.wait),
+               0)]
+    for inlet_name, inlet, tick in inlets:
+        rate, median, p99, cpu = benchmark(inlet, args.duration, tick)
+        print('{:<36}{:>12.0f}{:>18.2f}{:>15.2f}{:>8.1f}'.format(inlet_name, rate, median, p99, cpu))
+        inlet.disconnect()
+    stop_event.set()
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmark of HDF5 storage policies (codec, level, shuffle, chunk size) for experiment_data.h5 datasets.
+Measures write throughput (chunked appends as HDF5StreamWriter does), read throughput and compression ratio for raw,
+signals and markers data (simulated or taken from recorded experiment file) and reports which policy to use for
+sRawStorage, sSignalsStorage and sMarkersStorage settings.
+
+Usage:
+    python hdf5_storage_benchmark.py [--file results/.../experiment_data.h5] [--duration 60] [--n-channels 32]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+import h5py
+import numpy as np
+
+from pynfb.serializers.hdf5 import StoragePolicy, load_h5py_all_samples, load_channels_and_fs
+
+CANDIDATES = ['none', 'lzf', 'lzf shuffle', 'gzip:1', 'gzip:1 shuffle', 'gzip:4 shuffle', 'gzip:6 shuffle',
+              'zstd:3 shuffle', 'lz4 shuffle', 'blosc-lz4 shuffle', 'blosc-zstd:3 shuffle']
+CHUNKS_N_BYTES = [2 ** 14, 2 ** 16, 2 ** 18]
+
+
+def simulate_raw(n_samples, n_channels, fs, resolution=0.1, seed=0):
+    """
+    EEG-like data: 1/f background, 10 Hz alpha bursts and 50 Hz line noise quantized with amplifier resolution [uV]
+    """
+    rng = np.random.RandomState(seed)
+    freqs = np.fft.rfftfreq(n_samples, 1 / fs)
+    spectrum = (rng.randn(len(freqs), n_channels) + 1j * rng.randn(len(freqs), n_channels))
+    spectrum /= np.maximum(freqs, 1)[:, None] ** 0.5
+    x = np.fft.irfft(spectrum, n_samples, axis=0)
+    x *= 10 / x.std()
+    t = np.arange(n_samples) / fs
+    alpha = np.sin(2 * np.pi * 10 * t) * (np.sin(2 * np.pi * 0.1 * t) > 0)
+    x += 5 * alpha[:, None] * rng.rand(n_channels) + 2 * np.sin(2 * np.pi * 50 * t)[:, None]
+    return np.round(x / resolution) * resolution
+
+
+def simulate_signals(raw, n_signals=3, smoothing=0.99):
+    """
+    Envelope-like smooth signals
+    """
+    x = np.abs(raw[:, :n_signals])
+    y = np.empty_like(x)
+    y[0] = x[0]
+    for k in range(1, len(x)):
+        y[k] = smoothing * y[k - 1] + (1 - smoothing) * x[k]
+    return y
+
+
+def simulate_markers(n_samples, fs, rate=1.):
+    """
+    (sample_index, value) events table with events at given rate [Hz]
+    """
+    indices = np.sort(np.random.RandomState(1).choice(n_samples, int(n_samples / fs * rate), replace=False))
+    return np.column_stack([indices, np.random.RandomState(2).randint(0, 5, len(indices))]).astype('float64')
+
+
+def load_markers(file_path):
+    """
+    (sample_index, value) events tables of all protocols of experiment_data.h5 concatenated with all samples indices
+    """
+    tables, n_samples = [], 0
+    with h5py.File(file_path, 'r') as f:
+        for j in range(len([k for k in f.keys() if k.startswith('protocol')])):
+            group = f['protocol{}'.format(j + 1)]
+            if 'events' in group:
+                for name in group['events']:
+                    table = group['events/' + name][:]
+                    tables.append(table + [n_samples, 0])
+                n_samples += group['events'].attrs['n_samples']
+            else:
+                n_samples += len(group['raw_data'])
+    if not tables:
+        raise ValueError('No events tables in {}'.format(file_path))
+    return np.vstack(tables)
+
+
+def benchmark_policy(data, policy, chunk_len, n_repeats=3):
+    """
+    Write data by chunk_len samples chunks to resizable dataset, then read it back
+    :return: write throughput [MB/s], read throughput [MB/s], compression ratio
+    """
+    write_times, read_times = [], []
+    fd, file_path = tempfile.mkstemp(suffix='.h5')
+    os.close(fd)
+    try:
+        for _ in range(n_repeats):
+            start = perf_counter()
+            with h5py.File(file_path, 'w') as f:
+                dataset = f.create_dataset('data', shape=(0, ) + data.shape[1:], maxshape=(None, ) + data.shape[1:],
+                                           dtype=data.dtype, **policy.dataset_kwargs(data.shape[1:], data.dtype))
+                for k in range(0, len(data), chunk_len):
+                    chunk = data[k:k + chunk_len]
+                    dataset.resize(k + len(chunk), axis=0)
+                    dataset[k:] = chunk
+                storage_size = dataset.id.get_storage_size()
+            write_times.append(perf_counter() - start)
+            start = perf_counter()
+            with h5py.File(file_path, 'r') as f:
+                f['data'][:]
+            read_times.append(perf_counter() - start)
+    finally:
+        os.remove(file_path)
+    mb = data.nbytes / 2 ** 20
+    return mb / min(write_times), mb / min(read_times), data.nbytes / max(storage_size, 1)
+
+
+def run_benchmark(data, chunk_len, candidates=CANDIDATES, chunks_n_bytes=CHUNKS_N_BYTES, ratio_tolerance=0.9):
+    """
+    Benchmark all available candidate policies and print results table
+    :return: recommended policy: the fastest writer among policies within ratio_tolerance of the best ratio
+    """
+    results = []
+    for string in candidates:
+        for chunk_n_bytes in chunks_n_bytes:
+            policy = StoragePolicy.from_str('{} chunk={}'.format(string, chunk_n_bytes))
+            try:
+                results.append((policy, ) + benchmark_policy(data, policy, chunk_len))
+            except (ImportError, ValueError) as e:
+                print('{:<36} skipped: {}'.format(str(policy), e))
+                break
+    print('{:<36}{:>14}{:>14}{:>8}'.format('policy', 'write MB/s', 'read MB/s', 'ratio'))
+    for policy, write, read, ratio in results:
+        print('{:<36}{:>14.1f}{:>14.1f}{:>8.2f}'.format(str(policy), write, read, ratio))
+    best_ratio = max(ratio for _, _, _, ratio in results)
+    return max([r for r in results if r[3] >= ratio_tolerance * best_ratio], key=lambda r: r[1])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HDF5 storage policies benchmark')
+    parser.add_argument('--file', default=None, help='experiment_data.h5 to take raw, signals and markers data from (simulated if None)')
+    parser.add_argument('--duration', type=float, default=60, help='simulated data duration [s]')
+    parser.add_argument('--n-channels', type=int, default=32, help='simulated data number of channels')
+    parser.add_argument('--fs', type=float, default=500, help='simulated data sampling frequency [Hz]')
+    parser.add_argument('--dtype', default='float64', help='recording dtype (see sRecorderDtype setting)')
+    args = parser.parse_args()
+
+    if args.file is not None:
+        raw = load_h5py_all_samples(args.file, raw=True)
+        fs = load_channels_and_fs(args.file)[1]
+        signals = load_h5py_all_samples(args.file, raw=False)
+        markers = load_markers(args.file)
+    else:
+        fs = args.fs
+        raw = simulate_raw(int(args.duration * fs), args.n_channels, fs)
+        signals = simulate_signals(raw)
+        markers = simulate_markers(len(raw), fs)
+    raw = raw.astype(args.dtype)
+    signals = signals.astype(args.dtype)
+    chunk_len = max(1, int(fs) // 10)
+
+    recommended = {}
+    for setting, data in [('sRawStorage', raw), ('sSignalsStorage', signals), ('sMarkersStorage', markers)]:
+        print('\n{}: {} samples x {}, {:.1f} MB'.format(setting, data.shape[0], data.shape[1:], data.nbytes / 2 ** 20))
+        recommended[setting] = run_benchmark(data, chunk_len if setting != 'sMarkersStorage' else 16)
+    print('\nRecommended settings:')
+    for setting, policy in recommended.items():
+        print('    {}: {}'.format(setting, policy))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,110 +1,49 @@
-import xml.etree.ElementTree as ET
-import h5py
 import pandas as pd
 import numpy as np
+from pynfb.serializers.hdf5 import has_protocol_dataset
+from pynfb.serializers.reader import ExperimentReader
 
 
-def _get_channels_and_fs(xml_str_or_file):
-    root = ET.fromstring(xml_str_or_file)
-    if root.find('desc').find('channels') is not None:
-        channels = [k.find('label').text for k in root.find('desc').find('channels').findall('channel')]
-    else:
-        channels = [k.find('name').text for k in root.find('desc').findall('channel')]
-    fs = int(root.find('nominal_srate').text)
-    return channels, fs
-
-
-def _get_signals_list(xml_str):
-    root = ET.fromstring(xml_str)
-    derived = [s.find('sSignalName').text for s in root.find('vSignals').findall('DerivedSignal')]
-    composite = []
-    if root.find('vSignals').findall('CompositeSignal')[0].find('sSignalName') is not None:
-        composite = [s.find('sSignalName').text for s in root.find('vSignals').findall('CompositeSignal')]
-    return derived + composite
-
-
-def _get_info(f):
-    if 'channels' in f:
-        channels = [ch.decode("utf-8")  for ch in f['channels'][:]]
-        fs = int(f['fs'][()])
-    else:
-        channels, fs = _get_channels_and_fs(f['stream_info.xml'][0])
-    signals = _get_signals_list(f['settings.xml'][0])
-    n_protocols = len([k for k in f.keys() if ('protocol' in k and k != 'protocol0')])
-    block_names = [f['protocol{}'.format(j+1)].attrs['name'] for j in range(n_protocols)]
-    return fs, channels, block_names, signals
+# optional protocols datasets and corresponding data frame columns
+OPTIONAL_DATASETS = [('reward_data', 'reward'), ('choice_data', 'choice'), ('answer_data', 'answer'),
+                     ('probe_data', 'probe'), ('chunk_data', 'chunk_n'), ('cue_data', 'cue'),
+                     ('posner_stim_data', 'posner_stim'), ('posner_stim_time', 'posner_time'),
+                     ('response_data', 'response_data')]
 
 
 def load_data(file_path):
-    with h5py.File(file_path) as f:
+    """
+    Load experiment_data.h5 to data frame: raw channels (named by 'channels' dataset, events stream channel is 'EVENTS'
+    column, aux streams channels follow it), 'signal_<name>' columns, events and other recorded datasets columns
+    :return: data frame, fs, channels, protocols names
+    """
+    with ExperimentReader(file_path) as reader:
         # load meta info
-        fs, channels, p_names, signals = _get_info(f)
+        fs, channels, signals = reader.fs, reader.channels, reader.signals
+        p_names = [info.name for info in reader.protocols]
 
         # load raw data
-        data = [f['protocol{}/raw_data'.format(k + 1)][:] for k in range(len(p_names))]
-        df = pd.DataFrame(np.concatenate(data), columns=channels)
+        df = pd.DataFrame(reader.session('raw_data')[:], columns=channels)
 
         # load signals data
-        signals_data = [f['protocol{}/signals_data'.format(k + 1)][:] for k in range(len(p_names))]
-        df_signals = pd.DataFrame(np.concatenate(signals_data), columns=['signal_'+s for s in signals])
+        df_signals = pd.DataFrame(reader.session('signals_data')[:], columns=['signal_'+s for s in signals])
         df = pd.concat([df, df_signals], axis=1)
 
         # load timestamps
         if 'timestamp' in df:
-            timestamp_data = [f['protocol{}/timestamp_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['timestamps'] = np.concatenate(timestamp_data)
+            df['timestamps'] = reader.session('timestamp_data')[:]
 
         # events data
-        events_data = [f['protocol{}/mark_data'.format(k + 1)][:] for k in range(len(p_names))]
-        df['events'] = np.concatenate(events_data)
-
-        # reward data
-        if 'protocol1/reward_data' in f:
-            reward_data = [f['protocol{}/reward_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['reward'] = np.concatenate(reward_data)
-
-        # participant response data
-        if 'protocol1/choice_data' in f:
-            choice_data = [f['protocol{}/choice_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['choice'] = np.concatenate(choice_data)
-
-        if 'protocol1/answer_data' in f:
-            answer_data = [f['protocol{}/answer_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['answer'] = np.concatenate(answer_data)
-
-        # Probe data
-        if 'protocol1/probe_data' in f:
-            probe_data = [f['protocol{}/probe_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['probe'] = np.concatenate(probe_data)
-
-        # Chunk data
-        if 'protocol1/chunk_data' in f:
-            chunk_data = [f['protocol{}/chunk_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['chunk_n'] = np.concatenate(chunk_data)
-
-        # Posner Cue data
-        if 'protocol1/cue_data' in f:
-            cue_data = [f['protocol{}/cue_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['cue'] = np.concatenate(cue_data)
-
-        # Posner stim data
-        if 'protocol1/posner_stim_data' in f:
-            posner_stim_data = [f['protocol{}/posner_stim_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['posner_stim'] = np.concatenate(posner_stim_data)
-
-        # Posner stim time
-        if 'protocol1/posner_stim_time' in f:
-            posner_stim_time = [f['protocol{}/posner_stim_time'.format(k + 1)][:] for k in range(len(p_names))]
-            df['posner_time'] = np.concatenate(posner_stim_time)
+        df['events'] = reader.session('mark_data')[:]
 
-        # response data
-        if 'protocol1/response_data' in f:
-            response_data = [f['protocol{}/response_data'.format(k + 1)][:] for k in range(len(p_names))]
-            df['response_data'] = np.concatenate(response_data)
+        # reward, participant response, probe, chunk, Posner cue and stimuli data
+        for name, column in OPTIONAL_DATASETS:
+            if has_protocol_dataset(reader.file['protocol1'], name):
+                df[column] = reader.session(name)[:]
 
         # set block names and numbers
-        df['block_name'] = np.concatenate([[p]*len(d) for p, d in zip(p_names, data)])
-        df['block_number'] = np.concatenate([[j + 1]*len(d) for j, d in enumerate(data)])
+        df['block_name'] = np.concatenate([[info.name] * (info.stop - info.start) for info in reader.protocols])
+        df['block_number'] = np.concatenate([[info.number] * (info.stop - info.start) for info in reader.protocols])
     return df, fs, channels, p_names
 
 
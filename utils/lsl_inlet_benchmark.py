@@ -0,0 +1,87 @@
+"""
+Benchmark of LSL inlet pulls: list-based pull_chunk + np.array conversion vs. zero-copy pull into preallocated buffer
+(pynfb.inlets.lsl_inlet.pull_chunk_into). Default stream: 128 channels x 2 kHz float32.
+
+Usage:
+    python lsl_inlet_benchmark.py [--n-channels 128] [--fs 2000] [--duration 10] [--tick 0.01]
+"""
+import argparse
+import threading
+from time import perf_counter, sleep, process_time
+
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet, StreamInlet, resolve_byprop, local_clock
+
+from pynfb.inlets.lsl_inlet import pull_chunk_into
+
+
+def run_outlet(name, n_channels, fs, stop_event, chunk_len=20):
+    info = StreamInfo(name=name, type='EEG', channel_count=n_channels, nominal_srate=fs, channel_format='float32',
+                      source_id=name)
+    outlet = StreamOutlet(info, chunk_size=chunk_len)
+    chunk = np.random.randn(chunk_len, n_channels).astype('float32')
+    n_pushed = 0
+    start = local_clock()
+    while not stop_event.is_set():
+        n_required = int((local_clock() - start) * fs)
+        while n_pushed + chunk_len <= n_required:
+            outlet.push_chunk(chunk)
+            n_pushed += chunk_len
+        sleep(chunk_len / fs / 4)
+
+
+def pull_lists(inlet, max_samples, buffer, timestamps):
+    chunk, timestamp = inlet.pull_chunk(max_samples=max_samples)
+    return np.array(chunk, dtype='float64').shape[0]
+
+
+def pull_into(inlet, max_samples, buffer, timestamps):
+    return pull_chunk_into(inlet, buffer, timestamps)
+
+
+def benchmark(inlet, pull, n_channels, duration, tick, max_samples):
+    buffer = np.zeros((max_samples, n_channels), dtype='float32')
+    timestamps = np.zeros(max_samples)
+    inlet.flush()
+    pull_times = []
+    n_samples = 0
+    cpu_start = process_time()
+    start = perf_counter()
+    while perf_counter() - start < duration:
+        t = perf_counter()
+        n = pull(inlet, max_samples, buffer, timestamps)
+        if n > 0:
+            pull_times.append(perf_counter() - t)
+            n_samples += n
+        sleep(tick)
+    cpu_time = process_time() - cpu_start
+    pull_times = np.array(pull_times) * 1e6
+    return n_samples / duration, np.median(pull_times), np.percentile(pull_times, 99), cpu_time / duration * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LSL inlet pull benchmark')
+    parser.add_argument('--n-channels', type=int, default=128)
+    parser.add_argument('--fs', type=float, default=2000)
+    parser.add_argument('--duration', type=float, default=10, help='duration of each benchmark [s]')
+    parser.add_argument('--tick', type=float, default=0.01, help='pause between pulls (timer period) [s]')
+    parser.add_argument('--max-chunklen', type=int, default=1024)
+    args = parser.parse_args()
+
+    name = 'nfb_inlet_benchmark'
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_outlet, args=(name, args.n_channels, args.fs, stop_event), daemon=True)
+    thread.start()
+    inlet = StreamInlet(resolve_byprop('name', name, timeout=10)[0], max_buflen=2)
+    inlet.open_stream()
+    print('{} channels x {} Hz, {} s per method'.format(args.n_channels, args.fs, args.duration))
+    print('{:<28}{:>14}{:>16}{:>16}{:>10}'.format('method', 'samples/s', 'median pull us', '99% pull us', 'CPU %'))
+    for method_name, pull in [('pull_chunk + np.array', pull_lists), ('pull_chunk_into', pull_into)]:
+        rate, median, p99, cpu = benchmark(inlet, pull, args.n_channels, args.duration, args.tick, args.max_chunklen)
+        print('{:<28}{:>14.0f}{:>16.1f}{:>16.1f}{:>10.1f}'.format(method_name, rate, median, p99, cpu))
+    stop_event.set()
+    thread.join()
+
+
+if __name__ == '__main__':
+    main()
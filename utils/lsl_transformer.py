@@ -18,7 +18,7 @@ class LSLTransformer:
         inlet_chunk, input_timestamps = self.inlet.get_next_chunk()
         if inlet_chunk is not None:
             output_chunk = self.transform(inlet_chunk)
-            self.outlet.push_chunk(output_chunk.T.tolist())
+            self.outlet.push_chunk(output_chunk.T)
 
     def transform(self, x):
         return x**2